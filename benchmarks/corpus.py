@@ -0,0 +1,78 @@
+# Synthetic corpora for benchmarks.
+#
+# Every file holds random bytes, so every file has a different sha1 (and none
+# is skipped as a duplicate). Generating the same corpus twice gives the same
+# bytes: each generator seeds its own random.Random.
+
+import csv
+import os
+import random
+
+def _write_random_file(path, n_bytes, rng, chunk_size=1024 * 1024):
+    with open(path, 'wb') as f:
+        remaining = n_bytes
+        while remaining > 0:
+            n = min(chunk_size, remaining)
+            f.write(rng.getrandbits(n * 8).to_bytes(n, 'little'))
+            remaining -= n
+
+def generate_tiny_files(dirname, n_files=2000, n_bytes=4096, seed=1):
+    """Write n_files small files into one directory (the "millions of
+    emails" case: per-file overhead dominates)."""
+    rng = random.Random(seed)
+    os.makedirs(dirname, exist_ok=True)
+    for i in range(n_files):
+        _write_random_file(os.path.join(dirname, 'tiny-{:07d}.pdf'.format(i)), n_bytes, rng)
+
+def generate_huge_files(dirname, n_files=3, n_bytes=64 * 1024 * 1024, seed=2):
+    """Write a few big files (the "scanned archive" case: throughput
+    dominates)."""
+    rng = random.Random(seed)
+    os.makedirs(dirname, exist_ok=True)
+    for i in range(n_files):
+        _write_random_file(os.path.join(dirname, 'huge-{:03d}.pdf'.format(i)), n_bytes, rng)
+
+def generate_deep_tree(dirname, depth=6, fanout=3, files_per_directory=2, n_bytes=2048, seed=3):
+    """Write a tree ``depth`` directories deep, with ``fanout``
+    subdirectories in each (the "file share" case: walking dominates)."""
+    rng = random.Random(seed)
+
+    def generate(directory, level):
+        os.makedirs(directory, exist_ok=True)
+        for i in range(files_per_directory):
+            _write_random_file(os.path.join(directory, 'doc-{}.pdf'.format(i)), n_bytes, rng)
+        if level < depth:
+            for i in range(fanout):
+                generate(os.path.join(directory, 'd{}'.format(i)), level + 1)
+
+    generate(dirname, 1)
+
+def generate_csv(csv_path, files_dirname, url_prefix=None, n_metadata_fields=3):
+    """Write a CSV listing every file in files_dirname, with metadata.
+
+    Columns are ``title``, ``path`` (absolute), ``url`` (if url_prefix is
+    set: url_prefix plus the path relative to files_dirname's parent) and
+    ``field0``, ``field1``...
+
+    :return: the number of rows.
+    """
+    parent = os.path.dirname(os.path.abspath(files_dirname))
+    fieldnames = [ 'title', 'path' ]
+    if url_prefix is not None:
+        fieldnames.append('url')
+    fieldnames.extend('field{}'.format(i) for i in range(n_metadata_fields))
+
+    n_rows = 0
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames)
+        writer.writeheader()
+        for name in sorted(os.listdir(files_dirname)):
+            path = os.path.join(os.path.abspath(files_dirname), name)
+            row = { 'title': name, 'path': path }
+            if url_prefix is not None:
+                row['url'] = url_prefix + os.path.relpath(path, parent).replace(os.sep, '/')
+            for i in range(n_metadata_fields):
+                row['field{}'.format(i)] = 'value {} of {}'.format(i, name)
+            writer.writerow(row)
+            n_rows += 1
+    return n_rows
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+#
+# A stand-in for the parts of Overview's API that overview_upload uses, for
+# benchmarks and tests. It keeps everything in memory and throws uploaded
+# bytes away.
+#
+# Run it alone to point the command-line tools at it:
+#
+#     python3 benchmarks/fake_overview.py --port 9000 --latency 0.02
+
+import argparse
+import collections
+import hashlib
+import http.server
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+
+ChunkSize = 64 * 1024
+
+class _Throttle:
+    """Shares a bandwidth limit among all connections, like one network link."""
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._next_free_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, n_bytes):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            start = max(time.time(), self._next_free_at)
+            self._next_free_at = start + n_bytes / self.bytes_per_second
+            end = self._next_free_at
+        delay = end - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+class _DecodingHasher:
+    """Hashes a compressed body's original bytes, as a decompressing
+    proxy would pass them on."""
+
+    def __init__(self, sha1, encoding):
+        self.sha1 = sha1
+        if encoding == 'gzip':
+            self._decompressobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            import zstandard
+            self._decompressobj = zstandard.ZstdDecompressor().decompressobj()
+        self.n_bytes = 0
+
+    def update(self, chunk):
+        data = self._decompressobj.decompress(chunk)
+        self.n_bytes += len(data)
+        self.sha1.update(data)
+
+class FakeOverviewServer:
+    """Overview's upload API, in a background thread.
+
+    It implements:
+
+    * ``POST /api/v1/files/{uuid}``: reads (and hashes) the file.
+    * ``DELETE /api/v1/files``: forgets files that were not finished.
+    * ``POST /api/v1/files/finish``: adds uploaded files to the document set.
+    * ``HEAD /api/v1/document-sets/files/{sha1}``: 204 if the document set
+      has a file with that sha1, 404 otherwise.
+    * ``POST /api/v1/document-sets``: returns a new ID and API token.
+    * ``GET /corpus/{path}``: a file from ``corpus_dir``, with
+      Content-Length and an MD5 ETag (as S3 sends), for CSVs of URLs.
+
+    Like a decompressing proxy, it accepts uploads with a Content-Encoding
+    in ``accept_encodings``, and hashes their original bytes. It answers
+    other encodings with 415.
+
+    :param float latency: seconds to wait before answering each request.
+    :param int bandwidth: bytes per second shared by all uploads and
+        downloads, or ``None`` for no limit.
+    :param str corpus_dir: directory ``GET /corpus/`` serves from.
+    :param int max_concurrent_uploads: answer file uploads beyond this many
+        at once with 503 and ``Retry-After: 1``, like an overloaded
+        server; or ``None`` for no limit.
+    :param tuple accept_encodings: Content-Encodings to accept on uploads:
+        ``"gzip"`` and ``"zstd"`` (which needs the zstandard package).
+    :param int fail_uploads: answer this many file uploads (the first ones
+        after each ``reset()``) with 502, after reading them, like a flaky
+        gateway.
+    :param int fail_finishes: answer this many finish requests with 502,
+        after adding the files, like a gateway that timed out while the
+        server worked.
+    :param int fail_document_sets: answer this many document-set creations
+        with 502, after creating the document set.
+    :param int port: port to listen on, or 0 to pick a free one.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, corpus_dir=None, max_concurrent_uploads=None, accept_encodings=(), fail_uploads=0, fail_finishes=0, fail_document_sets=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.throttle = _Throttle(bandwidth)
+        self.corpus_dir = corpus_dir
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.accept_encodings = frozenset(accept_encodings)
+        self.fail_uploads = fail_uploads
+        self.fail_finishes = fail_finishes
+        self.fail_document_sets = fail_document_sets
+        self.n_uploads_in_progress = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+        server = self
+
+        class Handler(_Handler):
+            fake_overview = server
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def reset(self):
+        """Forget all files and zero all counters."""
+        with self._lock:
+            self.request_counts = collections.Counter() # 'METHOD endpoint' => n
+            self.n_bytes_received = 0 # of uploaded files, as sent
+            self.n_bytes_decoded = 0 # of uploaded files, decompressed
+            self.n_bytes_sent = 0
+            self.pending_sha1s = set() # uploaded, not finished
+            self.document_set_sha1s = set()
+            self.n_files_received = 0
+            self.n_files_rejected = 0 # by max_concurrent_uploads
+            self.n_files_unsupported = 0 # with a Content-Encoding we don't accept
+            self.n_files_failed = 0 # by fail_uploads
+            self.n_finishes_failed = 0 # by fail_finishes
+            self.n_document_sets_failed = 0 # by fail_document_sets
+            self.n_document_sets = 0
+
+    def counters(self):
+        """Return a snapshot of the counters, as a dict."""
+        with self._lock:
+            return {
+                'requests': dict(self.request_counts),
+                'n_requests': sum(self.request_counts.values()),
+                'n_files_received': self.n_files_received,
+                'n_files_rejected': self.n_files_rejected,
+                'n_files_unsupported': self.n_files_unsupported,
+                'n_files_failed': self.n_files_failed,
+                'n_bytes_received': self.n_bytes_received,
+                'n_bytes_decoded': self.n_bytes_decoded,
+                'n_bytes_sent': self.n_bytes_sent,
+                'n_files_in_document_set': len(self.document_set_sha1s),
+            }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-overview')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real server
+    fake_overview = None # set by FakeOverviewServer
+    timeout = 30 # drop a client that stalls mid-request, rather than hang
+
+    def log_message(self, format, *args):
+        pass # stay quiet: we're measuring speed
+
+    def _count(self, endpoint):
+        with self.fake_overview._lock:
+            self.fake_overview.request_counts['{} {}'.format(self.command, endpoint)] += 1
+
+    def _read_body(self, sha1=None):
+        """Read the request body in chunks, at the throttled speed."""
+        n_bytes = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                n_bytes += self._read_n_bytes(size, sha1)
+                self.rfile.readline()
+        else:
+            n_bytes = self._read_n_bytes(int(self.headers.get('Content-Length', 0)), sha1)
+        return n_bytes
+
+    def _read_n_bytes(self, n_bytes, sha1):
+        remaining = n_bytes
+        while remaining > 0:
+            chunk = self.rfile.read(min(ChunkSize, remaining))
+            if not chunk:
+                break
+            self.fake_overview.throttle.wait(len(chunk))
+            if sha1 is not None:
+                sha1.update(chunk)
+            remaining -= len(chunk)
+        return n_bytes - remaining
+
+    def _respond(self, status, body=b'', content_type='application/json', headers={}):
+        time.sleep(self.fake_overview.latency)
+        self.send_response(status)
+        if body or status not in (204, 304):
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        m = re.match(r'^/api/v1/document-sets/files/([0-9a-f]{40})$', self.path)
+        if not m:
+            self._count('unknown')
+            return self._respond(404)
+        self._count('/api/v1/document-sets/files/{sha1}')
+        with self.fake_overview._lock:
+            found = m.group(1) in self.fake_overview.document_set_sha1s
+        self._respond(204 if found else 404)
+
+    def do_DELETE(self):
+        if self.path != '/api/v1/files':
+            self._count('unknown')
+            return self._respond(404)
+        self._count('/api/v1/files')
+        with self.fake_overview._lock:
+            self.fake_overview.pending_sha1s.clear()
+        self._respond(204)
+
+    def do_POST(self):
+        server = self.fake_overview
+        if re.match(r'^/api/v1/files/[0-9a-f-]{36}$', self.path):
+            self._count('/api/v1/files/{uuid}')
+            encoding = self.headers.get('Content-Encoding', 'identity').lower()
+            if encoding != 'identity' and encoding not in server.accept_encodings:
+                with server._lock:
+                    server.n_files_unsupported += 1
+                self._read_body()
+                return self._respond(415)
+
+            with server._lock:
+                is_overloaded = server.max_concurrent_uploads is not None and server.n_uploads_in_progress >= server.max_concurrent_uploads
+                if is_overloaded:
+                    server.n_files_rejected += 1
+                else:
+                    server.n_uploads_in_progress += 1
+            if is_overloaded:
+                self._read_body()
+                return self._respond(503, headers={ 'Retry-After': '1' })
+
+            try:
+                sha1 = hashlib.sha1()
+                if encoding == 'identity':
+                    n_bytes = n_bytes_decoded = self._read_body(sha1)
+                else:
+                    hasher = _DecodingHasher(sha1, encoding)
+                    n_bytes = self._read_body(hasher)
+                    n_bytes_decoded = hasher.n_bytes
+                with server._lock:
+                    is_failed = server.n_files_failed < server.fail_uploads
+                    if is_failed:
+                        server.n_files_failed += 1
+                    else:
+                        server.n_files_received += 1
+                        server.n_bytes_received += n_bytes
+                        server.n_bytes_decoded += n_bytes_decoded
+                        server.pending_sha1s.add(sha1.hexdigest())
+                self._respond(502 if is_failed else 201)
+            finally:
+                with server._lock:
+                    server.n_uploads_in_progress -= 1
+        elif self.path == '/api/v1/files/finish':
+            self._count('/api/v1/files/finish')
+            self._read_body()
+            with server._lock:
+                server.document_set_sha1s.update(server.pending_sha1s)
+                server.pending_sha1s.clear()
+                is_failed = server.n_finishes_failed < server.fail_finishes
+                if is_failed:
+                    server.n_finishes_failed += 1
+            self._respond(502 if is_failed else 201)
+        elif self.path == '/api/v1/document-sets':
+            self._count('/api/v1/document-sets')
+            self._read_body()
+            with server._lock:
+                server.n_document_sets += 1
+                document_set_id = server.n_document_sets
+                is_failed = server.n_document_sets_failed < server.fail_document_sets
+                if is_failed:
+                    server.n_document_sets_failed += 1
+            if is_failed:
+                return self._respond(502)
+            body = json.dumps({
+                'documentSet': { 'id': document_set_id },
+                'apiToken': { 'token': 'token-{}'.format(document_set_id) },
+            }).encode('utf-8')
+            self._respond(201, body)
+        else:
+            self._count('unknown')
+            self._read_body()
+            self._respond(404)
+
+    def do_GET(self):
+        server = self.fake_overview
+        if not self.path.startswith('/corpus/') or server.corpus_dir is None:
+            self._count('unknown')
+            return self._respond(404)
+        self._count('/corpus/{path}')
+
+        relative_path = urllib.parse.unquote(self.path[len('/corpus/'):])
+        path = os.path.realpath(os.path.join(server.corpus_dir, relative_path))
+        if not path.startswith(os.path.realpath(server.corpus_dir) + os.sep) or not os.path.isfile(path):
+            return self._respond(404)
+
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ChunkSize), b''):
+                md5.update(chunk)
+
+        time.sleep(server.latency)
+        n_bytes = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(n_bytes))
+        self.send_header('ETag', '"{}"'.format(md5.hexdigest()))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ChunkSize), b''):
+                server.throttle.wait(len(chunk))
+                self.wfile.write(chunk)
+        with server._lock:
+            server.n_bytes_sent += n_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Overview upload API, for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=9000, help='port to listen on (default 9000)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response (default 0)')
+    parser.add_argument('--bandwidth', type=float, metavar='MB_PER_SECOND', help='limit all transfers, together, to this many MB/s')
+    parser.add_argument('--corpus-dir', help='serve files in this directory at /corpus/')
+    parser.add_argument('--max-concurrent-uploads', type=int, help='answer uploads beyond this many at once with 503, like an overloaded server')
+    parser.add_argument('--accept-encoding', action='append', choices=('gzip', 'zstd'), default=[], help='accept (and decompress) uploads with this Content-Encoding, like a decompressing proxy; answer others with 415. May be repeated')
+    parser.add_argument('--fail-uploads', type=int, default=0, metavar='N', help='answer the first N file uploads with 502, like a flaky gateway')
+    args = parser.parse_args()
+
+    server = FakeOverviewServer(
+        latency=args.latency,
+        bandwidth=args.bandwidth * 1e6 if args.bandwidth else None,
+        corpus_dir=args.corpus_dir,
+        max_concurrent_uploads=args.max_concurrent_uploads,
+        accept_encodings=args.accept_encoding,
+        fail_uploads=args.fail_uploads,
+        host=args.host,
+        port=args.port
+    )
+    print('Listening on {} (Ctrl+C to stop)'.format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.counters(), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+# Benchmark overview_upload against a fake, local Overview server.
+#
+#     python3 benchmarks/run.py                      # every scenario
+#     python3 benchmarks/run.py --scenario csv-url --latency 0.05 --concurrency 8
+#     python3 benchmarks/run.py --json before.json   # ...then change code, and:
+#     python3 benchmarks/run.py --compare before.json
+#
+# Each scenario runs in its own process, so that its peak RSS is its own. Times
+# are wall-clock times of that process, including Python's start-up.
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RepoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RepoDir) # benchmark this checkout, not an installed copy
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+from fake_overview import FakeOverviewServer
+
+Scenarios = [
+    'directory-tiny', # send_directory(): many small files
+    'directory-huge', # send_directory(): a few big files
+    'directory-deep', # send_directory(): a deep tree
+    'path-tiny', # send_path_if_conditions_met(), file by file
+    'csv-local', # overview-upload-csv --local-file-field
+    'csv-url', # overview-upload-csv --url-field (downloads from the fake server)
+]
+
+def _corpus_settings(scale):
+    return {
+        'tiny': { 'n_files': max(int(2000 * scale), 1), 'n_bytes': 4096 },
+        'huge': { 'n_files': 3, 'n_bytes': max(int(64 * 1024 * 1024 * scale), 1) },
+        'deep': { 'depth': 6, 'fanout': 3, 'files_per_directory': max(int(2 * scale), 1) },
+    }
+
+def prepare_corpus(dirname, scale):
+    """Generate corpora in dirname, unless they're there already."""
+    settings = _corpus_settings(scale)
+    marker = os.path.join(dirname, 'corpus.json')
+    try:
+        with open(marker) as f:
+            if json.load(f) == settings:
+                return
+    except (OSError, ValueError):
+        pass
+
+    print('Generating corpus in {}…'.format(dirname), file=sys.stderr)
+    for kind in ('tiny', 'huge', 'deep'):
+        path = os.path.join(dirname, kind)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    corpus.generate_tiny_files(os.path.join(dirname, 'tiny'), **settings['tiny'])
+    corpus.generate_huge_files(os.path.join(dirname, 'huge'), **settings['huge'])
+    corpus.generate_deep_tree(os.path.join(dirname, 'deep'), **settings['deep'])
+    with open(marker, 'w') as f:
+        json.dump(settings, f)
+
+def run_child(scenario, server_url, corpus_dir, concurrency, adaptive_concurrency):
+    """Run one library scenario in this process (called in a subprocess)."""
+    import overview_upload
+
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler())
+
+    limiter = overview_upload.ConcurrencyLimiter(max_limit=max(concurrency, 1)) if adaptive_concurrency else None
+    upload = overview_upload.Upload(server_url, 'token', logger=logger, pool_size=max(concurrency, 1), concurrency_limiter=limiter)
+    upload.clear_previous_upload()
+
+    if scenario.startswith('directory-'):
+        upload.send_directory(os.path.join(corpus_dir, scenario[len('directory-'):]), concurrency=concurrency)
+    elif scenario == 'path-tiny':
+        dirname = os.path.join(corpus_dir, 'tiny')
+        for name in sorted(os.listdir(dirname)):
+            upload.send_path_if_conditions_met(pathlib.Path(dirname, name), name)
+    else:
+        raise ValueError('Unknown scenario {}'.format(scenario))
+
+    upload.finish()
+    upload.close()
+
+def _command(scenario, server_url, corpus_dir, concurrency, adaptive_concurrency):
+    extra_args = [ '--adaptive-concurrency' ] if adaptive_concurrency else []
+
+    if scenario.startswith('csv-'):
+        csv_path = os.path.join(corpus_dir, 'tiny.csv')
+        corpus.generate_csv(csv_path, os.path.join(corpus_dir, 'tiny'), url_prefix=server_url + '/corpus/')
+        field_args = [ '--local-file-field', 'path' ] if scenario == 'csv-local' else [ '--url-field', 'url' ]
+        return [
+            sys.executable, os.path.join(RepoDir, 'overview-upload-csv'),
+            'token', csv_path,
+            '--server', server_url,
+            '--title-field', 'title',
+            '--n-concurrent-uploads', str(concurrency),
+            '--quiet',
+        ] + field_args + extra_args
+
+    return [
+        sys.executable, os.path.abspath(__file__),
+        '--child', scenario,
+        '--server', server_url,
+        '--corpus-dir', corpus_dir,
+        '--concurrency', str(concurrency),
+    ] + extra_args
+
+def run_scenario(scenario, server, corpus_dir, concurrency, adaptive_concurrency):
+    """Run a scenario in a subprocess; return its measurements as a dict."""
+    server.reset()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [ RepoDir, env.get('PYTHONPATH') ] if p)
+
+    start = time.time()
+    process = subprocess.Popen(_command(scenario, server.url, corpus_dir, concurrency, adaptive_concurrency), env=env)
+    # wait4() gives us the resource usage of this one child
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    seconds = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError('Scenario {} exited with status {}'.format(scenario, process.returncode))
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    counters = server.counters()
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'seconds': seconds,
+        'n_files': counters['n_files_received'],
+        'n_bytes': counters['n_bytes_received'],
+        'files_per_second': counters['n_files_received'] / seconds,
+        'mb_per_second': counters['n_bytes_received'] / 1e6 / seconds,
+        'peak_rss_mb': peak_rss / 1e6,
+        'n_requests': counters['n_requests'],
+        'requests': counters['requests'],
+    }
+
+def print_results(results, baseline=None):
+    baseline = dict((r['scenario'], r) for r in (baseline or []))
+
+    def change(result, key):
+        before = baseline.get(result['scenario'], {}).get(key)
+        if not before:
+            return ''
+        return ' ({:+.0f}%)'.format((result[key] - before) / before * 100)
+
+    print('{:16} {:>7} {:>9} {:>8} {:>16} {:>14} {:>16} {:>9}'.format(
+        'scenario', 'files', 'MB', 'seconds', 'files/s', 'MB/s', 'peak RSS MB', 'requests'
+    ))
+    for r in results:
+        print('{:16} {:>7} {:>9.1f} {:>8.2f} {:>16} {:>14} {:>16} {:>9}'.format(
+            r['scenario'],
+            r['n_files'],
+            r['n_bytes'] / 1e6,
+            r['seconds'],
+            '{:.1f}'.format(r['files_per_second']) + change(r, 'files_per_second'),
+            '{:.1f}'.format(r['mb_per_second']) + change(r, 'mb_per_second'),
+            '{:.1f}'.format(r['peak_rss_mb']) + change(r, 'peak_rss_mb'),
+            r['n_requests']
+        ))
+    for r in results:
+        print('{}: {}'.format(r['scenario'], ', '.join('{} {}'.format(n, k) for k, n in sorted(r['requests'].items()))))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark overview_upload against a fake, local Overview server')
+    parser.add_argument('--scenario', action='append', choices=Scenarios, help='scenario to run; may be repeated (default all)')
+    parser.add_argument('--concurrency', type=int, default=4, help='files to upload simultaneously (default 4)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits before each response (default 0)')
+    parser.add_argument('--bandwidth', type=float, metavar='MB_PER_SECOND', help='limit all transfers to and from the server, together, to this many MB/s')
+    parser.add_argument('--server-max-uploads', type=int, metavar='N', help='make the server answer uploads beyond N at once with 503 (default no limit)')
+    parser.add_argument('--adaptive-concurrency', action='store_true', default=False, help='treat --concurrency as a maximum, and adapt to the server')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply corpus sizes by this (default 1: 2,000 4kB files, 3 64MiB files, a 6-deep tree)')
+    parser.add_argument('--corpus-dir', help='where to generate (and reuse) corpora; default a temporary directory')
+    parser.add_argument('--json', metavar='FILE', help='also write results to this JSON file')
+    parser.add_argument('--compare', metavar='FILE', help='show the change since the results in this JSON file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--server', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.server, args.corpus_dir, args.concurrency, args.adaptive_concurrency)
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix='overview-upload-benchmark-') as tmp_dir:
+        corpus_dir = args.corpus_dir or tmp_dir
+        prepare_corpus(corpus_dir, args.scale)
+
+        server = FakeOverviewServer(
+            latency=args.latency,
+            bandwidth=args.bandwidth * 1e6 if args.bandwidth else None,
+            corpus_dir=corpus_dir,
+            max_concurrent_uploads=args.server_max_uploads
+        )
+        with server:
+            results = []
+            for scenario in args.scenario or Scenarios:
+                print('Running {}…'.format(scenario), file=sys.stderr)
+                results.append(run_scenario(scenario, server, corpus_dir, args.concurrency, args.adaptive_concurrency))
+
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,48 @@
 """Utilities for uploading to www.overviewdocs.com via its API
 """
 
-from overview_upload._upload import Upload
-from overview_upload._document_set import create_document_set
-from overview_upload._metadata import parse_metadata_json, read_metadata_json_file, parse_metadata_from_delimited_string_of_fields, DefaultMetadataSchema
+import importlib
+
+# Each public name, by the module that defines it. A module is imported the
+# first time one of its names is used, so a script only loads what it needs:
+# ``overview-create-document-set`` never loads the upload code, and nothing
+# loads ``requests`` until it creates a session.
+_Exports = [
+    ('_upload', [ 'Upload' ]),
+    ('_results', [ 'ResultUploaded', 'ResultDuplicate', 'ResultUnhandledExtension', 'ResultUnchanged', 'ResultAlreadySent', 'ResultFailed', 'ResultCancelled', 'ResultEmpty', 'ResultTooSmall', 'ResultTooLarge', 'ResultDeniedType' ]),
+    ('_pipeline', [ 'Pipeline', 'PathJob', 'UrlJob' ]),
+    ('_plan', [ 'Plan', 'iter_plan_jobs', 'read_plan_summary' ]),
+    ('_watch', [ 'DropDirectoryWatcher' ]),
+    ('_partition', [ 'Partition', 'Coordination', 'run_partitions' ]),
+    ('_shards', [ 'ShardedUpload', 'ShardCounter', 'shard_by_subdirectory', 'shard_title' ]),
+    ('_journal', [ 'UploadJournal', 'JournalEntry' ]),
+    ('_manifest', [ 'Manifest', 'ManifestEntry' ]),
+    ('_document_set', [ 'create_document_set' ]),
+    ('_async_upload', [ 'AsyncUpload', 'create_document_set_async' ]),
+    ('_session', [ 'create_session' ]),
+    ('_congestion', [ 'ConcurrencyLimiter' ]),
+    ('_compression', [ 'Compressor', 'CompressedFile', 'CompressionEncodings' ]),
+    ('_filter', [ 'ContentFilter', 'ContentTypes', 'DefaultDeniedTypes', 'build_content_filter', 'sniff_type' ]),
+    ('_walk', [ 'walk_directory' ]),
+    ('_archive', [ 'is_archive', 'iter_archive' ]),
+    ('_hashing', [ 'hash_file', 'hash_path', 'spool_file' ]),
+    ('_fetch', [ 'ChecksumMismatchError' ]),
+    ('_metrics', [ 'Metrics', 'ProgressDisplay' ]),
+    ('_csv_rows', [ 'CsvRows', 'CsvRow' ]),
+    ('_metadata', [ 'parse_metadata_json', 'read_metadata_json_file', 'parse_metadata_from_delimited_string_of_fields', 'DefaultMetadataSchema' ]),
+]
+
+_ModuleByName = dict((name, module) for module, names in _Exports for name in names)
+
+__all__ = [ name for _, names in _Exports for name in names ]
+
+def __getattr__(name):
+    module = _ModuleByName.get(name)
+    if module is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('{}.{}'.format(__name__, module)), name)
+    globals()[name] = value # so the next lookup doesn't come here
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,120 @@
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from overview_upload._walk import _matches
+
+ArchiveExtensions = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tbz2', '.tar.xz', '.txz')
+
+# Errors from a corrupt (or unsupported) archive. Not OSError: requests'
+# errors are OSErrors too.
+ArchiveErrors = (zipfile.BadZipFile, zipfile.LargeZipFile, tarfile.TarError, EOFError, zlib.error, lzma.LZMAError, NotImplementedError)
+
+def is_archive(filename):
+    """Return True if filename looks like a zip or tar archive."""
+    lower = filename.lower()
+    return any(lower.endswith(ext) for ext in ArchiveExtensions)
+
+class _MemberFile:
+    """An archive member, opened for reading, that knows its length.
+
+    requests reads ``len``. Without it, requests would seek to the end of the
+    member to measure it, decompressing the whole member an extra time.
+    """
+
+    def __init__(self, in_file, n_bytes, seekable):
+        self._in_file = in_file
+        self.len = n_bytes
+        self._seekable = seekable
+
+    def read(self, size=-1):
+        return self._in_file.read(size)
+
+    def seekable(self):
+        return self._seekable
+
+    def tell(self):
+        return self._in_file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._in_file.seek(offset, whence)
+
+def _skip_reason(parts, include, exclude, max_size, n_bytes):
+    """Return why walk_directory() would skip this member, or None."""
+    # Hidden files and directories, and Mac OS's "__MACOSX" resource forks
+    if any(part[0] == '.' or part == '__MACOSX' for part in parts):
+        return 'hidden'
+    if exclude and any(_matches(exclude, '/'.join(parts[:i + 1]), parts[i]) for i in range(len(parts))):
+        return 'excluded'
+    if include and not _matches(include, '/'.join(parts), parts[-1]):
+        return 'excluded'
+    if max_size is not None and n_bytes > max_size:
+        return 'too_large'
+    return None
+
+def _iter_zip(path):
+    with zipfile.ZipFile(str(path)) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if info.flag_bits & 0x1:
+                yield info.filename, info.file_size, None
+                continue
+            with archive.open(info) as in_file:
+                # A zip member can seek back to its start (by decompressing
+                # it again), so it can be hashed and then sent
+                yield info.filename, info.file_size, _MemberFile(in_file, info.file_size, True)
+
+def _iter_tar(path):
+    if str(path).lower().endswith('.tar'):
+        mode = 'r:' # members can seek: hash them, then send them
+    else:
+        mode = 'r|*' # one pass through the decompressor; members can't seek
+    with tarfile.open(str(path), mode) as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            in_file = archive.extractfile(member)
+            with in_file:
+                yield member.name, member.size, _MemberFile(in_file, member.size, mode == 'r:')
+
+def iter_archive(path, include=None, exclude=None, max_size=None, on_skip=None):
+    """Yield (filename, n_bytes, in_file) for each file in a zip or tar archive.
+
+    Nothing is extracted to disk: each ``in_file`` reads its member straight
+    out of the archive. It is only valid until the next member is yielded.
+    Members of compressed tar archives can't seek, because the archive is
+    read in a single pass.
+
+    ``filename`` is the member's path within the archive, with ``os.sep``
+    separators. Members are skipped by the same rules (and with the same
+    ``on_skip`` reasons) as ``walk_directory()``, plus ``"encrypted"`` for
+    encrypted zip members. Archives inside the archive are not expanded.
+
+    :param pathlib.Path path: zip, tar, tar.gz, tar.bz2 or tar.xz file.
+    :param list include: see ``walk_directory()``; matched against paths
+        within the archive.
+    :param list exclude: see ``walk_directory()``.
+    :param int max_size: see ``walk_directory()``.
+    :param function on_skip: see ``walk_directory()``.
+    :raises ArchiveErrors: if the archive is corrupt.
+    """
+    if on_skip is None:
+        on_skip = lambda filename, reason: None
+
+    members = _iter_zip(path) if str(path).lower().endswith('.zip') else _iter_tar(path)
+    for name, n_bytes, in_file in members:
+        parts = [ part for part in name.replace('\\', '/').split('/') if part not in ('', '.') ]
+        if not parts:
+            continue
+        filename = os.sep.join(parts) # visible on the server
+
+        reason = _skip_reason(parts, include, exclude, max_size, n_bytes)
+        if reason is None and in_file is None:
+            reason = 'encrypted'
+        if reason is not None:
+            on_skip(filename, reason)
+            continue
+
+        yield filename, n_bytes, in_file
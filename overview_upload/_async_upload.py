@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from overview_upload._document_set import create_document_set
+from overview_upload._upload import Upload
+
+DefaultMaxConcurrency = 16
+
+async def create_document_set_async(server_url, api_token, title, metadata_schema={'version':1,'fields':[]}, logger=None, session=None):
+    """Coroutine version of ``create_document_set()``.
+
+    It runs on the event loop's default executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(
+        create_document_set,
+        server_url,
+        api_token,
+        title,
+        metadata_schema=metadata_schema,
+        logger=logger,
+        session=session
+    ))
+
+class AsyncUpload:
+    """asyncio counterpart to Upload.
+
+    Each method is a coroutine that runs the matching ``Upload`` method on
+    a pool of ``max_concurrency`` threads. All the threads share one
+    ``Upload``, so they share its connection pool, counters, manifest and
+    journal. At most ``max_concurrency`` calls do I/O at once. The rest wait
+    their turn without holding a thread.
+
+    To upload many files, hand coroutines to ``spawn()``. It waits while
+    ``max_pending`` are outstanding, which throttles the producer. Then
+    ``finish()`` waits for all of them and finishes the upload.
+
+    This is not non-blocking I/O: every request still blocks a thread while
+    it runs, since ``Upload`` is built on requests. So ``max_concurrency``
+    costs what that many threads cost, and past a few dozen, threads add
+    memory and GIL contention faster than throughput. What it saves is the
+    waiting: calls beyond ``max_concurrency`` (and everything your own code
+    does meanwhile) wait on the event loop, not on threads. For more
+    simultaneous uploads, run several processes (see ``run_partitions()``).
+
+    Cancelling a call that is waiting its turn means its file is never sent.
+    Cancelling a call that is already sending lets the thread finish that
+    file in the background. The file is counted only if it succeeds, so
+    ``n_uploaded`` stays correct.
+
+    :param str server_url: see ``Upload``.
+    :param str api_token: see ``Upload``.
+    :param int max_concurrency: number of simultaneous requests (and
+        threads, and pooled connections).
+    :param int max_pending: number of ``spawn()``ed tasks allowed to be
+        outstanding; default ``max_concurrency * 4``.
+    :param Logger logger: see ``Upload``.
+    :param kwargs: passed on to ``Upload``.
+
+    Use it as an ``async with`` context manager, or call ``aclose()``.
+    """
+
+    def __init__(self, server_url, api_token, max_concurrency=DefaultMaxConcurrency, max_pending=None, logger=None, **kwargs):
+        kwargs.setdefault('pool_size', max_concurrency)
+        self.upload = Upload(server_url, api_token, logger=logger, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending or max_concurrency * 4
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphores = weakref.WeakKeyDictionary() # event loop => Semaphore
+        self._tasks = set()
+        self._errors = []
+
+    @property
+    def n_uploaded(self):
+        return self.upload.n_uploaded
+
+    @property
+    def metrics(self):
+        return self.upload.metrics
+
+    @property
+    def logger(self):
+        return self.upload.logger
+
+    async def _run(self, func, *args, **kwargs):
+        # A Semaphore belongs to one event loop, and each asyncio.run() has
+        # its own
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+
+        async with semaphore:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def clear_previous_upload(self):
+        """See ``Upload.clear_previous_upload()``."""
+        return await self._run(self.upload.clear_previous_upload)
+
+    async def resume_or_clear_previous_upload(self):
+        """See ``Upload.resume_or_clear_previous_upload()``."""
+        return await self._run(self.upload.resume_or_clear_previous_upload)
+
+    async def is_file_already_in_document_set(self, in_file, sha1=None):
+        """See ``Upload.is_file_already_in_document_set()``."""
+        return await self._run(self.upload.is_file_already_in_document_set, in_file, sha1)
+
+    async def send_file(self, in_file, filename, **kwargs):
+        """See ``Upload.send_file_if_conditions_met()``."""
+        return await self._run(self.upload.send_file_if_conditions_met, in_file, filename, **kwargs)
+
+    async def send_path(self, path, filename, **kwargs):
+        """See ``Upload.send_path_if_conditions_met()``."""
+        return await self._run(self.upload.send_path_if_conditions_met, path, filename, **kwargs)
+
+    async def send_url(self, url, filename, **kwargs):
+        """See ``Upload.send_url_if_conditions_met()``."""
+        return await self._run(self.upload.send_url_if_conditions_met, url, filename, **kwargs)
+
+    async def spawn(self, coro):
+        """Run ``coro`` as a task, once fewer than ``max_pending`` are running.
+
+        If a task raises an error, ``join()`` and ``finish()`` raise it.
+
+        :param coroutine coro: for instance, ``upload.send_path(path, name)``.
+        :return: the ``asyncio.Task``.
+        """
+        while len(self._tasks) >= self.max_pending:
+            await asyncio.wait(set(self._tasks), return_when=asyncio.FIRST_COMPLETED)
+
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._errors.append(task.exception())
+
+    async def join(self):
+        """Wait for all ``spawn()``ed tasks; raise the first error, if any."""
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise errors[0]
+
+    def cancel(self):
+        """Cancel all ``spawn()``ed tasks."""
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def finish(self, lang='en', ocr=True, split_by_page=False):
+        """Wait for ``spawn()``ed tasks, then call ``Upload.finish()``."""
+        await self.join()
+        return await self._run(self.upload.finish, lang=lang, ocr=ocr, split_by_page=split_by_page)
+
+    async def aclose(self):
+        """Cancel outstanding tasks, then close threads and connections."""
+        self.cancel()
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+        self._errors = []
+
+        # Wait for threads still sending files whose callers were cancelled
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+        self.upload.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,260 @@
+import gzip
+import io
+import os
+import tempfile
+import threading
+import time
+import zlib
+from overview_upload._filter import DefaultSniffSize, read_head, sniff_type
+from overview_upload._hashing import DefaultReadSize, DefaultSpoolMaxMemory
+
+# Content-Encodings we can send
+CompressionEncodings = ('gzip', 'zstd')
+
+# Smaller files aren't worth compressing: headers and round trips dominate
+DefaultMinSize = 4096
+
+# Send a file as it is unless compressing it leaves at most this fraction of
+# its bytes
+DefaultMaxRatio = 0.9
+
+# Compression level for each sniffed type, as (gzip level, zstd level).
+# Text shrinks a lot, so it's worth spending CPU on it; a PDF's streams are
+# compressed already, so a fast level gets nearly all there is to get.
+# Types not listed (.docx, JPEG, zip, audio, video...) are compressed
+# already: we send them as they are.
+_TypeLevels = {
+    'text': (9, 12),
+    'html': (9, 12),
+    'xml': (9, 12),
+    'rtf': (9, 12),
+    'ole': (6, 6),
+    'sqlite': (6, 6),
+    'tiff': (6, 6),
+    'executable': (6, 6),
+    'unknown': (6, 6),
+    'pdf': (1, 3),
+}
+
+# What to assume about a file sniff_type() calls "unknown" (for instance,
+# text that isn't UTF-8), by extension
+_ExtensionTypes = {
+    '.txt': 'text',
+    '.csv': 'text',
+    '.tsv': 'text',
+    '.json': 'text',
+    '.eml': 'text',
+    '.mbox': 'text',
+    '.htm': 'html',
+    '.html': 'html',
+    '.xml': 'xml',
+}
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd compression needs the "zstandard" package: pip install zstandard')
+    return zstandard
+
+class _DecompressingReader:
+    """Reads the original bytes back out of a compressed file.
+
+    Like ``_MemberFile``, it has a ``len`` so requests doesn't measure it.
+    """
+
+    def __init__(self, in_file, n_bytes):
+        self._in_file = in_file
+        self.len = n_bytes
+
+    def read(self, size=-1):
+        return self._in_file.read(size)
+
+    def seekable(self):
+        return False
+
+class CompressedFile:
+    """A file's bytes, compressed into a temporary file.
+
+    :param str encoding: the Content-Encoding: ``"gzip"`` or ``"zstd"``.
+    :param int level: the compression level.
+    :param str file_type: what ``sniff_type()`` called the file.
+    :param int n_bytes: the file's size.
+    :param int n_bytes_compressed: the compressed size.
+    :param float seconds: time spent compressing.
+    :param file: the compressed bytes, rewound; or ``None`` if they were
+        not worth sending (``in_file`` was rewound instead).
+    """
+
+    def __init__(self, encoding, level, file_type, n_bytes, n_bytes_compressed, seconds, file, in_file_position):
+        self.encoding = encoding
+        self.level = level
+        self.file_type = file_type
+        self.n_bytes = n_bytes
+        self.n_bytes_compressed = n_bytes_compressed
+        self.seconds = seconds
+        self.file = file
+        self._in_file_position = in_file_position
+
+    @property
+    def ratio(self):
+        """Compressed size, as a fraction of the original size."""
+        return self.n_bytes_compressed / self.n_bytes if self.n_bytes else 1.0
+
+    def open_original(self, in_file):
+        """Return a file with the original bytes, to send them as they are.
+
+        That's ``in_file``, rewound, if it can seek; otherwise, the
+        compressed bytes, decompressed as they are read.
+
+        :param in_file: the file ``Compressor.compress()`` returned.
+        """
+        if self._in_file_position is not None:
+            in_file.seek(self._in_file_position)
+            return in_file
+        self.file.seek(0)
+        if self.encoding == 'gzip':
+            reader = gzip.GzipFile(fileobj=self.file, mode='rb')
+        else:
+            reader = _import_zstandard().ZstdDecompressor().stream_reader(self.file)
+        return _DecompressingReader(reader, self.n_bytes)
+
+    def close(self):
+        """Delete the compressed bytes."""
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Compressor:
+    """Compresses files before ``Upload`` sends them, for slow links.
+
+    Only some servers accept compressed request bodies: a proxy in front of
+    Overview, for instance, that decompresses them. Overview sees (and
+    checks for duplicates by) the original bytes, so each file's sha1 is
+    the sha1 of its original bytes.
+
+    Each file is sniffed (see ``sniff_type()``) to choose a level: text
+    gets a high level, PDFs a fast one, and formats that are compressed
+    already (images, ``.docx``, archives, media) are sent as they are.
+    Files that don't shrink enough are sent as they are, too, if ``Upload``
+    can rewind them.
+
+    Files are compressed on the threads that send them, and zlib and
+    zstandard release the GIL while they work, so compressing doesn't
+    serialize concurrent uploads. Compressed bytes are kept in memory, up
+    to ``spool_max_memory``, and in a temporary file after that.
+
+    If the server answers "415 Unsupported Media Type", ``Upload`` sends
+    the file as it is, and calls ``disable()``: later files aren't
+    compressed either. Share a Compressor among Uploads to the same server,
+    so they all learn at once.
+
+    :param str encoding: ``"gzip"``, or ``"zstd"`` (which needs the
+        ``zstandard`` package).
+    :param dict levels: compression level for each file type (see
+        ``ContentTypes``), or ``None`` to send files of that type as they
+        are. These override the defaults.
+    :param int min_size: don't compress files smaller than this many bytes.
+    :param float max_ratio: send a file as it is unless compressing it
+        leaves at most this fraction of its bytes.
+    :param int read_size: number of bytes to compress at a time.
+    :param int spool_max_memory: number of compressed bytes to hold in
+        memory.
+    :raises ValueError: if ``encoding`` is unknown, or needs a package that
+        isn't installed.
+    """
+
+    def __init__(self, encoding='gzip', levels=None, min_size=DefaultMinSize, max_ratio=DefaultMaxRatio, read_size=DefaultReadSize, spool_max_memory=DefaultSpoolMaxMemory):
+        if encoding not in CompressionEncodings:
+            raise ValueError('Unknown encoding "{}"; expected one of {}'.format(encoding, ', '.join(CompressionEncodings)))
+        if encoding == 'zstd':
+            self._zstandard = _import_zstandard()
+        self.encoding = encoding
+        column = CompressionEncodings.index(encoding)
+        self.levels = dict((file_type, pair[column]) for file_type, pair in _TypeLevels.items())
+        self.levels.update(levels or {})
+        self.min_size = min_size
+        self.max_ratio = max_ratio
+        self.read_size = read_size
+        self.spool_max_memory = spool_max_memory
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def disable(self):
+        """Stop compressing files: the server doesn't accept them.
+
+        :return: ``True`` if this call disabled compression, ``False`` if
+            another call already had.
+        """
+        with self._lock:
+            was_enabled = self.enabled
+            self.enabled = False
+        return was_enabled
+
+    def level_for(self, file_type, filename):
+        """Return the level to compress a file at, or ``None`` to send it as
+        it is.
+
+        :param str file_type: what ``sniff_type()`` says.
+        :param str filename: the file's name, for its extension.
+        """
+        if file_type == 'unknown':
+            file_type = _ExtensionTypes.get(os.path.splitext(filename)[1].lower(), file_type)
+        return self.levels.get(file_type)
+
+    def _compressobj(self, level):
+        if self.encoding == 'gzip':
+            return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # with a gzip header
+        return self._zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, in_file, filename, n_bytes):
+        """Compress ``in_file``, if its type and size make it worthwhile.
+
+        :param in_file: file to compress, read from its current position.
+        :param str filename: the file's name, for its extension.
+        :param int n_bytes: ``in_file``'s size.
+        :return: ``(compressed, in_file)``. ``compressed`` is ``None`` if we
+            didn't try; otherwise, a CompressedFile, to close when done. Read
+            from the returned ``in_file`` from now on, if you read it.
+        """
+        if not self.enabled or n_bytes < self.min_size:
+            return None, in_file
+
+        head, in_file = read_head(in_file, DefaultSniffSize, n_bytes)
+        file_type = sniff_type(head)
+        level = self.level_for(file_type, filename)
+        if level is None:
+            return None, in_file
+
+        seekable = getattr(in_file, 'seekable', None)
+        position = in_file.tell() if seekable is not None and seekable() else None
+
+        start = time.time()
+        compressobj = self._compressobj(level)
+        # In memory, then on disk, as spool_file() does
+        out_file = io.BytesIO()
+        for chunk in iter(lambda: in_file.read(self.read_size), b''):
+            data = compressobj.compress(chunk)
+            if out_file.tell() + len(data) > self.spool_max_memory and isinstance(out_file, io.BytesIO):
+                on_disk = tempfile.TemporaryFile()
+                on_disk.write(out_file.getbuffer())
+                out_file.close()
+                out_file = on_disk
+            out_file.write(data)
+        out_file.write(compressobj.flush())
+        n_bytes_compressed = out_file.tell()
+        seconds = time.time() - start
+
+        if n_bytes_compressed > n_bytes * self.max_ratio and position is not None:
+            out_file.close()
+            in_file.seek(position)
+            out_file = None
+        else:
+            out_file.seek(0)
+
+        return CompressedFile(self.encoding, level, file_type, n_bytes, n_bytes_compressed, seconds, out_file, position), in_file
@@ -0,0 +1,171 @@
+import email.utils
+import threading
+import time
+
+# Responses that mean "the server is overloaded": back off, then try again
+OverloadStatusCodes = (429, 503)
+
+# A small file's latency is mostly round trip and server overhead, not
+# transfer: compare latencies per byte as if every file were at least this big
+_MinLatencyBytes = 64 * 1024
+
+def parse_retry_after(value, now=None):
+    """Return the number of seconds a ``Retry-After`` header asks us to wait.
+
+    :param str value: the header: a number of seconds or an HTTP date.
+    :return: a number of seconds (at least 0), or ``None`` if ``value`` is
+        missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        timestamp = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+    return max(timestamp - (time.time() if now is None else now), 0.0)
+
+class ConcurrencyLimiter:
+    """Limits simultaneous uploads to what the server can take.
+
+    The limit grows by about one upload per round of uploads while the
+    server keeps up (additive increase), and halves when it doesn't
+    (multiplicative decrease): on a 429 or 503 response, a network error, or
+    latency per byte above ``latency_tolerance`` times the best we've seen.
+    A ``Retry-After`` header pauses all new uploads for as long as it says.
+
+    Only uploads that started after the last decrease can cause another, so
+    a burst of errors from uploads that were already in flight halves the
+    limit once, not once per upload. Near the limit where the server last
+    got overloaded, the limit grows ``probe_slowdown`` times more slowly:
+    each overload costs a pause, so we don't hurry back to it.
+
+    Pass one to ``Upload(concurrency_limiter=...)``, and give the Upload at
+    least ``max_limit`` threads (and connections). The Upload then leaves
+    uploads' 429 and 503 responses for the limiter to see, rather than
+    retrying them itself.
+
+    :param int initial_limit: simultaneous uploads to start with.
+    :param int min_limit: never allow fewer simultaneous uploads.
+    :param int max_limit: never allow more simultaneous uploads.
+    :param float backoff_ratio: multiply the limit by this on overload.
+    :param float latency_tolerance: treat latency per byte this many times
+        the lowest we've seen as overload, or ``None`` to ignore latency.
+    :param float probe_slowdown: how much more slowly to grow the limit
+        near the last overload.
+    :param float default_retry_after: seconds to pause after a 429 or 503
+        response without a ``Retry-After`` header.
+    :param int max_overload_retries: number of times the Upload may retry a
+        file the server rejected with 429 or 503. (These retries don't count
+        toward ``max_attempts_per_file``.)
+    """
+
+    def __init__(self, initial_limit=2, min_limit=1, max_limit=32, backoff_ratio=0.5, latency_tolerance=3.0, probe_slowdown=10.0, default_retry_after=1.0, max_overload_retries=10):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError('Need 1 <= min_limit <= max_limit')
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.probe_slowdown = probe_slowdown
+        self.default_retry_after = default_retry_after
+        self.max_overload_retries = max_overload_retries
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._n_in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._overload_limit = None # the limit when we last decreased
+        self._best_latency = None # seconds per byte
+        self._smoothed_latency = None
+        self.n_overloaded = 0 # 429s, 503s and network errors
+        self.n_decreases = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        """Number of uploads allowed at once, right now."""
+        return int(self._limit)
+
+    @property
+    def n_in_flight(self):
+        """Number of uploads in progress."""
+        return self._n_in_flight
+
+    def acquire(self):
+        """Wait until another upload may start; return its start time.
+
+        Pass the start time to ``release()`` when the upload is done.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._condition.wait(self._paused_until - now)
+                elif self._n_in_flight >= int(self._limit):
+                    self._condition.wait()
+                else:
+                    break
+            self._n_in_flight += 1
+            return now
+
+    def release(self, started, n_bytes, status_code, retry_after=None):
+        """Record how an upload went, and let another one start.
+
+        :param float started: what ``acquire()`` returned.
+        :param int n_bytes: number of bytes uploaded.
+        :param int status_code: the response's HTTP status, or ``None`` after
+            a network error.
+        :param str retry_after: the response's ``Retry-After`` header, if any.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._n_in_flight -= 1
+
+            if status_code is None or status_code in OverloadStatusCodes:
+                self.n_overloaded += 1
+                if status_code is not None:
+                    delay = parse_retry_after(retry_after)
+                    if delay is None:
+                        delay = self.default_retry_after
+                    self._paused_until = max(self._paused_until, now + delay)
+                self._decrease(started, now)
+            elif status_code < 400:
+                if self._is_slow(now - started, n_bytes):
+                    self._decrease(started, now)
+                else:
+                    self._increase()
+
+            self._condition.notify_all()
+
+    def _is_slow(self, seconds, n_bytes):
+        latency = seconds / max(n_bytes or 0, _MinLatencyBytes)
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        if self._smoothed_latency is None:
+            self._smoothed_latency = latency
+        else:
+            self._smoothed_latency = 0.8 * self._smoothed_latency + 0.2 * latency
+        return self.latency_tolerance is not None and self._smoothed_latency > self._best_latency * self.latency_tolerance
+
+    def _increase(self):
+        # Over one round of `limit` uploads, the limit grows by 1
+        step = 1.0 / self._limit
+        if self._overload_limit is not None:
+            if self._limit + 1 >= self._overload_limit:
+                step /= self.probe_slowdown
+            if self._limit >= self._overload_limit + 1:
+                self._overload_limit = None # the server takes more now
+        self._limit = min(self._limit + step, float(self.max_limit))
+
+    def _decrease(self, started, now):
+        if started < self._last_decrease:
+            return # it was in flight when we last decreased: old news
+        self._last_decrease = now
+        self._overload_limit = self._limit
+        self._limit = max(self._limit * self.backoff_ratio, float(self.min_limit))
+        self._smoothed_latency = None
+        self.n_decreases += 1
@@ -0,0 +1,155 @@
+import csv
+import json.encoder
+import urllib.parse
+
+DefaultChunkSize = 10000
+
+# The C encoder json.dumps(..., ensure_ascii=True) uses for each string
+_encode_str = json.encoder.encode_basestring_ascii
+
+class CsvRow:
+    """One valid row of a CSV that lists files to upload.
+
+    :param int line_number: 1 for the first row after the header.
+    :param str value: the file's path or URL, stripped of whitespace.
+    :param str title: the filename to set in Overview.
+    :param str metadata_json: the row's metadata, already encoded as the
+        JSON Object ``Upload.send_file_if_conditions_met()`` sends. It holds
+        only the schema's fields.
+    :param str shard: the row's ``shard_field`` value, or ``None``.
+    """
+
+    __slots__ = ('line_number', 'value', 'title', 'metadata_json', 'shard')
+
+    def __init__(self, line_number, value, title, metadata_json, shard=None):
+        self.line_number = line_number
+        self.value = value
+        self.title = title
+        self.metadata_json = metadata_json
+        self.shard = shard
+
+class CsvRows:
+    """Reads (and validates) a CSV that lists files to upload, one per row.
+
+    Millions of rows are fine: rows are read in chunks of ``chunk_size``,
+    and nothing but the invalid rows' line numbers is kept in memory. Each
+    row's metadata is encoded once, as it is read, with only the columns the
+    metadata schema names. (Without a schema, every column is metadata.)
+
+    Call ``validate()`` to find every invalid row in one pass before you
+    upload anything; then ``iter_chunks()`` to read the valid rows.
+
+    :param str path: path to a UTF-8 CSV file with a header row.
+    :param str field: column containing each file's path or URL.
+    :param str title_field: column containing each file's title, or
+        ``None`` to use ``field``.
+    :param dict metadata_schema: a schema from ``parse_metadata_json()``, or
+        ``None``.
+    :param bool urls: if ``True``, ``field`` must hold http(s) URLs.
+    :param str shard_field: column that says which document set each row
+        belongs in (see ``ShardedUpload``), or ``None``.
+    :param int chunk_size: number of rows ``iter_chunks()`` yields at once.
+    :raises ValueError: if the CSV lacks a column we need.
+    """
+
+    def __init__(self, path, field, title_field=None, metadata_schema=None, urls=False, chunk_size=DefaultChunkSize, shard_field=None):
+        self.path = path
+        self.field = field
+        self.title_field = title_field or field
+        self.urls = urls
+        self.shard_field = shard_field
+        self.chunk_size = chunk_size
+
+        with open(path, encoding='utf-8', newline='') as f:
+            header = next(csv.reader(f), [])
+        columns = dict((name, i) for i, name in reversed(list(enumerate(header))))
+
+        for name in (field, self.title_field, shard_field):
+            if name is not None and name not in columns:
+                raise ValueError('The CSV does not contain a `{}` column'.format(name))
+
+        if metadata_schema is None:
+            names = header
+        else:
+            names = [ f['name'] for f in metadata_schema['fields'] ]
+            missing = [ name for name in names if name not in columns ]
+            if missing:
+                raise ValueError('The metadata schema has field(s) the CSV does not contain: {}'.format(', '.join(missing)))
+
+        self.n_columns = len(header)
+        self._field_index = columns[field]
+        self._title_index = columns[self.title_field]
+        self._shard_index = columns[shard_field] if shard_field is not None else None
+        # Encode each metadata key once, not once per row
+        self._metadata = [ (_encode_str(name) + ':', columns[name]) for name in names ]
+
+    def _row_error(self, row):
+        if len(row) != self.n_columns:
+            return 'expected {} values, got {}'.format(self.n_columns, len(row))
+
+        value = row[self._field_index].strip()
+        if not value:
+            return 'missing value for {}'.format(self.field)
+        if not row[self._title_index]:
+            return 'missing value for {}'.format(self.title_field)
+        if self._shard_index is not None and not row[self._shard_index].strip():
+            return 'missing value for {}'.format(self.shard_field)
+
+        if self.urls:
+            try:
+                parts = urllib.parse.urlparse(value)
+            except ValueError:
+                return '"{}" is not a valid URL'.format(value)
+            if parts.scheme not in ('http', 'https'):
+                return '"{}" does not start with http: or https:'.format(value)
+            if not parts.netloc:
+                return '"{}" does not include a network location'.format(value)
+
+        return None
+
+    def _metadata_json(self, row):
+        if not self._metadata:
+            return None
+        return '{' + ','.join(key + _encode_str(row[i]) for key, i in self._metadata) + '}'
+
+    def _iter_rows(self):
+        with open(self.path, encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None) # header
+            for line_number, row in enumerate(reader, 1):
+                if row: # csv.reader yields [] for a blank line
+                    yield line_number, row
+
+    def validate(self, max_errors=None):
+        """Read the whole CSV, and find its invalid rows.
+
+        :param int max_errors: stop collecting invalid rows after this many
+            (but keep counting them), or ``None`` for no limit.
+        :return: ``(invalid_rows, n_invalid, n_valid)``, where
+            ``invalid_rows`` is a list of ``(line_number, message)`` pairs.
+        """
+        invalid_rows = []
+        n_invalid = 0
+        n_valid = 0
+        for line_number, row in self._iter_rows():
+            error = self._row_error(row)
+            if error is None:
+                n_valid += 1
+                continue
+            n_invalid += 1
+            if max_errors is None or len(invalid_rows) < max_errors:
+                invalid_rows.append((line_number, error))
+        return invalid_rows, n_invalid, n_valid
+
+    def iter_chunks(self):
+        """Yield lists of up to ``chunk_size`` valid CsvRows, skipping invalid rows."""
+        chunk = []
+        for line_number, row in self._iter_rows():
+            if self._row_error(row) is None:
+                shard = row[self._shard_index].strip() if self._shard_index is not None else None
+                chunk.append(CsvRow(line_number, row[self._field_index].strip(), row[self._title_index], self._metadata_json(row), shard))
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
@@ -1,7 +1,7 @@
 import logging
-import requests
+from overview_upload._session import create_session
 
-def create_document_set(server_url, api_token, title, metadata_schema={'version':1,'fields':[]}, logger=None):
+def create_document_set(server_url, api_token, title, metadata_schema={'version':1,'fields':[]}, logger=None, session=None):
     """Create a DocumentSet on the Overview server.
 
     :param str server_url: Website URL. For example:
@@ -12,13 +12,22 @@ def create_document_set(server_url, api_token, title, metadata_schema={'version'
     :param str title: Title to give the new document set.
     :param dict metadata_schema: Initial metadata schema for the document set.
     :param Logger logger: Where to log activities.
+    :param requests.Session session: HTTP session to send the request with
+        (for instance, the one you will pass to ``Upload``), or ``None`` to
+        use a one-off session. A session from ``create_session()`` retries
+        this request only if it failed to connect, so it never creates two
+        document sets.
     """
+    if session is None:
+        with create_session(pool_size=1) as session:
+            return create_document_set(server_url, api_token, title, metadata_schema=metadata_schema, logger=logger, session=session)
+
     if logger is None:
         logger = logging.getLogger('{}.create_document_set'.format(__name__))
 
     url = '{}/api/v1/document-sets'.format(server_url)
     logger.debug('POST %s', url)
-    r = requests.request('POST', url,
+    r = session.request('POST', url,
         headers={
             'Accept': 'application/json',
             'X-Requested-With': 'overview_upload',
@@ -0,0 +1,89 @@
+import base64
+import binascii
+import hashlib
+import re
+
+_Md5EtagPattern = re.compile(r'^"([0-9a-fA-F]{32})"$')
+
+class ChecksumMismatchError(ValueError):
+    """A download's bytes don't match the MD5 its server advertised."""
+
+def content_length(response):
+    """Return the Content-Length of an HTTP response, or None."""
+    value = response.headers.get('Content-Length')
+    try:
+        n_bytes = int(value)
+    except (TypeError, ValueError):
+        return None
+    return n_bytes if n_bytes >= 0 else None
+
+def strong_etag(response):
+    """Return the ETag of an HTTP response, or None if it's missing or weak.
+
+    A strong ETag changes whenever the bytes change, so it can stand in for
+    the bytes when we cache a sha1.
+    """
+    etag = response.headers.get('ETag')
+    if not etag or etag.startswith('W/'):
+        return None
+    return etag
+
+def content_md5(response):
+    """Return the hex MD5 an HTTP response advertises, or None.
+
+    We read ``Content-MD5``, or an ETag that is a bare MD5 (as S3 sends for
+    objects that weren't uploaded in parts).
+    """
+    value = response.headers.get('Content-MD5')
+    if value:
+        try:
+            digest = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            digest = b''
+        if len(digest) == 16:
+            return binascii.hexlify(digest).decode('ascii')
+
+    match = _Md5EtagPattern.match(response.headers.get('ETag') or '')
+    if match:
+        return match.group(1).lower()
+
+    return None
+
+class VerifyingReader:
+    """Wraps a stream and checks its MD5 and length as it is read.
+
+    Reading the final (empty) chunk raises ChecksumMismatchError if the bytes
+    don't match ``md5`` or ``n_bytes``; so does reading past ``n_bytes``.
+    Copy the stream before sending it anywhere that would keep a corrupt
+    copy: the MD5 can only be checked once it has all been read.
+
+    :param in_file: stream to read.
+    :param str md5: expected hex MD5, or ``None``.
+    :param int n_bytes: expected length, or ``None``.
+    :param str name: what to call the stream in error messages.
+    """
+
+    def __init__(self, in_file, md5, n_bytes, name):
+        self.in_file = in_file
+        self.md5 = md5
+        self.n_bytes = n_bytes
+        self.name = name
+        self._m = hashlib.md5()
+        self._n_read = 0
+
+    def read(self, size=-1):
+        chunk = self.in_file.read(size)
+        if chunk:
+            self._m.update(chunk)
+            self._n_read += len(chunk)
+            if self.n_bytes is not None and self._n_read > self.n_bytes:
+                self._verify() # fail before passing on bytes we didn't expect
+        elif size != 0:
+            self._verify()
+        return chunk
+
+    def _verify(self):
+        if self.n_bytes is not None and self._n_read != self.n_bytes:
+            raise ChecksumMismatchError('{}: expected {} bytes, got {}'.format(self.name, self.n_bytes, self._n_read))
+        if self.md5 is not None and self._m.hexdigest() != self.md5:
+            raise ChecksumMismatchError('{}: expected MD5 {}, got {}'.format(self.name, self.md5, self._m.hexdigest()))
@@ -0,0 +1,250 @@
+import codecs
+import io
+import struct
+from overview_upload._results import ResultEmpty, ResultTooSmall, ResultTooLarge, ResultDeniedType
+
+# Bytes to read from the start of each file. Read-ahead fills a buffer
+# bigger than this anyway, and every signature we know fits in it.
+DefaultSniffSize = 4096
+
+# (offset, magic bytes, type): the first match wins
+_Signatures = [
+    (0, b'%PDF-', 'pdf'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'), # .doc, .xls, .ppt, .msg
+    (0, b'{\\rtf', 'rtf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'\xff\xd8\xff', 'jpeg'),
+    (0, b'GIF87a', 'gif'),
+    (0, b'GIF89a', 'gif'),
+    (0, b'II*\x00', 'tiff'),
+    (0, b'MM\x00*', 'tiff'),
+    (8, b'WEBP', 'webp'),
+    (0, b'\x1f\x8b', 'gzip'),
+    (0, b'BZh', 'bzip2'),
+    (0, b'\xfd7zXZ\x00', 'xz'),
+    (0, b'7z\xbc\xaf\x27\x1c', '7z'),
+    (0, b'Rar!\x1a\x07', 'rar'),
+    (0, b'SQLite format 3\x00', 'sqlite'),
+    (0, b'MZ', 'executable'),
+    (0, b'\x7fELF', 'executable'),
+    (0, b'\xfe\xed\xfa\xce', 'executable'), # Mach-O
+    (0, b'\xfe\xed\xfa\xcf', 'executable'),
+    (0, b'\xce\xfa\xed\xfe', 'executable'),
+    (0, b'\xcf\xfa\xed\xfe', 'executable'),
+    (0, b'ID3', 'media'),
+    (0, b'OggS', 'media'),
+    (0, b'fLaC', 'media'),
+    (4, b'ftyp', 'media'), # .mp4, .mov, .m4a
+    (8, b'WAVE', 'media'),
+    (8, b'AVI ', 'media'),
+    (0, b'\x1aE\xdf\xa3', 'media'), # .mkv, .webm
+]
+
+# Zip files whose first member shows they're office documents
+_ZipTypes = [
+    ('[Content_Types].xml', 'ooxml'), # .docx, .xlsx, .pptx
+    ('_rels/', 'ooxml'),
+    ('docProps/', 'ooxml'),
+    ('mimetype', 'odf'), # .odt, .ods, .odp
+]
+
+# Every type sniff_type() can return
+ContentTypes = frozenset([ t for _, _, t in _Signatures ] + [ t for _, t in _ZipTypes ] + [ 'zip', 'html', 'xml', 'text', 'unknown' ])
+
+# Formats Overview can't extract text from: the same kinds of files as
+# UnhandledExtensions, plus other archives, programs and media
+DefaultDeniedTypes = frozenset([ 'zip', 'gif', 'jpeg', 'png', 'tiff', 'webp', 'gzip', 'bzip2', 'xz', '7z', 'rar', 'sqlite', 'executable', 'media' ])
+
+def _sniff_zip(head):
+    # A local file header: the first member's name is at byte 30
+    if len(head) < 30:
+        return 'zip'
+    name_length = struct.unpack('<H', head[26:28])[0]
+    name = head[30:30 + name_length].decode('cp437')
+    for prefix, file_type in _ZipTypes:
+        if name.startswith(prefix):
+            return file_type
+    return 'zip'
+
+def _sniff_text(head):
+    if head.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'text' # UTF-16, with a byte-order mark
+    if b'\x00' in head:
+        return 'unknown'
+    try:
+        # final=False: head may end partway through a character
+        text = codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'unknown'
+    start = text.lstrip('\ufeff \t\r\n')[:14].lower()
+    if start.startswith(('<!doctype html', '<html')):
+        return 'html'
+    if start.startswith('<?xml'):
+        return 'xml'
+    return 'text'
+
+def sniff_type(head):
+    """Return a file's type, judging by its first bytes.
+
+    :param bytes head: the start of the file (a few KB is plenty).
+    :return: one of ``ContentTypes``: for instance ``"pdf"``, ``"jpeg"``,
+        ``"ooxml"`` (a ``.docx``, ``.xlsx`` or ``.pptx``), ``"text"``
+        (UTF-8 or UTF-16) or ``"unknown"``.
+    """
+    if head.startswith(b'PK\x03\x04'):
+        return _sniff_zip(head)
+    for offset, magic, file_type in _Signatures:
+        if head.startswith(magic, offset):
+            return file_type
+    if b'%PDF-' in head[:1024]:
+        return 'pdf' # PDF readers allow junk before the header
+    return _sniff_text(head)
+
+class _HeadReader:
+    """Reads ``head``, then the rest of ``in_file``.
+
+    Like ``_MemberFile``, it has a ``len`` so requests doesn't measure it.
+    """
+
+    def __init__(self, head, in_file, n_bytes):
+        self._head = head
+        self._in_file = in_file
+        self.len = n_bytes
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._in_file.read(size)
+        if size is None or size < 0:
+            chunk = self._head + self._in_file.read()
+            self._head = b''
+            return chunk
+        chunk = self._head[:size]
+        self._head = self._head[size:]
+        return chunk
+
+    def seekable(self):
+        return False
+
+def read_head(in_file, size, n_bytes=None):
+    """Return up to ``size`` bytes from the start of ``in_file``, without
+    using them up.
+
+    A buffered file (such as one ``open()`` returns, or an HTTP response)
+    gives us the bytes it has already read ahead, so sniffing costs no extra
+    I/O: the bytes are still there to hash and send. A seekable file is
+    read and rewound. Any other stream is read, and then replaced.
+
+    :param io.BufferedIOBase in_file: file to sniff.
+    :param int size: number of bytes we want.
+    :param int n_bytes: ``in_file``'s size, if known.
+    :return: ``(head, in_file)``. Read from the returned ``in_file`` from
+        now on: it may be a new object that returns ``head`` first.
+    """
+    peek = getattr(in_file, 'peek', None)
+    if peek is not None:
+        try:
+            head = peek(size)
+        except (io.UnsupportedOperation, ValueError):
+            head = None
+        if head is not None and (len(head) >= size or (n_bytes is not None and len(head) >= n_bytes)):
+            return head[:size], in_file
+        # A short peek (the read-ahead buffer was nearly used up): read below
+
+    seekable = getattr(in_file, 'seekable', None)
+    if seekable is not None and seekable():
+        position = in_file.tell()
+        head = in_file.read(size)
+        in_file.seek(position)
+        return head, in_file
+
+    head = in_file.read(size)
+    return head, _HeadReader(head, in_file, n_bytes)
+
+class ContentFilter:
+    """Decides which files to skip, by size and by what their first bytes
+    look like -- not by their names.
+
+    Files with the wrong extension (or none) are judged by their contents,
+    so we don't waste bandwidth and server time on files Overview can't
+    process. ``Upload(content_filter=...)`` checks each file's size before
+    reading it, and its first ``sniff_size`` bytes before hashing or sending
+    it. See ``sniff_type()`` for the types it recognizes.
+
+    :param set allow_types: if set, skip every file whose type isn't in it.
+    :param set deny_types: skip files of these types. Default
+        ``DefaultDeniedTypes``; pass ``()`` to sniff nothing.
+    :param int min_size: skip files smaller than this many bytes, or
+        ``None``.
+    :param int max_size: skip files larger than this many bytes, or
+        ``None``.
+    :param bool skip_empty: if ``True`` (the default), skip empty files.
+    :param int sniff_size: number of bytes to sniff.
+    :raises ValueError: if a type is not one of ``ContentTypes``.
+    """
+
+    def __init__(self, allow_types=None, deny_types=DefaultDeniedTypes, min_size=None, max_size=None, skip_empty=True, sniff_size=DefaultSniffSize):
+        for file_type in list(allow_types or ()) + list(deny_types or ()):
+            if file_type not in ContentTypes:
+                raise ValueError('Unknown content type "{}"; expected one of {}'.format(file_type, ', '.join(sorted(ContentTypes))))
+        self.allow_types = frozenset(allow_types) if allow_types is not None else None
+        self.deny_types = frozenset(deny_types or ())
+        self.min_size = min_size
+        self.max_size = max_size
+        self.skip_empty = skip_empty
+        self.sniff_size = sniff_size
+
+    @property
+    def sniffs(self):
+        """True if this filter needs to see files' first bytes."""
+        return self.allow_types is not None or bool(self.deny_types)
+
+    def check_size(self, n_bytes):
+        """Return why to skip a file of ``n_bytes`` bytes, or ``None``.
+
+        :return: ``ResultEmpty``, ``ResultTooSmall``, ``ResultTooLarge`` or
+            ``None``.
+        """
+        if n_bytes == 0 and self.skip_empty:
+            return ResultEmpty
+        if self.min_size is not None and n_bytes < self.min_size:
+            return ResultTooSmall
+        if self.max_size is not None and n_bytes > self.max_size:
+            return ResultTooLarge
+        return None
+
+    def check_head(self, head):
+        """Return ``(result, file_type)`` for a file that starts with ``head``.
+
+        :return: ``result`` is ``ResultEmpty``, ``ResultDeniedType`` or
+            ``None`` (to send the file); ``file_type`` is what
+            ``sniff_type()`` says, or ``None`` if the file is empty.
+        """
+        if not head:
+            return (ResultEmpty if self.skip_empty else None), None
+        file_type = sniff_type(head)
+        if file_type in self.deny_types or (self.allow_types is not None and file_type not in self.allow_types):
+            return ResultDeniedType, file_type
+        return None, file_type
+
+def build_content_filter(allow_types=None, deny_types=None, sniff_content=False, min_size=None, max_size=None, skip_empty=False):
+    """Return the ContentFilter command-line options ask for, or ``None`` if
+    they don't ask for one.
+
+    :param list allow_types: ``--allow-type`` values, or ``None``.
+    :param list deny_types: ``--deny-type`` values, or ``None``.
+    :param bool sniff_content: if ``True``, and no types are given, deny
+        ``DefaultDeniedTypes``.
+    :param int min_size: see ``ContentFilter``.
+    :param int max_size: see ``ContentFilter``.
+    :param bool skip_empty: see ``ContentFilter``.
+    :raises ValueError: if a type is not one of ``ContentTypes``.
+    """
+    if allow_types or deny_types:
+        deny_types = deny_types or ()
+    elif sniff_content:
+        deny_types = DefaultDeniedTypes
+    else:
+        deny_types = ()
+    if not (allow_types or deny_types or min_size or max_size or skip_empty):
+        return None
+    return ContentFilter(allow_types=allow_types, deny_types=deny_types, min_size=min_size, max_size=max_size, skip_empty=skip_empty)
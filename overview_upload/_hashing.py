@@ -0,0 +1,101 @@
+import hashlib
+import io
+import mmap
+import os
+import stat
+import tempfile
+
+DefaultReadSize = 1024 * 1024
+DefaultSpoolMaxMemory = 8 * 1024 * 1024
+
+def _hash_mmap(in_file, read_size):
+    """Return in_file's sha1 by mapping it into memory, or None if we can't.
+
+    Hashing a memory map skips copying each chunk into a Python bytes object,
+    and it doesn't move in_file's position.
+    """
+    try:
+        fileno = in_file.fileno()
+        if in_file.tell() != 0:
+            return None # the caller wants to hash from here on
+        stat_result = os.fstat(fileno)
+    except (AttributeError, OSError):
+        return None
+
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None # a pipe, socket, ...
+
+    m = hashlib.sha1()
+    if stat_result.st_size == 0:
+        return m.hexdigest() # mmap can't map an empty file
+
+    try:
+        mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return None
+
+    with mm:
+        if hasattr(mm, 'madvise'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mm) as view:
+            for offset in range(0, len(mm), read_size):
+                m.update(view[offset:offset + read_size])
+    return m.hexdigest()
+
+def hash_file(in_file, read_size=DefaultReadSize):
+    """Return the hex sha1 of in_file's contents.
+
+    If ``in_file`` is a regular file, it is hashed through a memory map
+    and its position is unchanged. Otherwise it is read to the end.
+
+    :param io.BufferedIOBase in_file: file to hash.
+    :param int read_size: number of bytes to hash at a time.
+    """
+    sha1 = _hash_mmap(in_file, read_size)
+    if sha1 is not None:
+        return sha1
+
+    m = hashlib.sha1()
+    for chunk in iter(lambda: in_file.read(read_size), b''):
+        m.update(chunk)
+    return m.hexdigest()
+
+def hash_path(path, read_size=DefaultReadSize):
+    """Return the hex sha1 of the file at path.
+
+    :param pathlib.Path path: file to hash.
+    :param int read_size: number of bytes to hash at a time.
+    """
+    with path.open('rb') as in_file:
+        return hash_file(in_file, read_size)
+
+def spool_file(in_file, read_size=DefaultReadSize, max_memory=DefaultSpoolMaxMemory):
+    """Copy in_file to a temporary file, calculating its size and sha1.
+
+    This reads ``in_file`` once, for streams that can't be read twice (such
+    as HTTP responses). The copy is an ``io.BytesIO`` up to ``max_memory``
+    bytes, and a temporary file on disk after that. Close it when done.
+
+    (We don't use ``tempfile.SpooledTemporaryFile``: ``requests`` calls its
+    ``fileno()``, which moves it to disk no matter how small it is.)
+
+    :param io.BufferedIOBase in_file: file to copy.
+    :param int read_size: number of bytes to read at a time.
+    :param int max_memory: number of bytes to hold in memory.
+    :return: ``(spooled_file, n_bytes, sha1)``, with ``spooled_file``
+        rewound to the beginning.
+    """
+    spooled_file = io.BytesIO()
+    m = hashlib.sha1()
+    n_bytes = 0
+    for chunk in iter(lambda: in_file.read(read_size), b''):
+        m.update(chunk)
+        n_bytes += len(chunk)
+        if n_bytes > max_memory and isinstance(spooled_file, io.BytesIO):
+            on_disk = tempfile.TemporaryFile()
+            on_disk.write(spooled_file.getbuffer())
+            spooled_file.close()
+            spooled_file = on_disk
+        spooled_file.write(chunk)
+    spooled_file.seek(0)
+    return spooled_file, n_bytes, m.hexdigest()
@@ -0,0 +1,87 @@
+import collections
+import json
+import os
+import threading
+
+JournalEntry = collections.namedtuple('JournalEntry', [ 'key', 'uuid', 'filename', 'sha1' ])
+
+class UploadJournal:
+    """Append-only record of files sent but not yet finish()ed.
+
+    Each line of the file is a JSON Object describing one completed
+    ``POST /api/v1/files/{uuid}``. If the program crashes, a new run can read
+    the journal, skip those files and ``finish()`` the rest. A line cut short
+    by the crash is removed when the journal is opened again.
+
+    :param str path: journal file to open or create.
+    :param bool fsync: if ``True``, flush every entry to disk before
+        continuing, so it survives a power failure (not just a crash). This
+        is slower.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                n_complete = 0 # bytes up to the end of the last whole line
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Cut short by a crash. Drop it, or the next entry
+                        # would be appended to it, and lost too.
+                        f.truncate(n_complete)
+                        break
+                    n_complete += len(line)
+                    try:
+                        entry = JournalEntry(**json.loads(line.decode('utf-8')))
+                    except (ValueError, TypeError):
+                        continue # garbled line
+                    self.entries[entry.key] = entry
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self.entries)
+
+    def record(self, key, uuid, filename, sha1):
+        """Remember that a file was sent.
+
+        :param str key: what identifies the source file across runs (for
+            instance, its absolute path or URL).
+        :param str uuid: the UUID we POSTed to.
+        :param str filename: the filename Overview will display.
+        :param str sha1: the file's sha1, or ``None``.
+        """
+        entry = JournalEntry(key, str(uuid), filename, sha1)
+        line = json.dumps(entry._asdict(), ensure_ascii=True) + '\n'
+        with self._lock:
+            self.entries[key] = entry
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def clear(self):
+        """Forget all entries: finish() added them, or they were deleted."""
+        with self._lock:
+            self.entries.clear()
+            self._file.truncate(0)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,215 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+DefaultCommitEvery = 1000
+DefaultTimeout = 5.0
+
+ManifestEntry = collections.namedtuple('ManifestEntry', [ 'path', 'size', 'mtime_ns', 'inode', 'sha1', 'status', 'updated_at' ])
+
+class Manifest:
+    """On-disk record of file hashes and upload statuses, in SQLite.
+
+    Each entry is keyed by absolute path and remembers the file's size, mtime
+    and inode when it was hashed. If any of those change, the entry no longer
+    applies and the file is hashed again.
+
+    The manifest also caches the sha1s of downloads, keyed by URL and ETag.
+
+    A manifest describes uploads to one document set: use a separate manifest
+    file per document set.
+
+    Processes uploading partitions of one upload (see ``Partition``) can
+    share a manifest, on one machine, if each passes ``commit_every=1``: a
+    batch holds SQLite's write lock until it is committed, and the other
+    processes can't write meanwhile. Each must ``commit()`` (or ``close()``)
+    before it reports that it is done.
+
+    :param str path: SQLite file to open or create.
+    :param int commit_every: number of writes to batch per transaction.
+    :param float timeout: seconds to wait for another process's
+        transaction to end, before raising ``sqlite3.OperationalError``.
+    """
+
+    # POSTed, but the document set won't contain it until finish()
+    StatusSent = 'sent'
+    # In the document set, because we uploaded it and called finish()
+    StatusUploaded = 'uploaded'
+    # In the document set, because somebody uploaded an identical file
+    StatusDuplicate = 'duplicate'
+
+    # Statuses that mean an unchanged file needn't be uploaded again
+    DoneStatuses = frozenset([ StatusUploaded, StatusDuplicate ])
+
+    # A ``timeout`` for processes that share a manifest: they write one row
+    # at a time, but there may be many of them
+    SharedTimeout = 60.0
+
+    def __init__(self, path, commit_every=DefaultCommitEvery, timeout=DefaultTimeout):
+        self.path = path
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._n_uncommitted = 0
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                sha1 TEXT,
+                status TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                size INTEGER,
+                sha1 TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def key(path):
+        """Return the string we store for a path."""
+        return os.path.abspath(str(path))
+
+    def lookup(self, path, stat_result):
+        """Return the ManifestEntry for path, or None if the file changed.
+
+        :param pathlib.Path path: file to look up.
+        :param os.stat_result stat_result: the file's current stats.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT * FROM files WHERE path = ?',
+                (self.key(path),)
+            ).fetchone()
+
+        if row is None:
+            return None
+        entry = ManifestEntry(*row)
+        if entry.size != stat_result.st_size or entry.mtime_ns != stat_result.st_mtime_ns or entry.inode != stat_result.st_ino:
+            return None
+        return entry
+
+    def record_hash(self, path, stat_result, sha1):
+        """Remember path's sha1.
+
+        The entry's status is kept if the sha1 did not change.
+        """
+        # Not an UPSERT (ON CONFLICT ... DO UPDATE): that needs SQLite 3.24,
+        # and some Pythons we support link an older one
+        key, size, mtime_ns, inode, sha1, _, updated_at = self._row(path, stat_result, sha1, None)
+        self._write("""
+            INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, sha1, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, (SELECT status FROM files WHERE path = ? AND sha1 = ?), ?)
+        """, (key, size, mtime_ns, inode, sha1, key, sha1, updated_at))
+
+    def record_status(self, path, stat_result, sha1, status):
+        """Remember path's sha1 (which may be None) and upload status."""
+        self._write(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, sha1, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self._row(path, stat_result, sha1, status)
+        )
+
+    def lookup_url(self, url, etag, n_bytes):
+        """Return the sha1 we saw when url had this ETag and size, or None."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, size, sha1 FROM urls WHERE url = ?',
+                (url,)
+            ).fetchone()
+
+        if row is None or row[0] != etag or row[1] != n_bytes:
+            return None
+        return row[2]
+
+    def record_url(self, url, etag, n_bytes, sha1):
+        """Remember the sha1 of url's bytes, while it has this ETag."""
+        self._write(
+            'INSERT OR REPLACE INTO urls (url, etag, size, sha1, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (url, etag, n_bytes, sha1, time.time())
+        )
+
+    def mark_sent_as_uploaded(self, paths=None):
+        """Record that finish() added sent files to the document set.
+
+        :param list paths: the files it added, if the manifest is shared by
+            several document sets; or ``None`` for every sent file.
+        """
+        if paths is None:
+            self._write('UPDATE files SET status = ? WHERE status = ?', (self.StatusUploaded, self.StatusSent))
+        else:
+            self._write_many('UPDATE files SET status = ? WHERE status = ? AND path = ?', [ (self.StatusUploaded, self.StatusSent, self.key(path)) for path in paths ])
+        self.commit()
+
+    def forget_sent(self, paths=None):
+        """Record that sent-but-unfinished files were deleted from the server.
+
+        :param list paths: the files deleted, if the manifest is shared by
+            several document sets; or ``None`` for every sent file.
+        """
+        if paths is None:
+            self._write('UPDATE files SET status = NULL WHERE status = ?', (self.StatusSent,))
+        else:
+            self._write_many('UPDATE files SET status = NULL WHERE status = ? AND path = ?', [ (self.StatusSent, self.key(path)) for path in paths ])
+        self.commit()
+
+    def remove(self, path):
+        self._write('DELETE FROM files WHERE path = ?', (self.key(path),))
+
+    def entries(self, status=None):
+        """Return all ManifestEntries, ordered by path.
+
+        :param str status: only return entries with this status.
+        """
+        with self._lock:
+            if status is None:
+                rows = self._db.execute('SELECT * FROM files ORDER BY path').fetchall()
+            else:
+                rows = self._db.execute('SELECT * FROM files WHERE status = ? ORDER BY path', (status,)).fetchall()
+        return [ ManifestEntry(*row) for row in rows ]
+
+    def count_by_status(self):
+        """Return a dict of status => number of entries (status may be None)."""
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall())
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+            self._n_uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _row(self, path, stat_result, sha1, status):
+        return (self.key(path), stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, sha1, status, time.time())
+
+    def _write(self, sql, params):
+        self._write_many(sql, [ params ])
+
+    def _write_many(self, sql, params_list):
+        with self._lock:
+            self._db.executemany(sql, params_list)
+            self._n_uncommitted += len(params_list)
+            if self._n_uncommitted >= self.commit_every:
+                self._db.commit()
+                self._n_uncommitted = 0
@@ -0,0 +1,290 @@
+import collections
+import json
+import sys
+import threading
+import time
+
+# Upper bounds (in seconds) of latency histogram buckets
+DefaultBuckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+# Events an Upload reports to observers, with their data
+EventHashed = 'hashed' # filename, n_bytes, seconds
+EventDuplicateCheck = 'duplicate_check' # sha1, source ('local' or 'server'), seconds
+EventUploaded = 'uploaded' # filename, n_bytes, n_bytes_sent, seconds
+EventCompressed = 'compressed' # filename, encoding, level, file_type, n_bytes, n_bytes_compressed, seconds, sent (False if it wasn't worth it, or the server refused it)
+EventSkipped = 'skipped' # filename, reason (and n_bytes or file_type, if a ContentFilter skipped it)
+EventFailed = 'failed' # filename, error
+
+class Histogram:
+    """Counts observations (such as latencies) in buckets."""
+
+    def __init__(self, buckets=DefaultBuckets):
+        self.buckets = buckets
+        self.bucket_counts = [ 0 ] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def to_dict(self):
+        """Return count, sum and cumulative bucket counts (as Prometheus does)."""
+        cumulative = []
+        total = 0
+        for bound, n in zip(self.buckets, self.bucket_counts):
+            total += n
+            cumulative.append(('+Inf' if bound == float('inf') else bound, total))
+        return { 'count': self.count, 'sum': self.sum, 'buckets': cumulative }
+
+class Metrics:
+    """Counters and latency histograms describing an upload.
+
+    ``Upload`` calls ``record()`` for each event. That updates the counters
+    and histograms, then passes the event to every observer. Everything here
+    is thread-safe.
+
+    Counters:
+
+    * ``files_total{result=...}``: files by what happened to them.
+      ``uploaded``, or why they were skipped: ``duplicate``,
+      ``unhandled_extension``, ``unchanged``, ``already_sent``, ``hidden``,
+      ``excluded``, ``too_large``, or ``failed``.
+    * ``bytes_uploaded_total`` and ``bytes_hashed_total``.
+    * ``bytes_sent_total``: bytes uploaded, as sent (after compression).
+    * ``duplicate_checks_total{source=...}``: ``local`` or ``server``.
+    * ``files_compressed_total{sent=...}``: files compressed, and whether
+      the compressed bytes were sent (``true``) or weren't worth it
+      (``false``).
+    * ``bytes_compressed_total`` and ``bytes_compressed_sent_total``:
+      original and compressed sizes of files sent compressed.
+
+    Histograms: ``hash_seconds``, ``duplicate_check_seconds`` (server checks
+    only), ``compress_seconds`` and ``upload_seconds``.
+    """
+
+    def __init__(self, buckets=DefaultBuckets):
+        self.buckets = buckets
+        self.started_at = time.time()
+        self.counters = collections.Counter() # (name, labels) => value
+        self.histograms = collections.OrderedDict() # name => Histogram
+        self._observers = []
+        self._lock = threading.Lock()
+
+    def add_observer(self, callback):
+        """Call ``callback(event, data)`` for each event.
+
+        ``event`` is one of the ``Event*`` constants and ``data`` is a dict.
+        Callbacks run on whichever thread handled the file, so they should be
+        quick and thread-safe.
+        """
+        with self._lock:
+            self._observers.append(callback)
+
+    def remove_observer(self, callback):
+        with self._lock:
+            self._observers.remove(callback)
+
+    def record(self, event, **data):
+        """Count an event and tell observers about it."""
+        with self._lock:
+            if event == EventHashed:
+                self._increment('bytes_hashed_total', (), data['n_bytes'])
+                self._observe('hash_seconds', data['seconds'])
+            elif event == EventDuplicateCheck:
+                self._increment('duplicate_checks_total', (('source', data['source']),))
+                if data['source'] == 'server':
+                    self._observe('duplicate_check_seconds', data['seconds'])
+            elif event == EventUploaded:
+                self._increment('files_total', (('result', 'uploaded'),))
+                self._increment('bytes_uploaded_total', (), data['n_bytes'])
+                self._increment('bytes_sent_total', (), data.get('n_bytes_sent', data['n_bytes']))
+                self._observe('upload_seconds', data['seconds'])
+            elif event == EventCompressed:
+                self._increment('files_compressed_total', (('sent', 'true' if data['sent'] else 'false'),))
+                if data['sent']:
+                    self._increment('bytes_compressed_total', (), data['n_bytes'])
+                    self._increment('bytes_compressed_sent_total', (), data['n_bytes_compressed'])
+                self._observe('compress_seconds', data['seconds'])
+            elif event == EventSkipped:
+                self._increment('files_total', (('result', data['reason']),))
+            elif event == EventFailed:
+                self._increment('files_total', (('result', 'failed'),))
+            observers = list(self._observers)
+
+        for observer in observers:
+            observer(event, data)
+
+    def count(self, name, **labels):
+        """Return a counter's value, for instance ``count('files_total', result='uploaded')``."""
+        with self._lock:
+            return self.counters[(name, tuple(sorted(labels.items())))]
+
+    def _increment(self, name, labels, n=1):
+        self.counters[(name, labels)] += n
+
+    def _observe(self, name, value):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self.buckets)
+        self.histograms[name].observe(value)
+
+    def summary(self):
+        """Return a one-line, human-readable summary of the upload so far.
+
+        Comparing total time spent hashing, checking and uploading shows
+        whether the disk, the CPU or the server limited the run.
+        """
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            n_uploaded = self.counters[('files_total', (('result', 'uploaded'),))]
+            n_bytes = self.counters[('bytes_uploaded_total', ())]
+            skipped = sorted((labels[0][1], v) for (name, labels), v in self.counters.items() if name == 'files_total' and labels != (('result', 'uploaded'),) and v)
+            n_skipped = sum(v for _, v in skipped)
+            seconds = dict((name, h.sum) for name, h in self.histograms.items())
+            n_bytes_sent = self.counters[('bytes_sent_total', ())]
+            n_bytes_compressed = self.counters[('bytes_compressed_total', ())]
+            n_bytes_compressed_sent = self.counters[('bytes_compressed_sent_total', ())]
+
+        # Say why files were skipped: "3 skipped (1 duplicate, 2 empty)"
+        reasons = ' ({})'.format(', '.join('{} {}'.format(v, reason) for reason, v in skipped)) if skipped else ''
+
+        line = '{} file(s) uploaded ({:.1f} MB, {:.2f} MB/s, {:.1f} files/s), {} skipped{} in {:.1f}s; time spent hashing {:.1f}s, checking duplicates {:.1f}s, uploading {:.1f}s'.format(
+            n_uploaded,
+            n_bytes / 1e6,
+            n_bytes / 1e6 / elapsed,
+            n_uploaded / elapsed,
+            n_skipped,
+            reasons,
+            elapsed,
+            seconds.get('hash_seconds', 0.0),
+            seconds.get('duplicate_check_seconds', 0.0),
+            seconds.get('upload_seconds', 0.0)
+        )
+
+        if 'compress_seconds' in seconds:
+            # Time saved: the bytes we didn't send, at the speed we sent the
+            # rest, less the time spent compressing
+            upload_seconds = seconds.get('upload_seconds', 0.0)
+            bytes_per_second = n_bytes_sent / upload_seconds if upload_seconds else 0.0
+            saved = (n_bytes_compressed - n_bytes_compressed_sent) / bytes_per_second if bytes_per_second else 0.0
+            line += '; compressed {:.1f} MB to {:.1f} MB ({:.0%}) in {:.1f}s, saving about {:.1f}s of uploading net'.format(
+                n_bytes_compressed / 1e6,
+                n_bytes_compressed_sent / 1e6,
+                n_bytes_compressed_sent / n_bytes_compressed if n_bytes_compressed else 1.0,
+                seconds['compress_seconds'],
+                saved - seconds['compress_seconds']
+            )
+        return line
+
+    def to_json_lines(self):
+        """Return all metrics as JSON Lines: one JSON Object per line."""
+        with self._lock:
+            lines = [ json.dumps({ 'name': name, 'labels': dict(labels), 'value': value }) for (name, labels), value in sorted(self.counters.items()) ]
+            for name, histogram in self.histograms.items():
+                d = histogram.to_dict()
+                d['buckets'] = [ [ str(bound), n ] for bound, n in d['buckets'] ]
+                d['name'] = name
+                lines.append(json.dumps(d))
+            lines.append(json.dumps({ 'name': 'elapsed_seconds', 'labels': {}, 'value': time.time() - self.started_at }))
+        return ''.join(line + '\n' for line in lines)
+
+    def to_prometheus_text(self, prefix='overview_upload_'):
+        """Return all metrics in the Prometheus text exposition format."""
+        def format_labels(labels):
+            if not labels:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels) + '}'
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append('# TYPE {}{} counter'.format(prefix, name))
+                    seen.add(name)
+                lines.append('{}{}{} {}'.format(prefix, name, format_labels(labels), value))
+            for name, histogram in self.histograms.items():
+                d = histogram.to_dict()
+                lines.append('# TYPE {}{} histogram'.format(prefix, name))
+                for bound, n in d['buckets']:
+                    lines.append('{}{}_bucket{{le="{}"}} {}'.format(prefix, name, bound, n))
+                lines.append('{}{}_sum {}'.format(prefix, name, d['sum']))
+                lines.append('{}{}_count {}'.format(prefix, name, d['count']))
+            lines.append('# TYPE {}elapsed_seconds gauge'.format(prefix))
+            lines.append('{}elapsed_seconds {}'.format(prefix, time.time() - self.started_at))
+        return ''.join(line + '\n' for line in lines)
+
+    def write(self, path):
+        """Write metrics to path: Prometheus text if it ends in ``.prom``,
+        JSON Lines otherwise."""
+        text = self.to_prometheus_text() if str(path).endswith('.prom') else self.to_json_lines()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+class ProgressDisplay:
+    """Observer that shows a one-line, live progress report.
+
+    Pass it to ``Upload.add_observer()``, and call ``close()`` at the end.
+
+    :param file stream: where to write (default ``sys.stderr``).
+    :param int total_files: number of files expected, if known, for an ETA.
+    :param float interval: minimum seconds between redraws.
+    """
+
+    def __init__(self, stream=None, total_files=None, interval=1.0):
+        self.stream = stream if stream is not None else sys.stderr
+        self.total_files = total_files
+        self.interval = interval
+        self.started_at = time.time()
+        self.n_uploaded = 0
+        self.n_skipped = 0
+        self.n_failed = 0
+        self.n_bytes = 0
+        self._last_drawn_at = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, event, data):
+        with self._lock:
+            if event == EventUploaded:
+                self.n_uploaded += 1
+                self.n_bytes += data['n_bytes']
+            elif event == EventSkipped:
+                self.n_skipped += 1
+            elif event == EventFailed:
+                self.n_failed += 1
+            else:
+                return
+
+            now = time.time()
+            if now - self._last_drawn_at >= self.interval:
+                self._last_drawn_at = now
+                self._draw(now)
+
+    def _draw(self, now):
+        elapsed = max(now - self.started_at, 1e-9)
+        n_done = self.n_uploaded + self.n_skipped + self.n_failed
+        line = '{} uploaded, {} skipped, {} failed | {:.1f} MB at {:.2f} MB/s'.format(
+            self.n_uploaded,
+            self.n_skipped,
+            self.n_failed,
+            self.n_bytes / 1e6,
+            self.n_bytes / 1e6 / elapsed
+        )
+        if self.total_files:
+            line += ' | {}/{} files'.format(n_done, self.total_files)
+            if n_done > 0 and n_done < self.total_files:
+                eta = elapsed / n_done * (self.total_files - n_done)
+                line += ', ETA {:d}:{:02d}:{:02d}'.format(int(eta // 3600), int(eta % 3600 // 60), int(eta % 60))
+        self.stream.write('\r' + line + '\x1b[K')
+        self.stream.flush()
+
+    def close(self):
+        """Draw the final numbers and end the line."""
+        with self._lock:
+            self._draw(time.time())
+            self.stream.write('\n')
+            self.stream.flush()
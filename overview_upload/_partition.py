@@ -0,0 +1,229 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import zlib
+
+class Partition:
+    """One of ``count`` parts of an upload, numbered from 1.
+
+    Several processes (on one machine, or on several sharing a filesystem)
+    can each upload one partition of the same directory or CSV, to the same
+    document set. Every process must see the same files: the partitions are
+    deterministic.
+
+    :param int number: this partition, from 1 to ``count``.
+    :param int count: number of partitions.
+    """
+
+    def __init__(self, number, count):
+        if not 1 <= number <= count:
+            raise ValueError('Partition number must be between 1 and {}'.format(count))
+        self.number = number
+        self.count = count
+
+    @classmethod
+    def parse(cls, s):
+        """Parse ``"K/N"`` (for instance, ``"2/4"``).
+
+        :raises ValueError: if ``s`` is not a valid partition.
+        """
+        try:
+            number, count = (int(part) for part in s.split('/'))
+        except ValueError:
+            raise ValueError('Partition must look like "K/N", such as "2/4"; got "{}"'.format(s))
+        return cls(number, count)
+
+    @property
+    def is_coordinator(self):
+        """True for partition 1, which clears and finishes the upload."""
+        return self.number == 1
+
+    def contains_path(self, filename):
+        """Return True if this partition should upload the file.
+
+        Files are assigned by a hash of ``filename`` (with ``/`` separators,
+        so Windows and Unix hosts agree).
+
+        :param str filename: path relative to the directory being uploaded.
+        """
+        key = filename.replace(os.sep, '/').encode('utf-8')
+        return zlib.crc32(key) % self.count == self.number - 1
+
+    def row_range(self, n_rows):
+        """Return ``(start, stop)``: this partition's rows, as a ``range()``.
+
+        Each partition gets a contiguous run of about ``n_rows / count``
+        rows.
+        """
+        return (self.number - 1) * n_rows // self.count, self.number * n_rows // self.count
+
+    def __str__(self):
+        return '{}/{}'.format(self.number, self.count)
+
+class Coordination:
+    """Lets the partitions of an upload report to each other, through files
+    in a directory they all share.
+
+    1. The coordinator (partition 1) clears the previous upload and calls
+       ``start()``. Other partitions call ``start()`` first: it waits for
+       the coordinator, so it can't clear their files.
+    2. Each partition uploads its files.
+    3. The other partitions ``report_done()``. The coordinator calls
+       ``wait_for_workers()``, then ``Upload.finish()``, then
+       ``mark_finished()``.
+
+    Use a new (or empty) directory for each upload: ``start()`` raises an
+    error if the directory holds another upload's files.
+
+    :param str dirname: directory every partition can read and write.
+    :param Partition partition: this process's partition.
+    :param float poll_interval: seconds between looks at the directory.
+    """
+
+    def __init__(self, dirname, partition, poll_interval=1.0):
+        self.dirname = dirname
+        self.partition = partition
+        self.poll_interval = poll_interval
+
+    def _path(self, name):
+        return os.path.join(self.dirname, name)
+
+    def _write(self, name, data):
+        # Write, then rename: nobody reads a half-written file
+        tmp_path = self._path('.{}.{}.tmp'.format(name, os.getpid()))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(name))
+
+    def _read(self, name):
+        try:
+            with open(self._path(name), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _done_name(self, number):
+        return 'done-{}-of-{}.json'.format(number, self.partition.count)
+
+    def start(self, timeout=None):
+        """Announce the coordinator; or, in other partitions, wait for it.
+
+        :param float timeout: seconds to wait, or ``None`` to wait forever.
+        :raises RuntimeError: if the directory holds another upload's files.
+        :raises TimeoutError: if the coordinator doesn't start in time.
+        """
+        if self.partition.is_coordinator:
+            os.makedirs(self.dirname, exist_ok=True)
+            if self._read('started.json') is not None:
+                raise RuntimeError('{} was used by another upload; use a new directory'.format(self.dirname))
+            self._write('started.json', { 'count': self.partition.count, 'pid': os.getpid() })
+            return
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self._read('finished.json') is not None:
+                raise RuntimeError('{} was used by another upload; use a new directory'.format(self.dirname))
+            started = self._read('started.json')
+            if started is not None:
+                if started['count'] != self.partition.count:
+                    raise RuntimeError('The coordinator expects {} partitions, not {}'.format(started['count'], self.partition.count))
+                return
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError('Partition 1 did not start within {}s'.format(timeout))
+            time.sleep(self.poll_interval)
+
+    def report_done(self, n_uploaded, n_failed, error=None):
+        """Tell the coordinator this partition is done (or failed).
+
+        :param int n_uploaded: files this partition uploaded.
+        :param int n_failed: files that failed to upload.
+        :param str error: the error that stopped this partition, or ``None``.
+        """
+        self._write(self._done_name(self.partition.number), {
+            'partition': self.partition.number,
+            'n_uploaded': n_uploaded,
+            'n_failed': n_failed,
+            'error': error,
+        })
+
+    def read_report(self, number):
+        """Return what partition ``number`` reported, or ``None`` if it
+        hasn't reported yet."""
+        return self._read(self._done_name(number))
+
+    def wait_for_workers(self, timeout=None):
+        """In the coordinator, wait until every other partition is done.
+
+        :param float timeout: seconds to wait, or ``None`` to wait forever.
+        :return: every other partition's report: a list of dicts with
+            ``partition``, ``n_uploaded``, ``n_failed`` and ``error``.
+        :raises TimeoutError: if a partition doesn't report in time.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        reports = {}
+        while True:
+            for number in range(2, self.partition.count + 1):
+                if number not in reports:
+                    report = self.read_report(number)
+                    if report is not None:
+                        reports[number] = report
+            if len(reports) == self.partition.count - 1:
+                return [ reports[number] for number in sorted(reports) ]
+            if deadline is not None and time.time() > deadline:
+                missing = sorted(set(range(2, self.partition.count + 1)) - set(reports))
+                raise TimeoutError('Partition(s) {} did not finish within {}s'.format(', '.join(map(str, missing)), timeout))
+            time.sleep(self.poll_interval)
+
+    def mark_finished(self):
+        """In the coordinator, record that the upload is finished."""
+        self._write('finished.json', { 'count': self.partition.count })
+
+def run_partitions(argv, n_workers, coordination_dir, poll_interval=1.0):
+    """Run a script once per partition, in parallel, and wait for them all.
+
+    Each process runs ``argv`` plus ``--partition K/N --coordination-dir
+    DIR``.
+
+    A process that exits without reporting to partition 1 (because it
+    crashed, or was killed) is reported as failed on its behalf, so
+    partition 1 doesn't wait for it forever. If partition 1 exits with an
+    error, the others are terminated: nobody would finish their upload.
+
+    :param list argv: the script and its arguments, as in ``sys.argv``.
+    :param float poll_interval: seconds between checks on the processes.
+    :return: the highest exit status.
+    """
+    os.makedirs(coordination_dir, exist_ok=True) # we may report before part 1 starts
+    partitions = [ Partition(number, n_workers) for number in range(1, n_workers + 1) ]
+    processes = [
+        subprocess.Popen([ sys.executable ] + list(argv) + [
+            '--partition', str(partition),
+            '--coordination-dir', coordination_dir,
+        ])
+        for partition in partitions
+    ]
+
+    statuses = [ None ] * n_workers
+    while True:
+        for i, (partition, process) in enumerate(zip(partitions, processes)):
+            if statuses[i] is not None:
+                continue
+            status = process.poll()
+            if status is None:
+                continue
+            statuses[i] = status
+
+            coordination = Coordination(coordination_dir, partition)
+            if partition.is_coordinator:
+                if status != 0:
+                    for other in processes:
+                        if other.poll() is None:
+                            other.terminate()
+            elif coordination.read_report(partition.number) is None:
+                coordination.report_done(0, 0, error='exited with status {} without reporting'.format(status))
+
+        if None not in statuses:
+            return max(abs(status) for status in statuses)
+        time.sleep(poll_interval)
@@ -0,0 +1,412 @@
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from overview_upload._fetch import ChecksumMismatchError
+from overview_upload._results import ResultFailed, ResultCancelled
+
+DefaultMaxBytesInFlight = 256 * 1024 * 1024
+
+Stages = ('fetch', 'hash', 'upload')
+
+class _ByteBudget:
+    """Blocks callers while too many bytes are being processed at once.
+
+    A single item larger than the whole budget is still let through (alone),
+    so a huge file can't deadlock the upload.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, n_bytes):
+        with self.condition:
+            while self.n_bytes > 0 and self.n_bytes + n_bytes > self.max_bytes:
+                self.condition.wait()
+            self.n_bytes += n_bytes
+
+    def release(self, n_bytes):
+        with self.condition:
+            self.n_bytes -= n_bytes
+            self.condition.notify_all()
+
+class _Job:
+    """A file (or files) for a Pipeline to send.
+
+    Each stage method runs on that stage's threads. A stage that decides the
+    job is done (for instance, because the file is a duplicate) sets
+    ``result``, and later stages are skipped.
+
+    After the job is done:
+
+    * ``result`` is a ``Result*`` constant, such as ``ResultUploaded``,
+      ``ResultFailed`` or ``ResultCancelled``.
+    * ``error`` is the exception that failed the job, or ``None``.
+    * ``tag`` is whatever the caller passed, such as a CSV line number.
+
+    ``target`` is the Upload that sends the job, or ``None`` for the
+    Pipeline's. One Pipeline can feed several document sets this way.
+    """
+
+    def __init__(self, filename, metadata=None, tag=None, target=None):
+        self.filename = filename
+        self.metadata = metadata
+        self.tag = tag
+        self.target = target
+        self.result = None
+        self.error = None
+        self.n_bytes = None # once fetched, if known
+        self.sha1 = None
+        self._reserved_bytes = 0 # of the Pipeline's max_bytes_in_flight
+
+    @property
+    def results(self):
+        """Count of results, for Pipeline.results."""
+        return collections.Counter([ self.result ])
+
+    def _target_upload(self, pipeline):
+        return self.target if self.target is not None else pipeline.upload
+
+    def fetch(self, pipeline):
+        pass
+
+    def hash(self, pipeline):
+        pass
+
+    def upload(self, pipeline):
+        pass
+
+    def close(self):
+        pass
+
+class PathJob(_Job):
+    """A local file for a Pipeline to send.
+
+    Its stages work like ``Upload.send_path_if_conditions_met()``: fetch
+    checks the journal and manifest, opens the file and sniffs it; hash
+    hashes it; upload sends it.
+
+    :param pathlib.Path path: file to send.
+    :param str filename: filename Overview should use.
+    :param dict metadata: metadata to set on the document, or ``None``.
+    :param str sha1: the file's sha1, if you already know it.
+    :param os.stat_result stat_result: ``path.stat()``, if you already
+        called it.
+    :param tag: anything, to identify the job in ``on_result``.
+    :param Upload target: what sends the file, or ``None`` (the default)
+        for the Pipeline's Upload.
+    """
+
+    def __init__(self, path, filename, metadata=None, sha1=None, stat_result=None, tag=None, target=None):
+        super().__init__(filename, metadata, tag, target)
+        self.path = path
+        self.sha1 = sha1
+        self.stat_result = stat_result
+        self.in_file = None
+
+    def fetch(self, pipeline):
+        upload = self._target_upload(pipeline)
+        self.result, self.stat_result, self.sha1 = upload._check_path(
+            self.path,
+            self.filename,
+            pipeline.skip_unhandled_extension,
+            pipeline.incremental,
+            self.sha1,
+            self.stat_result
+        )
+        if self.result is None:
+            self.n_bytes = self.stat_result.st_size
+            self.in_file = self.path.open('rb', buffering=upload.read_size)
+            self.result, self.in_file = upload._check_head(self.in_file, self.filename, self.n_bytes)
+
+    def hash(self, pipeline):
+        if pipeline.skip_duplicate and self.sha1 is None:
+            self.sha1 = self._target_upload(pipeline)._hash_path(self.path, self.stat_result, self.in_file)
+
+    def upload(self, pipeline):
+        self.result = self._target_upload(pipeline)._send_open_path(
+            self.path,
+            self.in_file,
+            self.filename,
+            self.stat_result,
+            self.sha1,
+            pipeline.skip_duplicate,
+            self.metadata
+        )
+
+    def close(self):
+        if self.in_file is not None:
+            self.in_file.close()
+
+class UrlJob(_Job):
+    """A download for a Pipeline to relay to Overview.
+
+    Its stages work like ``Upload.send_url_if_conditions_met()``: fetch
+    starts the download and sniffs it; hash copies it (if we need its sha1 and the
+    manifest doesn't know it, or to check its MD5 before sending it); upload
+    sends it.
+
+    :param str url: ``http:`` or ``https:`` URL to download.
+    :param str filename: filename Overview should use.
+    :param dict metadata: metadata to set on the document, or ``None``.
+    :param str journal_key: see ``Upload.send_url_if_conditions_met()``.
+    :param float timeout: seconds to wait for the source server.
+    :param tag: anything, to identify the job in ``on_result``.
+    :param Upload target: what sends the file, or ``None`` (the default)
+        for the Pipeline's Upload.
+    """
+
+    def __init__(self, url, filename, metadata=None, journal_key=None, timeout=None, tag=None, target=None):
+        super().__init__(filename, metadata, tag, target)
+        self.url = url
+        self.journal_key = journal_key if journal_key is not None else url
+        self.timeout = timeout
+        self.response = None
+        self.in_file = None
+        self.etag = None
+        self.md5 = None
+
+    def fetch(self, pipeline):
+        upload = self._target_upload(pipeline)
+        self.result = upload._check_before_reading(self.filename, self.journal_key, pipeline.skip_unhandled_extension)
+        if self.result is None:
+            self.response, self.in_file, self.n_bytes, self.etag, self.sha1, self.md5 = upload._open_url(self.url, pipeline.skip_duplicate, self.timeout)
+            self.result, self.in_file = upload._check_content(self.in_file, self.filename, self.n_bytes)
+
+    def hash(self, pipeline):
+        if self.md5 is None and (not pipeline.skip_duplicate or self.sha1 is not None):
+            return # relay it
+
+        upload = self._target_upload(pipeline)
+        size_was_unknown = self.n_bytes is None
+        try:
+            spooled_file, self.n_bytes, self.sha1 = upload._spool_url(self.url, self.filename, self.in_file, self.etag)
+        except ChecksumMismatchError as err:
+            self.result = upload._fail(self.filename, err)
+            return
+        self.response.close()
+        self.response = None
+        self.in_file = spooled_file
+        if size_was_unknown:
+            self.result = upload._check_size(self.filename, self.n_bytes)
+
+    def upload(self, pipeline):
+        try:
+            self.result = self._target_upload(pipeline)._hash_and_send_file(
+                self.in_file,
+                self.filename,
+                self.n_bytes,
+                pipeline.skip_duplicate,
+                self.metadata,
+                self.sha1,
+                self.journal_key
+            )
+        except ChecksumMismatchError as err:
+            self.result = self._target_upload(pipeline)._fail(self.filename, err)
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+        elif self.in_file is not None:
+            self.in_file.close() # the spooled copy
+
+class _ArchiveJob(_Job):
+    """An archive whose files Upload.send_directory() expands.
+
+    The upload stage sends all its files, one after another.
+    """
+
+    def __init__(self, path, filename_prefix, metadata, include, exclude, max_size, target=None):
+        super().__init__(filename_prefix, metadata, target=target)
+        self.path = path
+        self.include = include
+        self.exclude = exclude
+        self.max_size = max_size
+        self._results = collections.Counter()
+
+    @property
+    def results(self):
+        if self.result is not None:
+            return collections.Counter([ self.result ]) # failed or cancelled
+        return self._results
+
+    def upload(self, pipeline):
+        self._results = self._target_upload(pipeline).send_archive(
+            self.path,
+            self.filename,
+            skip_unhandled_extension=pipeline.skip_unhandled_extension,
+            skip_duplicate=pipeline.skip_duplicate,
+            metadata=self.metadata,
+            include=self.include,
+            exclude=self.exclude,
+            max_size=self.max_size
+        )
+
+class Pipeline:
+    """Sends files through fetch, hash and upload stages, each on its own
+    threads.
+
+    ``submit()`` jobs (``PathJob`` or ``UrlJob``), then ``drain()``. Each
+    stage has its own number of workers, so you can tune them separately:
+    for instance, many fetch workers for slow downloads, few hash workers
+    for a slow disk, and as many upload workers as the server can take.
+
+    ``submit()`` blocks while ``max_jobs_in_flight`` jobs are unfinished, or
+    while fetched files add up to more than ``max_bytes_in_flight`` bytes.
+    (A download whose size we don't know counts as ``spool_max_memory``.)
+    This keeps memory bounded no matter how many jobs you submit.
+
+    When a job is done, ``on_result(job)`` is called on whichever thread
+    finished it. ``results`` counts results.
+
+    If a job raises an error, it fails (``ResultFailed``, with the error in
+    ``job.error``). With ``stop_on_error`` (the default), the pipeline
+    then cancels: later ``submit()`` calls and ``drain()`` raise that
+    error. Otherwise it carries on.
+
+    ``cancel()`` stops jobs before their next stage: they finish as
+    ``ResultCancelled``. Files already being sent finish sending.
+
+    Use it as a context manager: on an exception (such as
+    ``KeyboardInterrupt``) it cancels, waits for running jobs and closes
+    its threads.
+
+    :param Upload upload: what sends files, unless a job has its own
+        ``target``. Its session should have at least ``upload_workers +
+        fetch_workers`` connections. ``None`` means every job has a target.
+    :param int fetch_workers: threads that open files and start downloads.
+    :param int hash_workers: threads that hash files (and copy downloads).
+    :param int upload_workers: threads that check for duplicates and send.
+    :param int max_bytes_in_flight: see above.
+    :param int max_jobs_in_flight: see above; default twice the number of
+        workers.
+    :param bool skip_unhandled_extension: see
+        ``Upload.send_file_if_conditions_met()``.
+    :param bool skip_duplicate: see ``Upload.send_file_if_conditions_met()``.
+    :param bool incremental: see ``Upload.send_path_if_conditions_met()``.
+    :param bool stop_on_error: see above.
+    :param function on_result: called with each finished job.
+    """
+
+    def __init__(self, upload, fetch_workers=4, hash_workers=2, upload_workers=4, max_bytes_in_flight=DefaultMaxBytesInFlight, max_jobs_in_flight=None, skip_unhandled_extension=True, skip_duplicate=True, incremental=False, stop_on_error=True, on_result=None):
+        self.upload = upload
+        self.skip_unhandled_extension = skip_unhandled_extension
+        self.skip_duplicate = skip_duplicate
+        self.incremental = incremental
+        self.stop_on_error = stop_on_error
+        self.on_result = on_result
+        self.results = collections.Counter()
+
+        if max_jobs_in_flight is None:
+            max_jobs_in_flight = (fetch_workers + hash_workers + upload_workers) * 2
+        self._slots = threading.BoundedSemaphore(max_jobs_in_flight)
+        self._budget = _ByteBudget(max_bytes_in_flight)
+        self._executors = [
+            ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='overview-upload-{}'.format(stage))
+            for stage, n_workers in zip(Stages, (fetch_workers, hash_workers, upload_workers))
+        ]
+
+        self._condition = threading.Condition() # guards everything below
+        self._n_unfinished = 0
+        self._cancelled = False
+        self._error = None
+
+    def submit(self, job):
+        """Queue a job, waiting while too many are unfinished.
+
+        :raises Exception: the error that stopped the pipeline, if any.
+        """
+        self._raise_error()
+        self._slots.acquire()
+        with self._condition:
+            self._n_unfinished += 1
+        self._executors[0].submit(self._run, job, 0)
+
+    def _run(self, job, stage_index):
+        """Run a job's stage on this thread, then queue its next stage."""
+        try:
+            if self._cancelled:
+                job.result = ResultCancelled
+            else:
+                getattr(job, Stages[stage_index])(self)
+                if stage_index == 0 and job.result is None:
+                    # Wait here, not in submit(): only now do we know the size
+                    n_bytes = job.n_bytes if job.n_bytes is not None else job._target_upload(self).spool_max_memory
+                    self._budget.acquire(n_bytes)
+                    job._reserved_bytes = n_bytes
+        except Exception as err:
+            job.result = ResultFailed
+            job.error = err
+            if self.stop_on_error:
+                self._stop(err)
+
+        if job.result is None and stage_index + 1 < len(Stages):
+            self._executors[stage_index + 1].submit(self._run, job, stage_index + 1)
+        else:
+            self._finish(job)
+
+    def _finish(self, job):
+        try:
+            job.close()
+        except Exception as err:
+            job._target_upload(self).logger.warning('Error closing %s: %s', job.filename, err)
+        if job._reserved_bytes:
+            self._budget.release(job._reserved_bytes)
+
+        try:
+            with self._condition:
+                self.results.update(job.results)
+            if self.on_result is not None:
+                self.on_result(job)
+        except Exception as err:
+            self._stop(err) # a bug in on_result should stop us, even without stop_on_error
+        finally:
+            self._slots.release()
+            with self._condition:
+                self._n_unfinished -= 1
+                self._condition.notify_all()
+
+    def _stop(self, err):
+        with self._condition:
+            if self._error is None:
+                self._error = err
+            self._cancelled = True
+
+    def _raise_error(self):
+        with self._condition:
+            err = self._error
+        if err is not None:
+            raise err
+
+    def cancel(self):
+        """Stop every job before its next stage."""
+        with self._condition:
+            self._cancelled = True
+
+    def _wait(self):
+        with self._condition:
+            while self._n_unfinished > 0:
+                self._condition.wait()
+
+    def drain(self):
+        """Wait for every submitted job to finish.
+
+        :raises Exception: the error that stopped the pipeline, if any.
+        """
+        self._wait()
+        self._raise_error()
+
+    def close(self):
+        """Wait for jobs, then stop the threads. Does not raise job errors."""
+        self._wait()
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.cancel()
+        self.close()
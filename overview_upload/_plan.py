@@ -0,0 +1,186 @@
+import collections
+import json
+import pathlib
+import shutil
+import tempfile
+from overview_upload._pipeline import PathJob, UrlJob, _ArchiveJob
+from overview_upload._results import ResultDuplicate
+
+PlanVersion = 1
+
+# What a plan entry's "kind" says to send
+KindPath = 'path'
+KindUrl = 'url'
+KindArchive = 'archive' # a local archive, whose files are checked when sent
+
+class Plan:
+    """What an upload would do, worked out without uploading anything.
+
+    ``Upload.plan_directory()`` and ``Upload.plan_paths()`` fill one in:
+    the files to send (with their sizes and sha1s), and how many files (and
+    bytes) would be skipped, and why. ``Upload.calibrate()`` measures the
+    server, so ``estimate_seconds()`` can say how long sending would take.
+
+    ``write()`` saves it as JSON Lines: a summary, then a line per file to
+    send. ``iter_plan_jobs()`` turns the file back into Pipeline jobs, to
+    upload exactly those files.
+
+    Entries are kept in a temporary file, not in memory, so a plan can list
+    millions of files. Call ``close()`` (or use it as a context manager) to
+    delete it.
+
+    :param str source: what the plan is for (a directory or a CSV).
+    :param dict options: ``include``, ``exclude`` and ``max_size``, which
+        apply to the files inside archives when the plan is sent.
+    """
+
+    def __init__(self, source=None, options=None):
+        self.source = source
+        self.options = options or {}
+        self.n_files = 0
+        self.n_bytes = 0
+        self.n_unknown_size = 0 # URLs: we don't know until we download them
+        self.skipped = collections.Counter() # reason => number of files
+        self.skipped_bytes = collections.Counter() # reason => bytes
+        self.calibration = None
+        self._entries = tempfile.TemporaryFile('w+', encoding='utf-8')
+
+    def add(self, kind, source, filename, n_bytes=None, sha1=None, metadata=None, mtime_ns=None):
+        """List a file to send.
+
+        :param str kind: ``"path"``, ``"url"`` or ``"archive"``.
+        :param str source: the file's path or URL.
+        :param str filename: filename Overview should use.
+        :param int n_bytes: the file's size, or ``None`` if unknown.
+        :param str sha1: the file's sha1, or ``None`` if unknown.
+        :param metadata: ``dict`` or JSON-encoded ``str``, or ``None``.
+        :param int mtime_ns: a local file's ``st_mtime_ns``: if it changes,
+            ``sha1`` is out of date.
+        """
+        self.n_files += 1
+        if n_bytes is None:
+            self.n_unknown_size += 1
+        else:
+            self.n_bytes += n_bytes
+        entry = { 'kind': kind, 'source': source, 'filename': filename, 'n_bytes': n_bytes, 'sha1': sha1 }
+        if metadata is not None:
+            entry['metadata'] = metadata
+        if mtime_ns is not None:
+            entry['mtime_ns'] = mtime_ns
+        self._entries.write(json.dumps(entry) + '\n')
+
+    def skip(self, reason, n_bytes=None):
+        """Count a file the upload would skip.
+
+        :param str reason: a result (such as ``ResultDuplicate``) or a walk
+            reason (such as ``"hidden"``).
+        :param int n_bytes: the file's size, if known.
+        """
+        self.skipped[reason] += 1
+        if n_bytes:
+            self.skipped_bytes[reason] += n_bytes
+
+    @property
+    def duplicate_ratio(self):
+        """Fraction of the files we'd send (or skip as duplicates) that are
+        duplicates."""
+        n_duplicates = self.skipped[ResultDuplicate]
+        n_checked = n_duplicates + self.n_files
+        return n_duplicates / n_checked if n_checked else 0.0
+
+    def estimate_seconds(self):
+        """Return about how long sending the plan would take, or ``None``
+        without a calibration.
+
+        The estimate is per-file overhead plus transfer time, at the
+        calibration's concurrency. It leaves out the bytes of files of
+        unknown size, and the duplicate checks the upload repeats.
+        """
+        if self.calibration is None:
+            return None
+        return self.n_files / self.calibration['files_per_second'] + self.n_bytes / self.calibration['bytes_per_second']
+
+    def summary(self):
+        """Return the plan's totals, as a dict that can be encoded as JSON."""
+        return {
+            'version': PlanVersion,
+            'source': self.source,
+            'options': self.options,
+            'files_to_upload': self.n_files,
+            'bytes_to_upload': self.n_bytes,
+            'files_of_unknown_size': self.n_unknown_size,
+            'files_skipped': dict(self.skipped),
+            'bytes_skipped': dict(self.skipped_bytes),
+            'duplicate_ratio': round(self.duplicate_ratio, 4),
+            'calibration': self.calibration,
+            'estimated_seconds': self.estimate_seconds(),
+        }
+
+    def write(self, path):
+        """Write the plan as JSON Lines: the summary, then a line per file."""
+        self._entries.flush()
+        self._entries.seek(0)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.summary()) + '\n')
+            shutil.copyfileobj(self._entries, f)
+        self._entries.seek(0, 2) # so add() appends
+
+    def close(self):
+        """Delete the temporary file listing the plan's files."""
+        self._entries.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_plan_summary(path):
+    """Return the summary line of a plan ``Plan.write()`` wrote.
+
+    :raises ValueError: if the file isn't a plan we can read.
+    """
+    with open(path, encoding='utf-8') as f:
+        line = f.readline()
+    try:
+        summary = json.loads(line)
+    except ValueError:
+        summary = None
+    if not isinstance(summary, dict) or summary.get('version') != PlanVersion:
+        raise ValueError('{} is not an upload plan (version {})'.format(path, PlanVersion))
+    return summary
+
+def iter_plan_jobs(path):
+    """Yield a Pipeline job for each file in a plan ``Plan.write()`` wrote.
+
+    Path jobs come with the sha1 the plan found, so they aren't hashed
+    again (unless the file's size or mtime changed). Each job is still
+    checked, for duplicates and against the journal, when it is sent: the
+    plan may be old.
+
+    :raises ValueError: if the file isn't a plan we can read.
+    """
+    options = read_plan_summary(path)['options']
+    with open(path, encoding='utf-8') as f:
+        next(f) # summary
+        for line in f:
+            entry = json.loads(line)
+            metadata = entry.get('metadata')
+            if entry['kind'] == KindUrl:
+                yield UrlJob(entry['source'], entry['filename'], metadata=metadata)
+            elif entry['kind'] == KindArchive:
+                yield _ArchiveJob(pathlib.Path(entry['source']), entry['filename'], metadata, options.get('include'), options.get('exclude'), options.get('max_size'))
+            else:
+                yield _path_job(entry, metadata)
+
+def _path_job(entry, metadata):
+    path = pathlib.Path(entry['source'])
+    try:
+        stat_result = path.stat()
+    except OSError:
+        # The job will fail, and say why
+        return PathJob(path, entry['filename'], metadata=metadata)
+    sha1 = entry['sha1']
+    if stat_result.st_size != entry['n_bytes'] or stat_result.st_mtime_ns != entry.get('mtime_ns'):
+        sha1 = None # it changed since we planned
+    return PathJob(path, entry['filename'], metadata=metadata, sha1=sha1, stat_result=stat_result)
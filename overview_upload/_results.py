@@ -0,0 +1,12 @@
+# What send_file_if_conditions_met() did with a file
+ResultUploaded = 'uploaded'
+ResultDuplicate = 'duplicate'
+ResultUnhandledExtension = 'unhandled_extension'
+ResultUnchanged = 'unchanged' # according to the Manifest
+ResultAlreadySent = 'already_sent' # according to the UploadJournal
+ResultFailed = 'failed' # and skip_failed_files is set
+ResultCancelled = 'cancelled' # by Pipeline.cancel(), before it was sent
+ResultEmpty = 'empty' # according to the ContentFilter
+ResultTooSmall = 'too_small' # according to the ContentFilter
+ResultTooLarge = 'too_large' # according to the ContentFilter
+ResultDeniedType = 'denied_type' # according to the ContentFilter
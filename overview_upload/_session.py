@@ -0,0 +1,113 @@
+from overview_upload._congestion import OverloadStatusCodes
+
+DefaultPoolSize = 10
+DefaultMaxRetries = 3
+
+# Responses that mean "try again later" rather than "you made a mistake"
+RetryStatusCodes = (429, 500, 502, 503, 504)
+
+# Requests that are safe to repeat once the server may have acted on them.
+# Other POSTs (finish, document-set creation) are retried only when they
+# failed to connect: a second one would import files or create a document
+# set twice.
+RetryMethods = frozenset([ 'HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS' ])
+
+# Each file POST goes to its own /api/v1/files/{uuid} URL, so sending it
+# again just replaces it
+FileRetryMethods = RetryMethods | frozenset([ 'POST' ])
+
+def _build_retry(max_retries, backoff_factor, retry_overloaded, retry_sent=True, methods=RetryMethods):
+    from requests.packages.urllib3.util.retry import Retry
+
+    if retry_overloaded:
+        status_codes = RetryStatusCodes
+    else:
+        status_codes = tuple(code for code in RetryStatusCodes if code not in OverloadStatusCodes)
+    kwargs = {
+        'total': max_retries,
+        'connect': max_retries,
+        'read': max_retries,
+        'status': max_retries,
+        'backoff_factor': backoff_factor,
+        'status_forcelist': status_codes,
+        # urllib3 retries any 429 or 503 with a Retry-After header, whatever
+        # status_forcelist says
+        'respect_retry_after_header': retry_overloaded,
+        'raise_on_status': False, # let the caller raise_for_status()
+    }
+    if not retry_sent:
+        # Once a body has been read, a retry would send what's left of it
+        kwargs.update(read=0, status=0, status_forcelist=(), other=0)
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        kwargs.pop('other', None)
+        return Retry(method_whitelist=methods, **kwargs)
+
+def _build_adapter(pool_size, retry):
+    from requests.adapters import HTTPAdapter
+
+    return HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=retry
+    )
+
+def create_session(pool_size=DefaultPoolSize, max_retries=DefaultMaxRetries, backoff_factor=0.5, retry_overloaded=True):
+    """Build a requests.Session that reuses connections and retries.
+
+    The session keeps up to ``pool_size`` keep-alive connections per host.
+    Threads that need a connection while all are busy wait for one, so share
+    one session among up to ``pool_size`` threads.
+
+    Requests that fail to connect are retried with exponential backoff.
+    Requests that are safe to repeat (not POSTs) are also retried after a
+    connection reset or a 429/5xx response, honoring ``Retry-After``. Send
+    file uploads with an adapter from ``create_file_adapter()`` or
+    ``create_stream_adapter()``.
+
+    :param int pool_size: maximum number of simultaneous connections.
+    :param int max_retries: number of retries before giving up.
+    :param float backoff_factor: sleep ``backoff_factor * 2 ** (n - 1)``
+        seconds before the n-th retry.
+    :param bool retry_overloaded: if ``False``, return 429 and 503 responses
+        without retrying them, so a ``ConcurrencyLimiter`` can see them.
+    """
+    # requests takes a while to import: wait until we need it
+    import requests
+
+    adapter = _build_adapter(pool_size, _build_retry(max_retries, backoff_factor, retry_overloaded))
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def create_file_adapter(pool_size=DefaultPoolSize, max_retries=DefaultMaxRetries, backoff_factor=0.5, retry_overloaded=True):
+    """Build a requests HTTPAdapter for POSTs to ``/api/v1/files/{uuid}``.
+
+    It retries like ``create_session()``, POSTs included: each file has its
+    own URL, so sending it twice is harmless. A body is rewound before each
+    retry only if it can seek: send streams with an adapter from
+    ``create_stream_adapter()`` instead.
+
+    :param int pool_size: maximum number of simultaneous connections.
+    :param int max_retries: number of retries before giving up.
+    :param float backoff_factor: see ``create_session()``.
+    :param bool retry_overloaded: see ``create_session()``.
+    """
+    return _build_adapter(pool_size, _build_retry(max_retries, backoff_factor, retry_overloaded, methods=FileRetryMethods))
+
+def create_stream_adapter(pool_size=DefaultPoolSize, max_retries=DefaultMaxRetries, backoff_factor=0.5):
+    """Build a requests HTTPAdapter for request bodies that can't be rewound.
+
+    It retries failures to connect, like ``create_session()``, but nothing
+    that happens after the body starts being read: not connection resets,
+    and not 429/5xx responses, which it returns as they are.
+
+    :param int pool_size: maximum number of simultaneous connections.
+    :param int max_retries: number of retries before giving up.
+    :param float backoff_factor: see ``create_session()``.
+    """
+    return _build_adapter(pool_size, _build_retry(max_retries, backoff_factor, True, retry_sent=False))
@@ -0,0 +1,208 @@
+import collections
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from overview_upload._archive import is_archive
+from overview_upload._metrics import Metrics
+from overview_upload._pipeline import Pipeline, PathJob, _ArchiveJob, DefaultMaxBytesInFlight
+from overview_upload._walk import _iter_directory, _log_walk_skip
+
+DefaultMaxSimultaneousFinishes = 8
+
+def shard_title(template, shard):
+    """Return the title of a shard's document set: ``template``, with
+    ``"{shard}"`` replaced by the shard (or the shard appended).
+
+    :param str template: for instance, ``"Mail {shard}"``.
+    :param str shard: for instance, ``"inbox"``, or ``""``.
+    """
+    if '{shard}' in template:
+        return template.replace('{shard}', shard).strip()
+    return '{} {}'.format(template, shard).strip()
+
+def shard_by_subdirectory(filename):
+    """Return the shard of a file in a directory: its top-level subdirectory.
+
+    Files directly in the directory go to shard ``""``.
+
+    :param str filename: path relative to the directory, as
+        ``walk_directory()`` yields it.
+    """
+    parts = filename.split(os.sep, 1)
+    return parts[0] if len(parts) > 1 else ''
+
+class ShardCounter:
+    """Splits shards into numbered shards of at most ``max_files`` files.
+
+    Call it with each file's shard (or ``""``), in order: it returns
+    ``"1"``, ``"1"``... then ``"2"``; or ``"A 1"``, ``"A 2"``... for shard
+    ``"A"``. Every file counts, even if it turns out to be a duplicate.
+
+    :param int max_files: number of files per shard.
+    """
+
+    def __init__(self, max_files):
+        if max_files < 1:
+            raise ValueError('max_files must be at least 1')
+        self.max_files = max_files
+        self._counts = collections.Counter()
+
+    def __call__(self, shard=''):
+        number = self._counts[shard] // self.max_files + 1
+        self._counts[shard] += 1
+        return '{} {}'.format(shard, number) if shard else str(number)
+
+class ShardedUpload:
+    """Uploads one source of files into many document sets at once.
+
+    Each shard (a string such as a subdirectory name or a CSV value) gets its
+    own document set, and its own Upload, the first time a file is submitted
+    to it. All shards share one Pipeline, so they share its threads and its
+    ``max_bytes_in_flight``. Give every Upload the same session, so they
+    share connections too.
+
+    ``create_upload(shard, metrics)`` must return an ``Upload`` for a new
+    shard (usually after ``create_document_set()``). Pass it ``metrics`` so
+    ``metrics`` covers every shard; and if the shards share a ``Manifest``,
+    pass ``manifest_shared=True``, so one shard's ``finish()`` doesn't mark
+    other shards' files uploaded. It is called on the thread that calls
+    ``submit()``.
+
+    :param function create_upload: see above.
+    :param int fetch_workers: see ``Pipeline``.
+    :param int hash_workers: see ``Pipeline``.
+    :param int upload_workers: see ``Pipeline``.
+    :param int max_bytes_in_flight: see ``Pipeline``.
+    :param bool skip_unhandled_extension: see ``Pipeline``.
+    :param bool skip_duplicate: see ``Pipeline``.
+    :param bool incremental: see ``Pipeline``.
+    :param bool stop_on_error: see ``Pipeline``.
+    :param function on_result: see ``Pipeline``.
+    :param Logger logger: where to log skipped files.
+    :param Metrics metrics: shared by every shard's Upload, or ``None`` to
+        create a new ``Metrics``.
+
+    Use it as a context manager (or call ``close()``) to stop its threads
+    and close every shard's Upload.
+    """
+
+    def __init__(self, create_upload, fetch_workers=4, hash_workers=2, upload_workers=4, max_bytes_in_flight=DefaultMaxBytesInFlight, skip_unhandled_extension=True, skip_duplicate=True, incremental=False, stop_on_error=True, on_result=None, logger=None, metrics=None):
+        if logger is None:
+            logger = logging.getLogger('{}.ShardedUpload'.format(__name__))
+
+        self.create_upload = create_upload
+        self.logger = logger
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.on_result = on_result
+        self.uploads = collections.OrderedDict() # shard => Upload
+        self.results = collections.OrderedDict() # shard => Counter of results
+        self._shards = {} # id(Upload) => shard
+        self._lock = threading.Lock()
+        self.pipeline = Pipeline(
+            None,
+            fetch_workers=fetch_workers,
+            hash_workers=hash_workers,
+            upload_workers=upload_workers,
+            max_bytes_in_flight=max_bytes_in_flight,
+            skip_unhandled_extension=skip_unhandled_extension,
+            skip_duplicate=skip_duplicate,
+            incremental=incremental,
+            stop_on_error=stop_on_error,
+            on_result=self._on_result
+        )
+
+    def upload_for(self, shard):
+        """Return the shard's Upload, creating it if it's new."""
+        upload = self.uploads.get(shard)
+        if upload is None:
+            upload = self.create_upload(shard, self.metrics)
+            with self._lock:
+                self.uploads[shard] = upload
+                self.results[shard] = collections.Counter()
+                self._shards[id(upload)] = shard
+        return upload
+
+    def submit(self, shard, job):
+        """Queue a job (such as a ``PathJob`` or ``UrlJob``) for a shard.
+
+        Waits while the Pipeline is full; see ``Pipeline.submit()``.
+        """
+        job.target = self.upload_for(shard)
+        self.pipeline.submit(job)
+
+    def _on_result(self, job):
+        with self._lock:
+            self.results[self._shards[id(job.target)]].update(job.results)
+        if self.on_result is not None:
+            self.on_result(job)
+
+    def _on_walk_skip(self, filename, reason):
+        _log_walk_skip(self.logger, self.metrics, filename, reason)
+
+    def send_directory(self, dirname, shard, metadata=None, include=None, exclude=None, max_size=None, expand_archives=False):
+        """Submit every file in a directory, each to the shard ``shard(filename)`` names.
+
+        Files are chosen as ``Upload.send_directory()`` chooses them. This
+        returns once every file is submitted; call ``drain()`` to wait for
+        them.
+
+        :param str dirname: directory to upload.
+        :param function shard: maps a filename (relative to ``dirname``) to
+            a shard, for instance ``shard_by_subdirectory``.
+        :param dict metadata: see ``Upload.send_directory()``.
+        :param list include: see ``Upload.send_directory()``.
+        :param list exclude: see ``Upload.send_directory()``.
+        :param int max_size: see ``Upload.send_directory()``.
+        :param bool expand_archives: see ``Upload.send_directory()``. An
+            archive's files all go to the archive's shard.
+        """
+        for path, filename, stat_result, _ in _iter_directory(dirname, include, exclude, max_size, expand_archives, self._on_walk_skip):
+            if expand_archives and is_archive(filename):
+                job = _ArchiveJob(path, filename + os.sep, metadata, include, exclude, max_size)
+            else:
+                job = PathJob(path, filename, metadata=metadata, stat_result=stat_result)
+            self.submit(shard(filename), job)
+
+    def drain(self):
+        """Wait for every submitted job; see ``Pipeline.drain()``."""
+        self.pipeline.drain()
+
+    def finish(self, max_simultaneous=DefaultMaxSimultaneousFinishes, **kwargs):
+        """Call ``finish()`` on every shard's Upload, several at a time.
+
+        :param int max_simultaneous: number of finish requests to send at
+            once.
+        :param kwargs: passed to ``Upload.finish()``.
+        :raises Exception: the first error, after every shard is done.
+        """
+        uploads = list(self.uploads.values())
+        if not uploads:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_simultaneous, len(uploads))) as executor:
+            futures = [ executor.submit(upload.finish, **kwargs) for upload in uploads ]
+        for future in futures:
+            future.result()
+
+    def summary(self):
+        """Return a line of results per shard, then ``metrics.summary()``."""
+        lines = []
+        for shard, results in self.results.items():
+            counts = ', '.join('{} {}'.format(n, result) for result, n in sorted(results.items()))
+            lines.append('{}: {}'.format(shard or '(top level)', counts or 'no files'))
+        lines.append(self.metrics.summary())
+        return '\n'.join(lines)
+
+    def close(self):
+        """Stop the Pipeline's threads, then close every shard's Upload."""
+        self.pipeline.close()
+        for upload in self.uploads.values():
+            upload.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.pipeline.cancel()
+        self.close()
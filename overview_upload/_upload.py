@@ -1,18 +1,88 @@
-import hashlib
+import collections
+import functools
 import io
 import json
 import logging
 import os
-import pathlib
-import requests
-import rfc6266
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from overview_upload._congestion import OverloadStatusCodes
+from overview_upload._fetch import ChecksumMismatchError, VerifyingReader, content_length, content_md5, strong_etag
+from overview_upload._filter import read_head
+from overview_upload._hashing import hash_file, spool_file, DefaultReadSize, DefaultSpoolMaxMemory
+from overview_upload._results import ResultUploaded, ResultDuplicate, ResultUnhandledExtension, ResultUnchanged, ResultAlreadySent, ResultFailed, ResultEmpty, ResultTooSmall, ResultTooLarge, ResultDeniedType
+from overview_upload._metrics import Metrics, EventHashed, EventDuplicateCheck, EventUploaded, EventCompressed, EventSkipped, EventFailed
+from overview_upload._walk import _iter_directory, _log_walk_skip
+from overview_upload._session import create_session, create_file_adapter, create_stream_adapter, DefaultPoolSize, DefaultMaxRetries
 
-def _calculate_sha1(in_file):
-    m = hashlib.sha1()
-    for chunk in iter(lambda: in_file.read(8192), b''):
-        m.update(chunk)
-    return m.hexdigest()
+DefaultDuplicateCheckWindow = 16
+
+# Plan this many files at a time: hash them, then check them in bulk
+DefaultPlanChunkSize = 1000
+
+# We go by filename, with a blacklist we know Overview doesn't handle (yet)
+UnhandledExtensions = frozenset([ '.zip', '.msg', '.gif', '.jpg', '.png', '.tiff', '.tif', '.dbf' ])
+
+_SkipMessages = {
+    ResultDuplicate: 'Skipping %s, already on server',
+    ResultUnhandledExtension: 'Skipping %s, Overview does not handle this format',
+    ResultUnchanged: 'Skipping %s, unchanged since it was uploaded',
+    ResultAlreadySent: 'Skipping %s, already sent before resuming',
+    ResultEmpty: 'Skipping %s, it is empty',
+    ResultTooSmall: 'Skipping %s, too small',
+    ResultTooLarge: 'Skipping %s, too large',
+    ResultDeniedType: 'Skipping %s, its contents are in a format we skip',
+}
+
+def _manifest_status(result):
+    """How a Manifest should remember result, or None to forget it."""
+    from overview_upload._manifest import Manifest # sqlite3 is slow to load
+    return {
+        ResultUploaded: Manifest.StatusSent,
+        ResultDuplicate: Manifest.StatusDuplicate,
+    }.get(result)
+
+def _is_manifest_done(entry):
+    """True if a ManifestEntry says its file needn't be sent again."""
+    from overview_upload._manifest import Manifest
+    return entry.status in Manifest.DoneStatuses
+
+def _content_disposition(filename):
+    # rfc6266 loads a parsing library, which takes a while: wait until we
+    # send a file
+    import rfc6266
+    return rfc6266.build_header(filename)
+
+def _is_archive(filename):
+    # tarfile, zipfile and lzma take a while to import: wait until we expand
+    # an archive
+    from overview_upload._archive import is_archive
+    return is_archive(filename)
+
+def _is_seekable(in_file):
+    seekable = getattr(in_file, 'seekable', None)
+    return seekable is not None and seekable()
+
+def _is_unhandled_extension(filename):
+    path, ext = os.path.splitext(filename)
+    return ext.lower() in UnhandledExtensions
+
+def _map_concurrently(func, items, n_workers):
+    """Like map(func, items), but on n_workers threads.
+
+    Results come back in order. At most ``n_workers * 2`` items are read ahead
+    of the results, so ``items`` can be a huge generator.
+    """
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= n_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 class Upload:
     """Start an Upload session.
@@ -21,16 +91,99 @@ class Upload:
         ``https://www.overviewdocs.com``
     :param str api_token: String from
         https://www.overviewdocs.com/documentsets/XXXX/api-tokens
+    :param Logger logger: Where to log activities.
+    :param requests.Session session: HTTP session to send requests with, or
+        ``None`` (the default) to create one. ``close()`` only closes
+        sessions this object created.
+    :param int pool_size: when creating a session, the maximum number of
+        simultaneous connections to the server. Make this at least the number
+        of threads that share this Upload.
+    :param int max_retries: when creating a session, the number of times to
+        retry a request after a connection reset or a 429/5xx response.
+        (The session retries ``finish()`` only after failures to connect.)
+        Files are sent through adapters of our own, on the same session
+        settings: one that retries them like that, and one for bodies that
+        can't be rewound (relayed downloads, archive members) that only
+        retries failures to connect. ``pool_size`` and ``max_retries``
+        configure them, too.
+    :param Manifest manifest: where to cache file hashes and remember which
+        files were uploaded, or ``None``. See ``incremental`` on
+        ``send_path_if_conditions_met()``.
+    :param bool manifest_shared: ``True`` if Uploads to other document sets
+        use the same manifest (as a ``ShardedUpload``'s may). Then
+        ``finish()`` and ``clear_previous_upload()`` only change the
+        statuses of files this Upload sent, not every sent file's.
+    :param UploadJournal journal: where to record each file sent, so a new
+        run can resume after a crash, or ``None``. See
+        ``resume_or_clear_previous_upload()``.
+    :param int max_attempts_per_file: number of times to try sending a file
+        before giving up. (This is on top of ``max_retries``, which retries
+        individual requests.)
+    :param float retry_backoff: seconds to wait after a file's first failed
+        attempt. Each later wait is twice as long as the one before.
+    :param bool skip_failed_files: if ``True``, log files that fail to send
+        and add them to ``failed_files``, instead of raising an error.
+    :param int read_size: number of bytes to read (or hash) at a time.
+    :param int spool_max_memory: when a stream must be read before it is
+        sent (to calculate its size or sha1), keep up to this many bytes in
+        memory and write the rest to a temporary file.
+    :param Metrics metrics: where to count files, bytes and latencies, or
+        ``None`` to create a new ``Metrics``. See ``add_observer()``.
+    :param ConcurrencyLimiter concurrency_limiter: if set, file uploads wait
+        for it, so they ramp up while the server keeps up and back off when
+        it is overloaded; and files the server rejects with 429 or 503 are
+        retried once it allows. (We don't retry file uploads' 429 and 503
+        responses ourselves then.)
+    :param ContentFilter content_filter: if set, skip files it rejects
+        because of their size or their first bytes, before hashing or
+        sending them.
+    :param Compressor compressor: if set, compress files it says are worth
+        compressing, and send them with a ``Content-Encoding`` header. Only
+        use this with a server (or proxy) that accepts compressed uploads.
+
+    Use it as a context manager (or call ``close()``) to close connections.
     """
 
-    def __init__(self, server_url, api_token, logger=None):
+    def __init__(self, server_url, api_token, logger=None, session=None, pool_size=DefaultPoolSize, max_retries=DefaultMaxRetries, manifest=None, manifest_shared=False, journal=None, max_attempts_per_file=1, retry_backoff=1.0, skip_failed_files=False, read_size=DefaultReadSize, spool_max_memory=DefaultSpoolMaxMemory, metrics=None, concurrency_limiter=None, content_filter=None, compressor=None):
         if logger is None:
             logger = logging.getLogger('{}.Upload'.format(__name__))
 
         self.server_url = server_url
         self.api_token = api_token
         self.logger = logger
+        self._owns_session = session is None
+        self.session = session if session is not None else create_session(pool_size=pool_size, max_retries=max_retries, retry_overloaded=concurrency_limiter is None)
+        self.manifest = manifest
+        self.manifest_shared = manifest_shared
+        self._sent_paths = [] # with manifest_shared, the paths we marked sent
+        self.journal = journal
+        self.max_attempts_per_file = max_attempts_per_file
+        self.retry_backoff = retry_backoff
+        self.skip_failed_files = skip_failed_files
+        self.failed_files = [] # (filename, error message) pairs
+        self.read_size = read_size
+        self.spool_max_memory = spool_max_memory
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.concurrency_limiter = concurrency_limiter
+        self.content_filter = content_filter
+        self.compressor = compressor
         self.n_uploaded = 0
+        self._n_uploaded_at_finish = 0 # n_uploaded when finish() last succeeded
+        self._lock = threading.Lock() # guards counters and sets across worker threads
+        self._pool_size = pool_size
+        self._max_retries = max_retries
+        self._file_adapter = None # created on the first file we send
+        self._stream_adapter = None # created on the first stream we send
+
+        # Duplicate checks we can answer without asking the server. Files
+        # only join the document set on finish(), so these stay valid until
+        # then.
+        self.known_sha1s = set()
+        self.known_sha1s_complete = False
+        self.absent_sha1s = set()
+        self._sent_sha1s = set() # join known_sha1s on finish()
+        self.n_duplicate_checks_local = 0
+        self.n_duplicate_checks_remote = 0
 
     def _request(self, method, path, **kwargs):
         url = '{}{}'.format(self.server_url, path)
@@ -50,7 +203,90 @@ class Upload:
         request_kwargs.update(kwargs)
         request_kwargs['headers'] = request_headers
 
-        return requests.request(method, url, **request_kwargs)
+        return self.session.request(method, url, **request_kwargs)
+
+    def _request_file(self, method, path, **kwargs):
+        """Like _request(), through the adapter that retries file POSTs.
+
+        The session's own retries leave POSTs alone, because repeating
+        finish() would be unsafe; repeating a POST to a file's own URL isn't.
+        """
+        with self._lock:
+            if self._file_adapter is None:
+                self._file_adapter = create_file_adapter(pool_size=self._pool_size, max_retries=self._max_retries, retry_overloaded=self.concurrency_limiter is None)
+            adapter = self._file_adapter
+        return self._send_with_adapter(adapter, method, path, **kwargs)
+
+    def _request_stream(self, method, path, **kwargs):
+        """Like _request(), through the adapter that doesn't retry sent bodies."""
+        with self._lock:
+            if self._stream_adapter is None:
+                self._stream_adapter = create_stream_adapter(pool_size=self._pool_size, max_retries=self._max_retries)
+            adapter = self._stream_adapter
+        return self._send_with_adapter(adapter, method, path, **kwargs)
+
+    def _send_with_adapter(self, adapter, method, path, **kwargs):
+        """Send a request through adapter instead of the session's own.
+
+        The session still supplies its headers, auth, proxies and TLS
+        settings: only the adapter (and its connection pool) differs.
+        """
+        import requests
+
+        url = '{}{}'.format(self.server_url, path)
+        self.logger.debug('%s %s', method, url)
+        headers = {
+            'X-Requested-With': 'overview_upload',
+        }
+        headers.update(kwargs.pop('headers', {}))
+        request = self.session.prepare_request(requests.Request(method, url, headers=headers, auth=(self.api_token, 'x-auth-token'), **kwargs))
+        settings = self.session.merge_environment_settings(request.url, {}, None, None, None)
+        response = adapter.send(request, **settings)
+        response.content # read it all, so the connection goes back to the pool
+        return response
+
+    def add_observer(self, callback):
+        """Call ``callback(event, data)`` whenever something happens to a file.
+
+        Events are ``"hashed"``, ``"duplicate_check"``, ``"uploaded"``,
+        ``"skipped"`` (with a ``reason``) and ``"failed"``; see
+        ``overview_upload.Metrics``. ``callback`` may be called from several
+        threads at once.
+        """
+        self.metrics.add_observer(callback)
+
+    def _skip(self, result, filename, **data):
+        """Log and count a skipped file; return result."""
+        self.logger.info(_SkipMessages[result], filename)
+        self.metrics.record(EventSkipped, filename=filename, reason=result, **data)
+        return result
+
+    def _take_sent_paths(self):
+        """With manifest_shared, return (and forget) the paths we marked
+        sent; otherwise, None, meaning every sent path."""
+        if not self.manifest_shared:
+            return None
+        with self._lock:
+            paths, self._sent_paths = self._sent_paths, []
+        return paths
+
+    def _on_walk_skip(self, filename, reason):
+        _log_walk_skip(self.logger, self.metrics, filename, reason)
+
+    def close(self):
+        """Close the HTTP connections this Upload opened."""
+        if self._owns_session:
+            self.session.close()
+        if self._file_adapter is not None:
+            self._file_adapter.close()
+        if self._stream_adapter is not None:
+            self._stream_adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def clear_previous_upload(self):
         """Remove any previously uploaded files from the server.
@@ -62,13 +298,36 @@ class Upload:
         self.logger.info('Clearing previous uploads…')
         r = self._request('DELETE', '/api/v1/files')
         r.raise_for_status()
+        if self.manifest is not None:
+            self.manifest.forget_sent(self._take_sent_paths())
+        if self.journal is not None:
+            self.journal.clear()
+
+    def resume_or_clear_previous_upload(self):
+        """Continue the upload in the journal, or start a new one.
+
+        If the journal lists files sent by a previous run that never called
+        ``finish()``, keep those files on the server and skip them when they
+        are sent again. Otherwise, call ``clear_previous_upload()``.
+        """
+        if self.journal is None or len(self.journal) == 0:
+            self.clear_previous_upload()
+            return
+
+        entries = list(self.journal.entries.values())
+        self.logger.info('Resuming previous upload: %d file(s) already sent', len(entries))
+        with self._lock:
+            self.n_uploaded += len(entries)
+            self._sent_sha1s.update(entry.sha1 for entry in entries if entry.sha1 is not None)
 
-    def send_directory(self, dirname, skip_unhandled_extension=True, skip_duplicate=True, metadata=None):
+    def send_directory(self, dirname, skip_unhandled_extension=True, skip_duplicate=True, metadata=None, incremental=False, concurrency=1, max_bytes_in_flight=None, duplicate_check_window=None, include=None, exclude=None, max_size=None, expand_archives=False, hash_workers=None, upload_workers=None, partition=None):
         """Upload all files in a directory to the Overview server.
 
-        If ``skip_duplicate == False``, then files will be streamed to the
-        server. Otherwise, this method will cache each file in memory during
-        upload.
+        Files are streamed to the server. If ``skip_duplicate == True``, each
+        file is hashed first.
+
+        Hidden files and directories (whose names start with ``"."``) are
+        skipped.
 
         :param str dirname: Directory to upload.
         :param bool skip_unhandled_extension: if ``True`` (the default), do not
@@ -78,28 +337,336 @@ class Upload:
             file if ``api_token`` points to a document set that already contains a
             file whose sha1 hash is identical to this file's. Files that have been
             sent without a call to ``finish()`` will not be included in the check.
-            If ``False``, stream files instead of caching them.
         :param dict metadata: Metadata to set on every document, or ``None``.
             The document set should have a metadata schema that corresponds to
             this document's metadata (or you can set the schema later).
+        :param bool incremental: skip files the manifest says are unchanged
+            since they were uploaded. See ``send_path_if_conditions_met()``.
+        :param int concurrency: number of files to open, hash, check and
+            upload at once. ``1`` (the default) uploads files one after
+            another. With more, this thread scans the directory while a
+            ``Pipeline`` sends files: ``concurrency`` threads open them,
+            ``hash_workers`` hash them and ``upload_workers`` send them.
+        :param int max_bytes_in_flight: when ``concurrency > 1``, stop
+            scanning while the files being sent add up to more than this many
+            bytes; default ``Pipeline``'s.
+        :param int hash_workers: when ``concurrency > 1``, number of threads
+            hashing files; default ``concurrency``.
+        :param int upload_workers: when ``concurrency > 1``, number of threads
+            checking for duplicates and sending files; default
+            ``concurrency``.
+        :param int duplicate_check_window: if set (and ``skip_duplicate``),
+            hash files a chunk (``DefaultPlanChunkSize`` files) at a time,
+            and check each chunk's sha1s with this many simultaneous
+            requests before uploading any of its files. This is much faster
+            when most files are already on the server.
+        :param list include: glob patterns (such as ``"*.pdf"``): if set,
+            only upload files that match one. A pattern containing ``"/"`` is
+            matched against the path relative to ``dirname``; others are
+            matched against the file's name.
+        :param list exclude: glob patterns of files and directories to skip.
+            Excluded directories are not scanned at all.
+        :param int max_size: if set, skip files larger than this many bytes.
+        :param bool expand_archives: if ``True``, upload the files inside zip
+            and tar archives instead of the archives themselves. See
+            ``send_archive()``. Each file's name starts with its archive's,
+            as in ``"mail/box1.zip/inbox/1.pdf"``. ``include``, ``exclude``
+            and ``max_size`` apply to the files inside, and ``incremental``
+            does not apply to archives.
+        :param Partition partition: if set, only upload this partition's
+            files. Other processes upload the other partitions; see
+            ``Coordination``.
+        """
+        kwargs = {
+            'skip_unhandled_extension': skip_unhandled_extension,
+            'skip_duplicate': skip_duplicate,
+            'metadata': metadata,
+            'incremental': incremental,
+        }
+
+        send_path = self.send_path_if_conditions_met
+        if expand_archives:
+            send_path = functools.partial(self._send_path_or_archive, include=include, exclude=exclude, max_size=max_size)
+
+        paths = self._iter_directory(dirname, include, exclude, max_size, expand_archives, partition)
+        if skip_duplicate and duplicate_check_window:
+            paths = self._skip_known_duplicates(paths, skip_unhandled_extension, incremental, concurrency, duplicate_check_window, expand_archives)
+
+        if concurrency <= 1:
+            for path, filename, stat_result, sha1 in paths:
+                send_path(path, filename, sha1=sha1, stat_result=stat_result, **kwargs)
+        else:
+            self._send_paths_concurrently(paths, concurrency, hash_workers, upload_workers, max_bytes_in_flight, kwargs, expand_archives, include, exclude, max_size)
+
+    def _iter_directory(self, dirname, include, exclude, max_size, expand_archives=False, partition=None):
+        return _iter_directory(dirname, include, exclude, max_size, expand_archives, self._on_walk_skip, partition)
+
+    def _send_path_or_archive(self, path, filename, sha1=None, stat_result=None, incremental=False, include=None, exclude=None, max_size=None, **kwargs):
+        """Call send_archive() on archives, send_path_if_conditions_met() on other files."""
+        if _is_archive(filename):
+            self.send_archive(path, filename + os.sep, include=include, exclude=exclude, max_size=max_size, **kwargs)
+        else:
+            self.send_path_if_conditions_met(path, filename, sha1=sha1, stat_result=stat_result, incremental=incremental, **kwargs)
+
+    def _skip_known_duplicates(self, paths, skip_unhandled_extension, incremental, concurrency, window, expand_archives=False):
+        """Hash paths, check them in bulk and yield the ones to send.
+
+        Paths are hashed and checked ``DefaultPlanChunkSize`` at a time, as
+        ``plan_paths()`` does, so the first files are sent while later ones
+        are hashed, and a huge tree isn't held in memory.
+
+        Yields (path, filename, stat_result, sha1) tuples. Files with
+        unhandled extensions (or sizes the content_filter rejects) pass
+        through unhashed: send_path_if_conditions_met() will skip them. So do
+        archives we will expand: their members are checked one by one.
         """
-        for path in pathlib.Path(dirname).glob('**/*'):
-            filename = str(path.relative_to(dirname)) # visible on the server
+        def will_skip(filename, stat_result):
+            if skip_unhandled_extension and _is_unhandled_extension(filename):
+                return True
+            return self.content_filter is not None and self.content_filter.check_size(stat_result.st_size) is not None
 
-            # Don't upload hidden files (e.g., ".DS_Store" on Mac OS)
-            if filename[0] == '.' or '/.' in filename or '\\.' in filename:
+        def hash_path(item):
+            path, filename, stat_result, sha1 = item
+            if expand_archives and _is_archive(filename):
+                return item
+            if sha1 is None and not will_skip(filename, stat_result):
+                entry = self._lookup_manifest(path, stat_result)
+                if entry is not None:
+                    if incremental and _is_manifest_done(entry):
+                        self._skip(ResultUnchanged, filename)
+                        return None
+                    sha1 = entry.sha1
+                if sha1 is None:
+                    sha1 = self._hash_path(path, stat_result)
+            return path, filename, stat_result, sha1
+
+        def check_chunk(chunk):
+            self.logger.info('Checking %d file(s) against the server…', len(chunk))
+            found = self.check_sha1s(set(item[3] for item in chunk if item[3] is not None), window=window)
+            for item in chunk:
+                if item[3] in found:
+                    self._skip(ResultDuplicate, item[1])
+                else:
+                    yield item
+
+        self.logger.info('Hashing files…')
+        chunk = []
+        for item in _map_concurrently(hash_path, paths, max(concurrency, 1)):
+            if item is None:
                 continue
+            chunk.append(item)
+            if len(chunk) == DefaultPlanChunkSize:
+                yield from check_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from check_chunk(chunk)
 
-            if path.is_file():
-                self.send_path_if_conditions_met(
-                    path,
-                    filename,
-                    skip_unhandled_extension=skip_unhandled_extension,
-                    skip_duplicate=skip_duplicate,
-                    metadata=metadata
-                )
+    def _send_paths_concurrently(self, paths, concurrency, hash_workers, upload_workers, max_bytes_in_flight, kwargs, expand_archives, include, exclude, max_size):
+        """Send paths through a Pipeline.
+
+        The caller's thread keeps producing paths until the pipeline is full.
+        The first error stops the upload and is re-raised here, after
+        in-progress files finish.
+        """
+        from overview_upload._pipeline import Pipeline, PathJob, _ArchiveJob, DefaultMaxBytesInFlight
+
+        pipeline = Pipeline(
+            self,
+            fetch_workers=concurrency,
+            hash_workers=hash_workers or concurrency,
+            upload_workers=upload_workers or concurrency,
+            max_bytes_in_flight=max_bytes_in_flight if max_bytes_in_flight is not None else DefaultMaxBytesInFlight,
+            skip_unhandled_extension=kwargs['skip_unhandled_extension'],
+            skip_duplicate=kwargs['skip_duplicate'],
+            incremental=kwargs['incremental']
+        )
+        with pipeline:
+            for path, filename, stat_result, sha1 in paths:
+                if expand_archives and _is_archive(filename):
+                    job = _ArchiveJob(path, filename + os.sep, kwargs['metadata'], include, exclude, max_size)
+                else:
+                    job = PathJob(path, filename, metadata=kwargs['metadata'], sha1=sha1, stat_result=stat_result)
+                pipeline.submit(job)
+            pipeline.drain()
+
+    def plan_directory(self, dirname, skip_unhandled_extension=True, skip_duplicate=True, incremental=False, concurrency=1, duplicate_check_window=DefaultDuplicateCheckWindow, include=None, exclude=None, max_size=None, expand_archives=False, partition=None):
+        """Work out what ``send_directory()`` would do, without uploading.
+
+        Files are chosen and checked just as ``send_directory()`` would: the
+        hidden-file, include/exclude, size, extension, manifest, journal and
+        content_filter rules all apply. With ``skip_duplicate``, every file
+        is hashed (and the hashes go in the manifest, so the real upload
+        needn't hash them again), and the sha1s are checked against the
+        server in bulk.
+
+        Archives are listed whole, with ``expand_archives``: the files in
+        them are checked when they are sent.
+
+        :param str dirname: directory to plan.
+        :param int concurrency: number of files to check and hash at once.
+        :param int duplicate_check_window: number of simultaneous duplicate
+            checks. (Give ``Upload`` a ``pool_size`` at least this big.)
+        :param partition: see ``send_directory()``; the other parameters
+            are, too.
+        :return: a ``Plan``. Close it when done.
+        """
+        from overview_upload._plan import Plan
+
+        plan = Plan(source=dirname, options={ 'include': include, 'exclude': exclude, 'max_size': max_size })
+
+        def on_skip(filename, reason):
+            self.logger.debug('Skipping %s, %s', filename, reason.replace('_', ' '))
+            plan.skip(reason)
+
+        items = (
+            (path, filename, stat_result, None)
+            for path, filename, stat_result, _ in _iter_directory(dirname, include, exclude, max_size, expand_archives, on_skip, partition)
+        )
+        self.plan_paths(items, plan, skip_unhandled_extension, skip_duplicate, incremental, concurrency, duplicate_check_window, expand_archives)
+        return plan
+
+    def plan_paths(self, items, plan, skip_unhandled_extension=True, skip_duplicate=True, incremental=False, concurrency=1, duplicate_check_window=DefaultDuplicateCheckWindow, expand_archives=False):
+        """Add local files to a Plan, as ``plan_directory()`` does.
+
+        :param iterable items: ``(path, filename, stat_result, metadata)``
+            tuples, where ``path`` is a ``pathlib.Path``, ``stat_result`` is
+            ``None`` if you haven't called ``path.stat()``, and
+            ``metadata`` is what ``send_file_if_conditions_met()`` takes.
+        :param Plan plan: where to add them.
+        :param bool expand_archives: if ``True``, list archives without
+            checking them.
+        """
+        from overview_upload._plan import KindPath, KindArchive
+
+        sniff = self.content_filter is not None and self.content_filter.sniffs
+
+        def check(item):
+            path, filename, stat_result, metadata = item
+            if expand_archives and _is_archive(filename):
+                return item, None, None
+            sha1 = None
+            try:
+                result, stat_result, sha1 = self._check_path(path, filename, skip_unhandled_extension, incremental, None, stat_result)
+                if result is None and (sniff or (skip_duplicate and sha1 is None)):
+                    with path.open('rb', buffering=self.read_size) as in_file:
+                        result, in_file = self._check_head(in_file, filename, stat_result.st_size)
+                        if result is None and skip_duplicate and sha1 is None:
+                            sha1 = self._hash_path(path, stat_result, in_file)
+            except OSError as err:
+                self.logger.warning('Cannot read %s: %s', filename, err)
+                result = ResultFailed
+            return (path, filename, stat_result, metadata), result, sha1
+
+        def plan_chunk(chunk):
+            found = set()
+            if skip_duplicate:
+                found = self.check_sha1s(set(sha1 for _, result, sha1 in chunk if result is None and sha1 is not None), window=duplicate_check_window)
+
+            for (path, filename, stat_result, metadata), result, sha1 in chunk:
+                n_bytes = stat_result.st_size if stat_result is not None else None
+                if expand_archives and _is_archive(filename):
+                    plan.add(KindArchive, str(path), filename + os.sep, n_bytes, metadata=metadata)
+                elif result is not None:
+                    plan.skip(result, n_bytes)
+                elif sha1 in found:
+                    self._skip(ResultDuplicate, filename)
+                    plan.skip(ResultDuplicate, n_bytes)
+                else:
+                    plan.add(KindPath, str(path), filename, n_bytes, sha1, metadata, stat_result.st_mtime_ns)
+
+        chunk = []
+        for checked in _map_concurrently(check, items, max(concurrency, 1)):
+            chunk.append(checked)
+            if len(chunk) == DefaultPlanChunkSize:
+                plan_chunk(chunk)
+                chunk = []
+        if chunk:
+            plan_chunk(chunk)
+
+    def plan_urls(self, items, plan, skip_unhandled_extension=True):
+        """Add downloads to a Plan, without downloading them.
 
-    def send_path_if_conditions_met(self, path, filename, skip_unhandled_extension=True, skip_duplicate=True, metadata=None):
+        Only the journal and extension rules apply: we can't know a
+        download's size, sha1 or contents until we start it.
+
+        :param iterable items: ``(url, filename, metadata)`` tuples.
+        :param Plan plan: where to add them.
+        """
+        from overview_upload._plan import KindUrl
+
+        for url, filename, metadata in items:
+            result = self._check_before_reading(filename, url, skip_unhandled_extension)
+            if result is not None:
+                plan.skip(result)
+            else:
+                plan.add(KindUrl, url, filename, metadata=metadata)
+
+    def calibrate(self, concurrency=1, n_files=8, n_bytes_per_file=1024 * 1024):
+        """Time throwaway uploads, so a Plan can estimate how long it'll take.
+
+        Sends ``n_files`` tiny files (to time per-file overhead), then
+        ``n_files`` files of ``n_bytes_per_file`` random bytes (to time
+        transfer), ``concurrency`` at a time. Then it calls
+        ``clear_previous_upload()``, which deletes them -- and any other files
+        sent to this document set but not finished.
+
+        :return: a dict with ``files_per_second``, ``bytes_per_second`` and
+            ``concurrency``: set it as ``Plan.calibration``.
+        :raises requests.exceptions.RequestException: if an upload fails.
+        """
+        def send(item):
+            i, n_bytes = item
+            headers = {
+                'Content-Disposition': _content_disposition('overview-upload-calibration-{}.bin'.format(i)),
+                'Content-Length': str(n_bytes),
+            }
+            self._post_file('/api/v1/files/{}'.format(uuid.uuid4()), headers, io.BytesIO(os.urandom(n_bytes)), 'calibration file')
+
+        def time_uploads(n_bytes):
+            start = time.time()
+            for _ in _map_concurrently(send, [ (i, n_bytes) for i in range(n_files) ], max(concurrency, 1)):
+                pass
+            return max(time.time() - start, 1e-6)
+
+        self.logger.info('Calibrating: sending %d tiny and %d %d-byte throwaway files…', n_files, n_files, n_bytes_per_file)
+        try:
+            overhead_seconds = time_uploads(1)
+            total_seconds = time_uploads(n_bytes_per_file)
+        finally:
+            self.clear_previous_upload()
+
+        files_per_second = n_files / overhead_seconds
+        # The big files' time, less what the same number of tiny files took
+        transfer_seconds = max(total_seconds - overhead_seconds, 1e-6)
+        return {
+            'files_per_second': files_per_second,
+            'bytes_per_second': n_files * n_bytes_per_file / transfer_seconds,
+            'concurrency': concurrency,
+        }
+
+    def _lookup_manifest(self, path, stat_result):
+        if self.manifest is None:
+            return None
+        return self.manifest.lookup(path, stat_result)
+
+    def _hash_path(self, path, stat_result, in_file=None):
+        """Calculate path's sha1, and remember it in the manifest.
+
+        Pass ``in_file`` if path is already open, to hash it without opening
+        it again.
+        """
+        start = time.time()
+        if in_file is None:
+            with path.open('rb') as in_file:
+                sha1 = hash_file(in_file, self.read_size)
+        else:
+            sha1 = hash_file(in_file, self.read_size)
+        self.metrics.record(EventHashed, filename=str(path), n_bytes=stat_result.st_size, seconds=time.time() - start)
+        if self.manifest is not None:
+            self.manifest.record_hash(path, stat_result, sha1)
+        return sha1
+
+    def send_path_if_conditions_met(self, path, filename, skip_unhandled_extension=True, skip_duplicate=True, metadata=None, sha1=None, incremental=False, stat_result=None):
         """Upload the file at the specified Path to the Overview server.
 
         The file will be streamed: that is, the script does not risk running out
@@ -119,41 +686,301 @@ class Upload:
         :param dict metadata: Metadata to set on the document, or ``None``.
             The document set should have a metadata schema that corresponds to
             this document's metadata (or you can set the schema later).
+        :param str sha1: SHA1 hash of the file, if you already know it.
+        :param bool incremental: if ``True``, skip this file if the manifest
+            says it was uploaded (or found to be a duplicate) and its size,
+            mtime and inode haven't changed since. Without a manifest, this
+            does nothing.
+        :param os.stat_result stat_result: ``path.stat()``, if you already
+            called it.
+        :return: what happened: ``ResultUploaded``, ``ResultDuplicate``,
+            ``ResultUnhandledExtension``, ``ResultUnchanged``,
+            ``ResultAlreadySent`` or ``ResultFailed``.
         """
-        n_bytes = path.stat().st_size
+        result, stat_result, sha1 = self._check_path(path, filename, skip_unhandled_extension, incremental, sha1, stat_result)
+        if result is not None:
+            return result
+
+        with path.open('rb', buffering=self.read_size) as in_file:
+            result, in_file = self._check_head(in_file, filename, stat_result.st_size)
+            if result is not None:
+                return result
+
+            if skip_duplicate and sha1 is None:
+                # We need the sha1 before we send the file. Hash it through
+                # a memory map, then stream it from the same open file: the
+                # second read comes from the OS page cache, not the disk,
+                # unless the file is bigger than free memory.
+                sha1 = self._hash_path(path, stat_result, in_file)
+
+            return self._send_open_path(path, in_file, filename, stat_result, sha1, skip_duplicate, metadata)
+
+    def _check_path(self, path, filename, skip_unhandled_extension, incremental, sha1, stat_result):
+        """Decide whether to send path, without reading it.
+
+        Return ``(result, stat_result, sha1)``: ``result`` is why we skipped
+        the file, or ``None`` to send it. ``sha1`` may come from the manifest.
+        """
+        if self.journal is not None and os.path.abspath(str(path)) in self.journal:
+            return self._skip(ResultAlreadySent, filename), stat_result, sha1
+
+        if stat_result is None:
+            stat_result = path.stat()
+
+        entry = self._lookup_manifest(path, stat_result)
+        if entry is not None:
+            if incremental and _is_manifest_done(entry):
+                return self._skip(ResultUnchanged, filename), stat_result, sha1
+            if sha1 is None:
+                sha1 = entry.sha1
+
+        if skip_unhandled_extension and _is_unhandled_extension(filename):
+            # Skip before we waste time hashing
+            return self._skip(ResultUnhandledExtension, filename), stat_result, sha1
+
+        return self._check_size(filename, stat_result.st_size), stat_result, sha1
+
+    def _send_open_path(self, path, in_file, filename, stat_result, sha1, skip_duplicate, metadata):
+        """Send path (open as in_file) and remember the result in the manifest.
+
+        _check_path() and _check_head() must have passed it.
+        """
+        result = self._hash_and_send_file(
+            in_file,
+            filename,
+            stat_result.st_size,
+            skip_duplicate,
+            metadata,
+            sha1,
+            os.path.abspath(str(path))
+        )
+
+        status = _manifest_status(result) if self.manifest is not None else None
+        if status is not None:
+            self.manifest.record_status(path, stat_result, sha1, status)
+            if self.manifest_shared and result == ResultUploaded:
+                with self._lock:
+                    self._sent_paths.append(path)
+
+        return result
+
+    def send_archive(self, path, filename_prefix='', skip_unhandled_extension=True, skip_duplicate=True, metadata=None, include=None, exclude=None, max_size=None):
+        """Upload the files inside a zip or tar archive, without extracting it.
+
+        Each file is read straight out of the archive and streamed to the
+        server. Nothing is written to disk, except with compressed tar
+        archives (``.tar.gz``, ``.tar.bz2``, ``.tar.xz``) and
+        ``skip_duplicate``: those are read in a single pass, so each file is
+        copied (in memory up to ``spool_max_memory`` bytes) while it is
+        hashed. Zip files and plain tar files are hashed, then read again to
+        send them.
+
+        Hidden files (and ``__MACOSX`` folders), unhandled extensions and
+        encrypted zip members are skipped. Archives inside the archive are
+        not expanded.
+
+        With a journal, each file is journaled as
+        ``"/path/to/archive.zip!member/path"``, so a resumed upload skips the
+        files it sent. The manifest is not used.
+
+        :param pathlib.Path path: zip or tar archive.
+        :param str filename_prefix: prepended to each file's path within the
+            archive, to make the filename Overview shows. For instance,
+            ``"box1.zip/"``.
+        :param bool skip_unhandled_extension: see
+            ``send_file_if_conditions_met()``.
+        :param bool skip_duplicate: see ``send_file_if_conditions_met()``.
+        :param dict metadata: see ``send_file_if_conditions_met()``.
+        :param list include: see ``send_directory()``; matched against paths
+            within the archive.
+        :param list exclude: see ``send_directory()``.
+        :param int max_size: see ``send_directory()``.
+        :raises ArchiveErrors: if the archive is corrupt, unless the Upload
+            skips failed files.
+        :return: a ``collections.Counter`` of results, such as
+            ``{ ResultUploaded: 10, ResultDuplicate: 2 }``.
+        """
+        from overview_upload._archive import ArchiveErrors, iter_archive
+
+        archive_key = os.path.abspath(str(path))
+        results = collections.Counter()
+
+        def on_skip(member_filename, reason):
+            self._on_walk_skip(filename_prefix + member_filename, reason)
+
+        try:
+            for member_filename, n_bytes, in_file in iter_archive(path, include=include, exclude=exclude, max_size=max_size, on_skip=on_skip):
+                result = self.send_file_if_conditions_met(
+                    in_file,
+                    filename_prefix + member_filename,
+                    n_bytes=n_bytes,
+                    skip_unhandled_extension=skip_unhandled_extension,
+                    skip_duplicate=skip_duplicate,
+                    metadata=metadata,
+                    journal_key='{}!{}'.format(archive_key, member_filename.replace(os.sep, '/'))
+                )
+                results[result] += 1
+        except ArchiveErrors as err:
+            results[self._fail(filename_prefix.rstrip(os.sep) or str(path), err)] += 1
+
+        return results
+
+    def send_url_if_conditions_met(self, url, filename, skip_unhandled_extension=True, skip_duplicate=True, metadata=None, journal_key=None, timeout=None):
+        """Download a document and relay it to the Overview server.
+
+        If the source sends ``Content-Length``, and we don't need to hash the
+        document first, bytes are relayed straight through without being
+        stored. Otherwise the document is read once into a temporary copy,
+        which stays in memory up to ``spool_max_memory`` bytes.
+
+        If the source advertises an MD5 (``Content-MD5``, or an S3-style
+        ETag), the document is always copied, and checked against it before
+        we send it: Overview would keep a corrupt file it had received.
+
+        If the Upload has a manifest, and the source sends a strong ETag, we
+        remember the document's sha1. When the ETag is unchanged on a later
+        run, we can skip the document without downloading it, or relay it
+        without copying it.
+
+        :param str url: ``http:`` or ``https:`` URL to download.
+        :param str filename: filename Overview should use.
+        :param bool skip_unhandled_extension: see
+            ``send_file_if_conditions_met()``.
+        :param bool skip_duplicate: see ``send_file_if_conditions_met()``.
+        :param dict metadata: see ``send_file_if_conditions_met()``.
+        :param str journal_key: see ``send_file_if_conditions_met()``;
+            defaults to ``url``.
+        :param float timeout: seconds to wait for the source server, or
+            ``None`` to wait forever.
+        :raises urllib.error.URLError: if the download can't start.
+        :return: see ``send_file_if_conditions_met()``.
+        """
+        if journal_key is None:
+            journal_key = url
+
+        # Check what we can before downloading
+        result = self._check_before_reading(filename, journal_key, skip_unhandled_extension)
+        if result is not None:
+            return result
+
+        response, in_file, n_bytes, etag, sha1, md5 = self._open_url(url, skip_duplicate, timeout)
+        with response:
+            try:
+                # Skip a file we can judge by its Content-Length or its
+                # first bytes before downloading the rest of it
+                result, in_file = self._check_content(in_file, filename, n_bytes)
+                if result is not None:
+                    return result
+
+                if md5 is None and (sha1 is not None or not skip_duplicate):
+                    # Relay (if n_bytes is known) or spool (if not)
+                    return self._hash_and_send_file(in_file, filename, n_bytes, skip_duplicate, metadata, sha1, journal_key)
+
+                spooled_file, n_bytes, sha1 = self._spool_url(url, filename, in_file, etag)
+            except ChecksumMismatchError as err:
+                return self._fail(filename, err)
+
+        with spooled_file:
+            result = self._check_size(filename, n_bytes)
+            if result is not None:
+                return result
+            return self._hash_and_send_file(spooled_file, filename, n_bytes, skip_duplicate, metadata, sha1, journal_key)
+
+    def _check_before_reading(self, filename, journal_key, skip_unhandled_extension):
+        """Return why we should skip a file without reading it, or None."""
+        if self.journal is not None and journal_key is not None and journal_key in self.journal:
+            return self._skip(ResultAlreadySent, filename)
+        if skip_unhandled_extension and _is_unhandled_extension(filename):
+            return self._skip(ResultUnhandledExtension, filename)
+        return None
+
+    def _check_size(self, filename, n_bytes):
+        """Return why the content_filter skips a file of n_bytes bytes, or None."""
+        if self.content_filter is None:
+            return None
+        result = self.content_filter.check_size(n_bytes)
+        if result is not None:
+            return self._skip(result, filename, n_bytes=n_bytes)
+        return None
+
+    def _check_head(self, in_file, filename, n_bytes):
+        """Sniff in_file's first bytes, without using them up.
+
+        Return ``(result, in_file)``: why the content_filter skips the file,
+        or ``None``; and what to read from now on (see ``read_head()``).
+        """
+        if self.content_filter is None or not self.content_filter.sniffs:
+            return None, in_file
+        head, in_file = read_head(in_file, self.content_filter.sniff_size, n_bytes)
+        result, file_type = self.content_filter.check_head(head)
+        if result is not None:
+            return self._skip(result, filename, file_type=file_type), in_file
+        return None, in_file
+
+    def _check_content(self, in_file, filename, n_bytes):
+        """Like _check_head(), after _check_size() if we know n_bytes."""
+        if n_bytes is not None:
+            result = self._check_size(filename, n_bytes)
+            if result is not None:
+                return result, in_file
+        return self._check_head(in_file, filename, n_bytes)
+
+    def _open_url(self, url, skip_duplicate, timeout):
+        """Start downloading url.
+
+        Return ``(response, in_file, n_bytes, etag, sha1, md5)``.
+        ``in_file`` reads ``response``, checking its MD5 and length if we
+        can. ``sha1`` comes from the manifest if the ETag is unchanged, or is
+        ``None``. ``md5`` is what the source advertises, or ``None``: if it's
+        set, spool ``in_file`` before sending it, since the MD5 is only
+        checked at the end.
+
+        :raises urllib.error.URLError: if the download can't start.
+        """
+        import urllib.request # slow to import: most uploads don't need it
+
+        response = urllib.request.urlopen(url, timeout=timeout)
+        n_bytes = content_length(response)
+        etag = strong_etag(response)
 
         sha1 = None
-        if skip_duplicate:
-            # we need to stream the file to calculate sha1, and then we need
-            # to stream it again to send it to the server. Do that by
-            # opening the file twice: the alternative is to read the entire
-            # file into memory, which can be huge.
-            with path.open('rb') as in_file:
-                sha1 = _calculate_sha1(in_file)
-
-        with path.open('rb', buffering=8192) as in_file:
-            self.send_file_if_conditions_met(
-                in_file,
-                filename,
-                n_bytes=n_bytes,
-                skip_unhandled_extension=skip_unhandled_extension,
-                skip_duplicate=skip_duplicate,
-                metadata=metadata,
-                sha1=sha1
-            )
+        if skip_duplicate and etag is not None and self.manifest is not None:
+            sha1 = self.manifest.lookup_url(url, etag, n_bytes)
+
+        in_file = response
+        md5 = content_md5(response)
+        if md5 is not None or n_bytes is not None:
+            in_file = VerifyingReader(response, md5, n_bytes, url)
+
+        return response, in_file, n_bytes, etag, sha1, md5
+
+    def _spool_url(self, url, filename, in_file, etag):
+        """Download in_file into a temporary copy, and remember its sha1.
+
+        Return ``(spooled_file, n_bytes, sha1)``.
+
+        :raises ChecksumMismatchError: if the download is corrupt.
+        """
+        start = time.time()
+        spooled_file, n_bytes, sha1 = spool_file(in_file, self.read_size, self.spool_max_memory)
+        self.metrics.record(EventHashed, filename=filename, n_bytes=n_bytes, seconds=time.time() - start)
+        if etag is not None and self.manifest is not None:
+            self.manifest.record_url(url, etag, n_bytes, sha1)
+        return spooled_file, n_bytes, sha1
 
-    def send_file_if_conditions_met(self, in_file, filename, n_bytes=None, skip_unhandled_extension=True, skip_duplicate=True, metadata=None, sha1=None):
+    def send_file_if_conditions_met(self, in_file, filename, n_bytes=None, skip_unhandled_extension=True, skip_duplicate=True, metadata=None, sha1=None, journal_key=None):
         """Upload a file to the Overview server.
 
         If ``n_bytes is None or (skip_duplicate == True and sha1 is None)``,
-        then ``in_file`` will be cached in memory. Otherwise, it will be
-        streamed to the server, saving memory.
+        then ``in_file`` will be copied (in one pass) to a temporary file
+        that stays in memory up to ``spool_max_memory`` bytes. Otherwise, it
+        will be streamed to the server, saving memory and disk.
 
         :param io.BytesIO in_file: BytesIO containing the document.
         :param str filename: Filename to set in Overview.
         :param int n_bytes: Exact file size (or `None` to auto-calculate).
             Supply this and ``sha1`` (if applicable) to stream ``in_file`` to
-            the server instead of caching it in memory.
+            the server instead of copying it.
         :param bool skip_unhandled_extension: if ``True`` (the default), do not
             upload this file if Overview doesn't support its filename extension
             (for instance, ``".dbf"``).
@@ -164,49 +991,220 @@ class Upload:
             included in the check.
         :param dict metadata: Metadata to set on the document, or ``None``.
             The document set should have a metadata schema that corresponds to
-            this document's metadata (or you can set the schema later).
+            this document's metadata (or you can set the schema later). To
+            skip encoding it for every file, pass a ``str``: a JSON Object
+            encoded as ASCII, such as ``CsvRow.metadata_json``.
         :param str sha1: SHA1 hash:to use in ``skip_duplicate()`` check, or
             ``None`` to calculate on the fly. If you set this and ``n_bytes``,
-            this method will stream the file contents instead of caching them
-            in memory.
+            this method will stream the file contents instead of copying
+            them.
+        :param str journal_key: if the Upload has a journal, what identifies
+            this file across runs (for instance, its URL). If the journal
+            says it was already sent, skip it; otherwise, record it once
+            sent.
+        :return: what happened: ``ResultUploaded``, ``ResultDuplicate``,
+            ``ResultUnhandledExtension``, ``ResultAlreadySent``,
+            ``ResultFailed``, or (with a content_filter) ``ResultEmpty``,
+            ``ResultTooSmall``, ``ResultTooLarge`` or ``ResultDeniedType``.
         """
-        if skip_unhandled_extension:
-            # We go by filename, with a blacklist we know Overview doesn't handle (yet)
-            path, ext = os.path.splitext(filename)
-            if ext.lower() in ['.zip', '.msg', '.gif', '.jpg', '.png', '.tiff', '.tif', '.dbf']:
-                self.logger.info('Skipping %s, Overview does not handle this format', filename)
-                return
+        result = self._check_before_reading(filename, journal_key, skip_unhandled_extension)
+        if result is not None:
+            return result
+
+        result, in_file = self._check_content(in_file, filename, n_bytes)
+        if result is not None:
+            return result
+
+        return self._hash_and_send_file(in_file, filename, n_bytes, skip_duplicate, metadata, sha1, journal_key)
+
+    def _hash_and_send_file(self, in_file, filename, n_bytes, skip_duplicate, metadata, sha1, journal_key):
+        """Hash in_file (or copy it, if we must), then send it.
+
+        The journal, extension and content_filter must have passed it.
+        """
+        if skip_duplicate and sha1 is None and n_bytes is not None and _is_seekable(in_file):
+            # A seekable file (such as a local file) can be hashed and then
+            # rewound without copying it
+            position = in_file.tell()
+            start = time.time()
+            sha1 = hash_file(in_file, self.read_size)
+            self.metrics.record(EventHashed, filename=filename, n_bytes=n_bytes, seconds=time.time() - start)
+            in_file.seek(position)
+
+        spooled_file = None
+        size_was_unknown = n_bytes is None
+        if (skip_duplicate and sha1 is None) or n_bytes is None:
+            # Read in_file once, into a temporary copy we can send later. The
+            # copy stays in memory only if it's small.
+            start = time.time()
+            spooled_file, n_bytes, sha1 = spool_file(in_file, self.read_size, self.spool_max_memory)
+            self.metrics.record(EventHashed, filename=filename, n_bytes=n_bytes, seconds=time.time() - start)
+            in_file = spooled_file
+
+        try:
+            if size_was_unknown:
+                result = self._check_size(filename, n_bytes)
+                if result is not None:
+                    return result
+            return self._send_file(in_file, filename, n_bytes, skip_duplicate, metadata, sha1, journal_key)
+        finally:
+            if spooled_file is not None:
+                spooled_file.close()
+
+    def _send_file(self, in_file, filename, n_bytes, skip_duplicate, metadata, sha1, journal_key):
+        import requests.exceptions # loaded by now: our session uses it
 
         if skip_duplicate:
-            if sha1 is None:
-                # Cache in_file bytes in memory so we can read it twice: once in
-                # is_file_already_in_document_set(), and once below.
-                in_file = io.BytesIO(in_file.read())
-                sha1 = _calculate_sha1(in_file)
-                in_file.seek(0)
-
-            if self.is_file_already_in_document_set(in_file, sha1):
-                self.logger.info('Skipping %s, already on server', filename)
-                return
+            try:
+                is_duplicate = self.is_file_already_in_document_set(in_file, sha1)
+            except requests.exceptions.RequestException as err:
+                return self._fail(filename, err)
 
-        if n_bytes is None:
-            # Cache in_file bytes in memory so we can read it twice: once 
-            # here, once below
-            in_file = io.BytesIO(in_file.read())
-            n_bytes = in_file.getbuffer().nbytes
+            if is_duplicate:
+                return self._skip(ResultDuplicate, filename)
 
-        server_path = '/api/v1/files/{}'.format(uuid.uuid4())
+        file_uuid = uuid.uuid4()
+        server_path = '/api/v1/files/{}'.format(file_uuid)
         headers = {
-            'Content-Disposition': rfc6266.build_header(filename),
+            'Content-Disposition': _content_disposition(filename),
             'Content-Length': str(n_bytes),
         }
-        if metadata:
+        if isinstance(metadata, str):
+            headers['Overview-Document-Metadata-JSON'] = metadata # already encoded
+        elif metadata:
             headers['Overview-Document-Metadata-JSON'] = json.dumps(metadata, ensure_ascii=True)
 
         self.logger.info('Uploading %s…', filename)
-        r = self._request('POST', server_path, headers=headers, data=in_file)
-        r.raise_for_status()
-        self.n_uploaded += 1
+        start = time.time()
+        try:
+            n_bytes_sent = self._compress_and_post_file(server_path, headers, in_file, filename, n_bytes)
+        except requests.exceptions.RequestException as err:
+            return self._fail(filename, err)
+        self.metrics.record(EventUploaded, filename=filename, n_bytes=n_bytes, n_bytes_sent=n_bytes_sent, seconds=time.time() - start)
+
+        if self.journal is not None and journal_key is not None:
+            self.journal.record(journal_key, file_uuid, filename, sha1)
+        with self._lock:
+            self.n_uploaded += 1
+            if sha1 is not None:
+                self._sent_sha1s.add(sha1)
+        return ResultUploaded
+
+    def _compress_and_post_file(self, server_path, headers, in_file, filename, n_bytes):
+        """POST in_file, compressed if the compressor says it's worthwhile.
+
+        If the server rejects the compressed file with 415, send it as it is
+        and stop compressing. Return the number of bytes sent.
+        """
+        import requests.exceptions
+
+        if self.compressor is None:
+            self._post_file(server_path, headers, in_file, filename)
+            return n_bytes
+
+        compressed, in_file = self.compressor.compress(in_file, filename, n_bytes)
+        if compressed is None:
+            self._post_file(server_path, headers, in_file, filename)
+            return n_bytes
+
+        with compressed:
+            sent = False
+            if compressed.file is None:
+                self._post_file(server_path, headers, in_file, filename) # it wasn't worth it
+            else:
+                compressed_headers = dict(headers)
+                compressed_headers['Content-Encoding'] = compressed.encoding
+                compressed_headers['Content-Length'] = str(compressed.n_bytes_compressed)
+                try:
+                    self._post_file(server_path, compressed_headers, compressed.file, filename)
+                    sent = True
+                except requests.exceptions.HTTPError as err:
+                    if err.response is None or err.response.status_code != 415:
+                        raise
+                    if self.compressor.disable():
+                        self.logger.warning('Server does not accept %s-encoded uploads; sending files uncompressed', compressed.encoding)
+                    self._post_file(server_path, headers, compressed.open_original(in_file), filename)
+
+        self.metrics.record(EventCompressed, filename=filename, encoding=compressed.encoding, level=compressed.level, file_type=compressed.file_type, n_bytes=n_bytes, n_bytes_compressed=compressed.n_bytes_compressed, seconds=compressed.seconds, sent=sent)
+        return compressed.n_bytes_compressed if sent else n_bytes
+
+    def _post_file(self, server_path, headers, in_file, filename):
+        """POST in_file, trying up to max_attempts_per_file times.
+
+        We only retry if we can rewind in_file, and only after errors that
+        might go away: network errors, 408, 429 and 5xx. With a
+        concurrency_limiter, 429 and 503 responses are retried (up to its
+        max_overload_retries) once it lets us, without using up attempts.
+        """
+        import requests.exceptions
+
+        start = in_file.tell() if _is_seekable(in_file) else None
+
+        attempt = 1
+        n_overloaded = 0
+        while True:
+            try:
+                r = self._post_file_once(server_path, headers, in_file)
+                r.raise_for_status()
+                return
+            except requests.exceptions.RequestException as err:
+                response = getattr(err, 'response', None)
+                if (
+                    self.concurrency_limiter is not None
+                    and start is not None
+                    and response is not None
+                    and response.status_code in OverloadStatusCodes
+                    and n_overloaded < self.concurrency_limiter.max_overload_retries
+                ):
+                    # The limiter has backed off; it will make us wait
+                    n_overloaded += 1
+                    self.logger.info('Server is overloaded (%d); will retry %s', response.status_code, filename)
+                    in_file.seek(start)
+                    continue
+
+                is_permanent = response is not None and 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+                if attempt == self.max_attempts_per_file or start is None or is_permanent:
+                    raise
+
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                self.logger.warning('Failed to upload %s (%s); retrying in %.1fs', filename, err, delay)
+                time.sleep(delay)
+                in_file.seek(start)
+                attempt += 1
+
+    def _post_file_once(self, server_path, headers, in_file):
+        # Retries can't rewind a stream: they'd send what's left of it
+        # (nothing) under the full Content-Length
+        request = self._request_file if _is_seekable(in_file) else self._request_stream
+        # requests sends an empty file as "Transfer-Encoding: chunked", and
+        # then sends it unchunked (because of our Content-Length): the server
+        # waits for a chunk that never comes. Empty bytes it sends properly.
+        data = b'' if headers.get('Content-Length') == '0' else in_file
+
+        limiter = self.concurrency_limiter
+        if limiter is None:
+            return request('POST', server_path, headers=headers, data=data)
+
+        started = limiter.acquire()
+        r = None
+        try:
+            r = request('POST', server_path, headers=headers, data=data)
+            return r
+        finally:
+            if r is None:
+                limiter.release(started, 0, None) # network error
+            else:
+                limiter.release(started, int(headers.get('Content-Length', 0)), r.status_code, r.headers.get('Retry-After'))
+
+    def _fail(self, filename, err):
+        """Log err and return ResultFailed, or raise if we shouldn't skip."""
+        self.metrics.record(EventFailed, filename=filename, error=str(err))
+        if not self.skip_failed_files:
+            raise err
+        self.logger.error('Failed to upload %s: %s', filename, err)
+        with self._lock:
+            self.failed_files.append((filename, str(err)))
+        return ResultFailed
 
     def is_file_already_in_document_set(self, in_file, sha1=None):
         """Return True iff the document set contains an identical file.
@@ -221,17 +1219,91 @@ class Upload:
             will be read completely.
         """
         if sha1 is None:
-            sha1 = _calculate_sha1(in_file)
+            sha1 = hash_file(in_file, self.read_size)
 
+        return self._is_sha1_in_document_set(sha1)
+
+    def _is_sha1_in_document_set(self, sha1):
+        with self._lock:
+            is_known = None
+            if sha1 in self.known_sha1s:
+                is_known = True
+            elif self.known_sha1s_complete or sha1 in self.absent_sha1s:
+                is_known = False
+            if is_known is not None:
+                self.n_duplicate_checks_local += 1
+
+        if is_known is not None:
+            self.metrics.record(EventDuplicateCheck, sha1=sha1, source='local', seconds=0.0)
+            return is_known
+
+        start = time.time()
         r = self._request('HEAD', '/api/v1/document-sets/files/{}'.format(sha1))
+        self.metrics.record(EventDuplicateCheck, sha1=sha1, source='server', seconds=time.time() - start)
+
+        with self._lock:
+            self.n_duplicate_checks_remote += 1
 
         if r.status_code == 204:
+            with self._lock:
+                self.known_sha1s.add(sha1)
             return True
         elif r.status_code == 404:
             return False
         else:
             r.raise_for_status()
 
+    def check_sha1s(self, sha1s, window=DefaultDuplicateCheckWindow):
+        """Return the set of ``sha1s`` the document set already contains.
+
+        Sends up to ``window`` requests at once (give ``Upload`` a
+        ``pool_size`` at least this big). Later checks for any of these sha1s
+        are answered locally, until ``finish()``.
+
+        :param iterable sha1s: hex SHA1 hashes to check.
+        :param int window: maximum number of simultaneous requests.
+        """
+        def check(sha1):
+            return sha1, self._is_sha1_in_document_set(sha1)
+
+        found = set()
+        for sha1, is_found in _map_concurrently(check, sha1s, window):
+            if is_found:
+                found.add(sha1)
+            else:
+                with self._lock:
+                    self.absent_sha1s.add(sha1)
+        return found
+
+    def preload_known_sha1s(self, sha1s, complete=False):
+        """Remember that the document set contains files with these hashes.
+
+        ``is_file_already_in_document_set()`` will answer ``True`` for these
+        without asking the server.
+
+        :param iterable sha1s: hex SHA1 hashes of files in the document set.
+        :param bool complete: if ``True``, these are *all* the files in the
+            document set, so any other sha1 can be answered ``False`` without
+            asking the server either.
+        """
+        with self._lock:
+            self.known_sha1s.update(sha1.strip().lower() for sha1 in sha1s)
+            if complete:
+                self.known_sha1s_complete = True
+
+    def load_known_sha1s_file(self, path, complete=False):
+        """Call ``preload_known_sha1s()`` with the hashes listed in a file.
+
+        :param str path: text file with one hex SHA1 hash per line. Blank
+            lines and lines starting with ``#`` are ignored.
+        :param bool complete: see ``preload_known_sha1s()``.
+        """
+        with open(path, encoding='utf-8') as f:
+            self.preload_known_sha1s(
+                (line for line in f if line.strip() and not line.startswith('#')),
+                complete=complete
+            )
+
     def finish(self, lang='en', ocr=True, split_by_page=False):
         """Adds sent files to the document set.
 
@@ -244,7 +1316,15 @@ class Upload:
             LibreOffice-compatible documents.) If ``False`` (the default), tell
             Overview to create one document per uploaded file.
         """
-        if self.n_uploaded == 0:
+        if self.n_duplicate_checks_local or self.n_duplicate_checks_remote:
+            self.logger.info(
+                'Duplicate checks: %d answered locally, %d sent to server',
+                self.n_duplicate_checks_local,
+                self.n_duplicate_checks_remote
+            )
+
+        n_uploaded = self.n_uploaded - self._n_uploaded_at_finish
+        if n_uploaded == 0:
             self.logger.info('No files uploaded')
             return
 
@@ -256,8 +1336,19 @@ class Upload:
             'split_documents': split_by_page,
         })
         r.raise_for_status()
+        if self.manifest is not None:
+            self.manifest.mark_sent_as_uploaded(self._take_sent_paths())
+        if self.journal is not None:
+            self.journal.clear()
+        with self._lock:
+            # the document set has the new files now
+            self.absent_sha1s.clear()
+            self.known_sha1s.update(self._sent_sha1s)
+            self._sent_sha1s.clear()
+            # the next finish() only counts files sent after this one
+            self._n_uploaded_at_finish += n_uploaded
         self.logger.info(
             'Finished uploading %d file(s). Browse to %s/documentsets to watch progress',
-            self.n_uploaded,
+            n_uploaded,
             self.server_url
         )
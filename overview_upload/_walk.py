@@ -0,0 +1,132 @@
+import fnmatch
+import logging
+import os
+import pathlib
+from overview_upload._metrics import EventSkipped
+
+def _matches(patterns, relative_path, name):
+    """Return True if any glob pattern matches.
+
+    A pattern containing ``/`` is matched against the path relative to the
+    top directory (with ``/`` separators); other patterns are matched against
+    the bare name.
+    """
+    for pattern in patterns:
+        if fnmatch.fnmatch(relative_path if '/' in pattern else name, pattern):
+            return True
+    return False
+
+def walk_directory(dirname, include=None, exclude=None, max_size=None, on_skip=None):
+    """Yield (path, filename, stat_result) for every non-hidden file in dirname.
+
+    ``filename`` is the path relative to ``dirname``: the name Overview shows.
+
+    This is a generator: it yields files as it finds them, so the caller can
+    start uploading right away. It stats each file once and never descends
+    into hidden (or excluded) directories. It does not follow symlinks to
+    directories, and it skips directories it cannot read (or that vanish
+    while it walks).
+
+    :param str dirname: Directory to walk.
+    :param list include: glob patterns (such as ``"*.pdf"`` or
+        ``"reports/*.doc"``): if set, only yield files that match one.
+    :param list exclude: glob patterns of files and directories to skip.
+    :param int max_size: if set, skip files larger than this many bytes.
+    :param function on_skip: if set, called as ``on_skip(filename, reason)``
+        for each skipped file or directory. ``reason`` is ``"hidden"``,
+        ``"excluded"``, ``"too_large"`` or (for a directory)
+        ``"unreadable"``. (Files inside a skipped directory are not
+        reported.)
+    """
+    include = list(include or [])
+    exclude = list(exclude or [])
+    if on_skip is None:
+        on_skip = lambda filename, reason: None
+
+    # (directory path, its path relative to dirname with "/" separators)
+    stack = [ (str(dirname), '') ]
+    while stack:
+        directory, relative_directory = stack.pop()
+
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as err:
+            if not relative_directory and not isinstance(err, PermissionError):
+                raise # dirname itself is missing: the caller's mistake
+            # Not ours to read, deleted while we walked, or an I/O error
+            on_skip(relative_directory.rstrip('/').replace('/', os.sep) or str(dirname), 'unreadable')
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            relative_path = relative_directory + entry.name
+
+            # Don't upload hidden files (e.g., ".DS_Store" on Mac OS)
+            if entry.name[0] == '.':
+                on_skip(relative_path.replace('/', os.sep), 'hidden')
+                continue
+
+            if exclude and _matches(exclude, relative_path, entry.name):
+                on_skip(relative_path.replace('/', os.sep), 'excluded')
+                continue
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append((entry.path, relative_path + '/'))
+                    continue
+
+                if not entry.is_file():
+                    continue
+
+                stat_result = entry.stat()
+            except OSError:
+                continue # deleted while we walked, or a broken symlink
+
+            filename = relative_path.replace('/', os.sep) # visible on the server
+            if include and not _matches(include, relative_path, entry.name):
+                on_skip(filename, 'excluded')
+                continue
+            if max_size is not None and stat_result.st_size > max_size:
+                on_skip(filename, 'too_large')
+                continue
+
+            path = pathlib.Path(entry.path)
+            yield path, filename, stat_result
+
+        # Pop subdirectories in the order scandir listed them
+        stack.extend(reversed(subdirectories))
+
+def _log_walk_skip(logger, metrics, filename, reason):
+    """Log and count a file (or directory) skipped before it was opened."""
+    level = logging.WARNING if reason in ('encrypted', 'unreadable') else logging.DEBUG
+    logger.log(level, 'Skipping %s, %s', filename, reason.replace('_', ' '))
+    metrics.record(EventSkipped, filename=filename, reason=reason)
+
+def _iter_directory(dirname, include, exclude, max_size, expand_archives, on_skip, partition=None):
+    """Yield (path, filename, stat_result, None) for files to upload.
+
+    The ``None`` is the sha1, which we haven't calculated yet.
+
+    With ``expand_archives``, archives pass ``include`` and ``max_size``:
+    those filter the files inside them. With ``partition``, files in other
+    partitions are left out (silently: other processes will send them).
+    """
+    if not expand_archives:
+        files = walk_directory(dirname, include=include, exclude=exclude, max_size=max_size, on_skip=on_skip)
+    else:
+        # tarfile and zipfile take a while to import: wait until we need them
+        from overview_upload._archive import is_archive
+        files = walk_directory(dirname, exclude=exclude, on_skip=on_skip)
+
+    for path, filename, stat_result in files:
+        if partition is not None and not partition.contains_path(filename):
+            continue
+        if expand_archives and not is_archive(filename):
+            if include and not _matches(include, filename.replace(os.sep, '/'), path.name):
+                on_skip(filename, 'excluded')
+                continue
+            if max_size is not None and stat_result.st_size > max_size:
+                on_skip(filename, 'too_large')
+                continue
+        yield path, filename, stat_result, None
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from overview_upload._results import ResultUploaded, ResultFailed
+from overview_upload._upload import _map_concurrently
+from overview_upload._walk import walk_directory
+
+DefaultBatchSize = 100
+DefaultBatchSeconds = 60.0
+
+def _is_inside(path, dirname):
+    """Return True if path is dirname or below it, following symlinks."""
+    path = os.path.realpath(str(path))
+    dirname = os.path.realpath(str(dirname))
+    return os.path.commonpath([ path, dirname ]) == dirname
+
+class DropDirectoryWatcher:
+    """Uploads files as they land in a directory, for as long as it runs.
+
+    One process, one ``Upload``: its connections stay open, so each new file
+    costs a few requests, not an interpreter start and a TLS handshake.
+
+    Every ``poll_interval`` seconds, the watcher lists the directory (the
+    way ``walk_directory()`` does, so hidden files are ignored: write a file
+    under a hidden name and rename it when it's complete). A file is sent
+    once its size and mtime haven't changed for ``settle_seconds``, so files
+    being copied in aren't sent half-written. A file that changes after it
+    was handled is handled again.
+
+    Overview only adds files to the document set on ``Upload.finish()``. The
+    watcher calls it once ``batch_size`` files are sent, or
+    ``batch_seconds`` after the first of them, whichever comes first; and
+    on ``close()``.
+
+    With ``done_dirname``, each file is moved there (at the same relative
+    path) once it is in the document set, or as soon as it's skipped. If
+    the watcher stops before a batch is finished, its files are still in the
+    drop directory: call ``Upload.resume_or_clear_previous_upload()`` (or
+    ``clear_previous_upload()``) before ``run()``, and they are sent again.
+    Files that fail stay where they are, and are tried again when they
+    change or the watcher restarts.
+
+    :param Upload upload: where to send files.
+    :param str dirname: the drop directory.
+    :param int batch_size: finish after this many files are sent.
+    :param float batch_seconds: finish this many seconds after the first
+        file of a batch is sent.
+    :param float poll_interval: seconds between looks at the directory.
+    :param float settle_seconds: seconds a file must stay unchanged before
+        it is sent.
+    :param str done_dirname: where to move handled files, or ``None`` to
+        leave them (and remember them, until the watcher stops).
+    :param int concurrency: number of files to send at once.
+    :param list include: see ``walk_directory()``.
+    :param list exclude: see ``walk_directory()``.
+    :param int max_size: see ``walk_directory()``.
+    :param dict send_kwargs: passed on to
+        ``Upload.send_path_if_conditions_met()``: for instance,
+        ``skip_duplicate``.
+    :param dict finish_kwargs: passed on to ``Upload.finish()``: ``lang``,
+        ``ocr`` and ``split_by_page``.
+    :raises ValueError: if ``done_dirname`` is inside ``dirname``: the
+        watcher would send the files it moved there all over again.
+    """
+
+    def __init__(self, upload, dirname, batch_size=DefaultBatchSize, batch_seconds=DefaultBatchSeconds, poll_interval=1.0, settle_seconds=2.0, done_dirname=None, concurrency=1, include=None, exclude=None, max_size=None, send_kwargs=None, finish_kwargs=None):
+        if done_dirname is not None and _is_inside(done_dirname, dirname):
+            raise ValueError('The done directory, {}, must not be inside the watched directory, {}'.format(done_dirname, dirname))
+        self.upload = upload
+        self.dirname = dirname
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.done_dirname = done_dirname
+        self.concurrency = concurrency
+        self.include = include
+        self.exclude = exclude
+        self.max_size = max_size
+        self.send_kwargs = send_kwargs or {}
+        self.finish_kwargs = finish_kwargs or {}
+        self.n_batches = 0
+        self._changing = {} # path => (size, mtime_ns, first seen unchanged at)
+        self._handled = {} # path => (size, mtime_ns): sent, skipped or failed
+        self._batch = [] # (path, filename) sent since the last finish()
+        self._batch_started_at = None
+        self._stop_event = threading.Event()
+
+    def _settled_files(self, now):
+        """List (path, filename, stat_result) for files ready to send."""
+        ready = []
+        present = set()
+        for path, filename, stat_result in walk_directory(self.dirname, include=self.include, exclude=self.exclude, max_size=self.max_size):
+            present.add(path)
+            signature = (stat_result.st_size, stat_result.st_mtime_ns)
+            if self._handled.get(path) == signature:
+                continue
+            changing = self._changing.get(path)
+            if changing is None or changing[:2] != signature:
+                self._changing[path] = signature + (now,)
+                if self.settle_seconds > 0:
+                    continue
+            elif now - changing[2] < self.settle_seconds:
+                continue
+            del self._changing[path]
+            ready.append((path, filename, stat_result))
+
+        # Forget files that were deleted (or moved away)
+        for paths in (self._changing, self._handled):
+            for path in [ path for path in paths if path not in present ]:
+                del paths[path]
+        return ready
+
+    def _send(self, item):
+        path, filename, stat_result = item
+        try:
+            result = self.upload.send_path_if_conditions_met(path, filename, stat_result=stat_result, **self.send_kwargs)
+        except FileNotFoundError:
+            return item, None # deleted before we could send it
+        return item, result
+
+    def _move_to_done_dir(self, path, filename):
+        if self.done_dirname is None:
+            return
+        destination = os.path.join(self.done_dirname, filename)
+        try:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(str(path), destination)
+        except OSError as err:
+            self.upload.logger.warning('Could not move %s to %s: %s', path, destination, err)
+
+    def poll(self):
+        """Send the files that have landed since the last call, and finish
+        the batch if it's due.
+
+        :return: the number of files sent (or skipped, or failed).
+        """
+        now = time.time()
+        ready = self._settled_files(now)
+        n_handled = 0
+        for (path, filename, stat_result), result in _map_concurrently(self._send, ready, max(self.concurrency, 1)):
+            if result is None:
+                continue
+            n_handled += 1
+            self._handled[path] = (stat_result.st_size, stat_result.st_mtime_ns)
+            if result == ResultUploaded:
+                if not self._batch:
+                    self._batch_started_at = time.time()
+                self._batch.append((path, filename))
+            elif result != ResultFailed:
+                self._move_to_done_dir(path, filename) # skipped: it won't be sent
+
+        if self._batch and (len(self._batch) >= self.batch_size or time.time() - self._batch_started_at >= self.batch_seconds):
+            self.finish()
+        return n_handled
+
+    def finish(self):
+        """Add the files sent since the last call to the document set."""
+        if not self._batch:
+            return
+        self.upload.finish(**self.finish_kwargs)
+        self.n_batches += 1
+        self.upload.logger.info('Finished a batch of %d file(s)', len(self._batch))
+        for path, filename in self._batch:
+            self._move_to_done_dir(path, filename)
+        self._batch = []
+        self._batch_started_at = None
+
+    def run(self):
+        """Watch the directory until ``stop()`` is called."""
+        while not self._stop_event.is_set():
+            self.poll()
+            self._stop_event.wait(self.poll_interval)
+
+    def stop(self):
+        """Make ``run()`` return after the current poll. Any thread (or a
+        signal handler) may call this."""
+        self._stop_event.set()
+
+    def close(self):
+        """Finish the last batch."""
+        self.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -17,13 +17,17 @@ setup(
         'requests>=2.17.3',
         'rfc6266>=0.0.4',
     ],
+    extras_require={
+        'zstd': [ 'zstandard' ],
+    },
+    python_requires='>=3.7',
     packages=[ 'overview_upload' ],
-    scripts=[ 'overview-create-document-set', 'overview-upload', 'overview-upload-csv' ],
+    scripts=[ 'overview-create-document-set', 'overview-upload', 'overview-upload-csv', 'overview-upload-manifest' ],
     classifiers=(
         'License :: OSI Approved :: GNU Affero General Public License v3',
         'Intended Audience :: Developers',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     )
 )
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_overview import FakeOverviewServer
+
+@pytest.fixture
+def server():
+    """A FakeOverviewServer, running until the test ends."""
+    with FakeOverviewServer() as server:
+        yield server
+
+@pytest.fixture
+def corpus(tmp_path):
+    """A directory of five small text files, named f0.txt to f4.txt."""
+    dirname = tmp_path / 'corpus'
+    dirname.mkdir()
+    for i in range(5):
+        (dirname / 'f{}.txt'.format(i)).write_text('file {}\n'.format(i) * (i + 1))
+    return dirname
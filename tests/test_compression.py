@@ -0,0 +1,60 @@
+import hashlib
+import io
+from overview_upload import Upload, Compressor, ResultUploaded
+
+# Compressible, and bigger than Compressor's min_size
+Text = ('All work and no play makes Jack a dull boy.\n' * 500).encode('utf-8')
+
+class NonSeekableFile:
+    """A stream that can't be rewound, like a relayed download."""
+
+    def __init__(self, data):
+        self._in_file = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._in_file.read(size)
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+def send(upload, in_file, filename):
+    return upload.send_file_if_conditions_met(in_file, filename, n_bytes=len(Text), skip_duplicate=False)
+
+def test_compressed_upload_keeps_the_original_sha1(server):
+    server.accept_encodings = frozenset([ 'gzip' ])
+    compressor = Compressor('gzip')
+    with Upload(server.url, 'token', compressor=compressor) as upload:
+        assert send(upload, io.BytesIO(Text), 'a.txt') == ResultUploaded
+    counters = server.counters()
+    assert counters['n_bytes_decoded'] == len(Text)
+    assert counters['n_bytes_received'] < len(Text) / 10
+    assert server.pending_sha1s == set([ sha1(Text) ])
+    assert compressor.enabled
+
+def test_small_files_are_sent_as_they_are(server):
+    compressor = Compressor('gzip')
+    with Upload(server.url, 'token', compressor=compressor) as upload:
+        upload.send_file_if_conditions_met(io.BytesIO(b'tiny'), 'a.txt', n_bytes=4, skip_duplicate=False)
+    counters = server.counters()
+    assert counters['n_files_unsupported'] == 0
+    assert counters['n_bytes_received'] == 4
+
+def test_415_sends_the_file_uncompressed_and_disables_compression(server):
+    compressor = Compressor('gzip')
+    with Upload(server.url, 'token', compressor=compressor) as upload:
+        assert send(upload, io.BytesIO(Text), 'a.txt') == ResultUploaded
+        assert not compressor.enabled
+        assert send(upload, io.BytesIO(Text), 'b.txt') == ResultUploaded
+    counters = server.counters()
+    assert counters['n_files_unsupported'] == 1 # only the first file tried
+    assert counters['n_bytes_received'] == 2 * len(Text)
+    assert server.pending_sha1s == set([ sha1(Text) ])
+
+def test_415_decompresses_a_file_that_cannot_be_rewound(server):
+    compressor = Compressor('gzip')
+    with Upload(server.url, 'token', compressor=compressor) as upload:
+        assert send(upload, NonSeekableFile(Text), 'a.txt') == ResultUploaded
+    counters = server.counters()
+    assert counters['n_files_unsupported'] == 1
+    assert counters['n_bytes_received'] == len(Text)
+    assert server.pending_sha1s == set([ sha1(Text) ])
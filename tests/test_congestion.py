@@ -0,0 +1,54 @@
+import time
+from overview_upload import Upload, ConcurrencyLimiter, ResultUploaded
+from overview_upload._congestion import parse_retry_after
+
+def test_parse_retry_after():
+    assert parse_retry_after('2') == 2.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:05 GMT', now=1445412480) == 5.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+def test_limit_grows_by_about_one_per_round():
+    limiter = ConcurrencyLimiter(initial_limit=2, latency_tolerance=None)
+    for _ in range(2 + 4): # a round of 2 uploads, then a round of (about) 3
+        limiter.release(limiter.acquire(), 1000, 200)
+    assert limiter.limit == 4
+
+def test_overload_halves_the_limit_once_per_burst():
+    limiter = ConcurrencyLimiter(initial_limit=8, latency_tolerance=None)
+    starts = [ limiter.acquire() for _ in range(8) ]
+    for started in starts:
+        limiter.release(started, 1000, 503, '0')
+    assert limiter.limit == 4 # not 1: they were all in flight at once
+    assert (limiter.n_overloaded, limiter.n_decreases) == (8, 1)
+
+def test_retry_after_pauses_new_uploads():
+    limiter = ConcurrencyLimiter(initial_limit=4)
+    limiter.release(limiter.acquire(), 1000, 429, '0.3')
+    start = time.monotonic()
+    limiter.release(limiter.acquire(), 1000, 200)
+    assert time.monotonic() - start >= 0.25
+
+def test_network_error_decreases_without_pausing():
+    limiter = ConcurrencyLimiter(initial_limit=4)
+    limiter.release(limiter.acquire(), 0, None)
+    assert limiter.limit == 2
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+def test_upload_backs_off_an_overloaded_server(server, corpus):
+    server.max_concurrent_uploads = 2
+    server.latency = 0.05
+    limiter = ConcurrencyLimiter(initial_limit=8, max_limit=8)
+    with Upload(server.url, 'token', pool_size=8, concurrency_limiter=limiter) as upload:
+        upload.send_directory(str(corpus), skip_duplicate=False, concurrency=8)
+        assert upload.n_uploaded == 5
+
+    assert server.counters()['n_files_rejected'] > 0 # the 503s reached the limiter
+    assert limiter.n_overloaded == server.counters()['n_files_rejected']
+    assert limiter.n_decreases >= 1
+    assert limiter.limit < 8
+    assert limiter.n_in_flight == 0
+    assert len(server.pending_sha1s) == 5
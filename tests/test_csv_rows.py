@@ -0,0 +1,81 @@
+import json
+import pathlib
+import pytest
+from overview_upload import Upload, Pipeline, PathJob, CsvRows, ResultUploaded
+
+def write_csv(tmp_path, text):
+    path = tmp_path / 'files.csv'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+Schema = { 'version': 1, 'fields': [ { 'name': 'author', 'type': 'String' } ] }
+
+def test_validate_reports_every_invalid_row(tmp_path):
+    path = write_csv(tmp_path, '\n'.join([
+        'path,title,author',
+        'a.txt,A,Alice',
+        'b.txt,B', # too few values
+        ' ,C,Carol', # blank path
+        'd.txt,,Dan', # blank title
+        '',
+        'e.txt,E,"Eve, ""the"" spy"',
+    ]) + '\n')
+    rows = CsvRows(path, 'path', title_field='title', metadata_schema=Schema)
+    invalid_rows, n_invalid, n_valid = rows.validate()
+    assert invalid_rows == [
+        (2, 'expected 3 values, got 2'),
+        (3, 'missing value for path'),
+        (4, 'missing value for title'),
+    ]
+    assert (n_invalid, n_valid) == (3, 2)
+
+    valid = [ row for chunk in rows.iter_chunks() for row in chunk ]
+    assert [ (row.line_number, row.value, row.title) for row in valid ] == [ (1, 'a.txt', 'A'), (6, 'e.txt', 'E') ]
+    assert json.loads(valid[1].metadata_json) == { 'author': 'Eve, "the" spy' }
+
+def test_validate_stops_collecting_at_max_errors(tmp_path):
+    path = write_csv(tmp_path, 'path\n' + 'x,y\n' * 5 + 'ok.txt\n')
+    invalid_rows, n_invalid, n_valid = CsvRows(path, 'path').validate(max_errors=2)
+    assert [ line_number for line_number, _ in invalid_rows ] == [ 1, 2 ]
+    assert (n_invalid, n_valid) == (5, 1)
+
+@pytest.mark.parametrize('url,message', [
+    ('https://example.com/a.pdf', None),
+    ('ftp://example.com/a.pdf', '"ftp://example.com/a.pdf" does not start with http: or https:'),
+    ('https:///a.pdf', '"https:///a.pdf" does not include a network location'),
+    ('http://[::1/a.pdf', '"http://[::1/a.pdf" is not a valid URL'),
+])
+def test_validate_checks_urls(tmp_path, url, message):
+    path = write_csv(tmp_path, 'url\n{}\n'.format(url))
+    invalid_rows, _, _ = CsvRows(path, 'url', urls=True).validate()
+    assert invalid_rows == ([] if message is None else [ (1, message) ])
+
+def test_missing_columns_are_an_error(tmp_path):
+    path = write_csv(tmp_path, 'path,title\na.txt,A\n')
+    with pytest.raises(ValueError, match='`name`'):
+        CsvRows(path, 'path', title_field='name')
+    with pytest.raises(ValueError, match='author'):
+        CsvRows(path, 'path', metadata_schema=Schema)
+
+def test_without_a_schema_every_column_is_metadata(tmp_path):
+    path = write_csv(tmp_path, 'path,title,author\na.txt,A,Alice\n')
+    row = next(CsvRows(path, 'path').iter_chunks())[0]
+    assert json.loads(row.metadata_json) == { 'path': 'a.txt', 'title': 'A', 'author': 'Alice' }
+
+def test_only_valid_rows_are_uploaded(server, corpus, tmp_path):
+    lines = [ 'path,title' ]
+    lines += [ '{},doc {}'.format(corpus / 'f{}.txt'.format(i), i) for i in range(5) ]
+    lines += [ ',no path', '{},'.format(corpus / 'f0.txt') ]
+    rows = CsvRows(write_csv(tmp_path, '\n'.join(lines) + '\n'), 'path', title_field='title', chunk_size=2)
+    assert rows.validate()[1:] == (2, 5)
+
+    with Upload(server.url, 'token') as upload:
+        with Pipeline(upload, skip_duplicate=False) as pipeline:
+            for chunk in rows.iter_chunks():
+                assert len(chunk) <= 2
+                for row in chunk:
+                    pipeline.submit(PathJob(pathlib.Path(row.value), row.title, metadata=row.metadata_json))
+            pipeline.drain()
+
+    assert pipeline.results == { ResultUploaded: 5 }
+    assert len(server.pending_sha1s) == 5
@@ -0,0 +1,18 @@
+import pytest
+import requests
+from overview_upload import create_document_set, create_session
+
+def n_document_set_posts(server):
+    return server.counters()['requests'].get('POST /api/v1/document-sets', 0)
+
+def test_create_document_set(server):
+    response = create_document_set(server.url, 'token', 'Title')
+    assert response['apiToken']['token'] == 'token-1'
+
+@pytest.mark.parametrize('shared_session', [ False, True ])
+def test_create_document_set_is_not_retried_after_a_5xx(server, shared_session):
+    server.fail_document_sets = 1 # the server created it, then the gateway gave up
+    with create_session() as session:
+        with pytest.raises(requests.exceptions.HTTPError):
+            create_document_set(server.url, 'token', 'Title', session=session if shared_session else None)
+    assert n_document_set_posts(server) == 1
@@ -0,0 +1,68 @@
+import pytest
+from overview_upload import Upload, ContentFilter, build_content_filter, sniff_type, ResultUploaded, ResultDeniedType, ResultEmpty, ResultTooLarge
+
+Pdf = b'%PDF-1.4\n' + b'x' * 100
+Png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+
+@pytest.mark.parametrize('head,file_type', [
+    (Pdf, 'pdf'),
+    (b'junk\n%PDF-1.7', 'pdf'),
+    (Png, 'png'),
+    (b'PK\x03\x04' + b'\x00' * 22 + b'\x13\x00\x00\x00' + b'[Content_Types].xml', 'ooxml'),
+    (b'PK\x03\x04' + b'\x00' * 22 + b'\x05\x00\x00\x00' + b'a.txt', 'zip'),
+    (b'\xef\xbb\xbf<!DOCTYPE html><p>Hi', 'html'),
+    (b'<?xml version="1.0"?>', 'xml'),
+    ('café'.encode('utf-8')[:-1], 'text'), # cut off mid-character
+    (b'\xff\xfeh\x00i\x00', 'text'),
+    (b'\x00\x01\x02', 'unknown'),
+])
+def test_sniff_type(head, file_type):
+    assert sniff_type(head) == file_type
+
+@pytest.fixture
+def mislabeled(tmp_path):
+    """Files whose extensions don't say what they are."""
+    dirname = tmp_path / 'mislabeled'
+    dirname.mkdir()
+    (dirname / 'report.txt').write_bytes(Pdf)
+    (dirname / 'scan.pdf').write_bytes(Png)
+    (dirname / 'notes.doc').write_bytes(b'plain text')
+    (dirname / 'empty.txt').write_bytes(b'')
+    return dirname
+
+def send_all(server, dirname, content_filter):
+    results = {}
+    with Upload(server.url, 'token', content_filter=content_filter) as upload:
+        for path in sorted(dirname.iterdir()):
+            results[path.name] = upload.send_path_if_conditions_met(path, path.name, skip_duplicate=False)
+    return results
+
+def test_sniffing_skips_denied_types_whatever_their_extension(server, mislabeled):
+    content_filter = build_content_filter(sniff_content=True, skip_empty=True)
+    assert send_all(server, mislabeled, content_filter) == {
+        'empty.txt': ResultEmpty,
+        'notes.doc': ResultUploaded,
+        'report.txt': ResultUploaded,
+        'scan.pdf': ResultDeniedType,
+    }
+    assert server.counters()['n_bytes_received'] == len(Pdf) + len(b'plain text') # sniffing lost no bytes
+
+def test_allow_types_sends_only_those_types(server, mislabeled):
+    content_filter = build_content_filter(allow_types=[ 'pdf' ])
+    results = send_all(server, mislabeled, content_filter)
+    assert results['report.txt'] == ResultUploaded
+    assert results['notes.doc'] == ResultDeniedType
+    assert results['scan.pdf'] == ResultDeniedType
+
+def test_max_size_skips_large_files_before_reading_them(server, mislabeled):
+    content_filter = ContentFilter(deny_types=(), max_size=50)
+    results = send_all(server, mislabeled, content_filter)
+    assert results['report.txt'] == ResultTooLarge
+    assert results['notes.doc'] == ResultUploaded
+
+def test_no_options_means_no_filter():
+    assert build_content_filter() is None
+
+def test_unknown_type_is_an_error():
+    with pytest.raises(ValueError):
+        ContentFilter(deny_types=[ 'bogus' ])
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+RepoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def modules_loaded_by(code):
+    output = subprocess.check_output([ sys.executable, '-c', code + '\nimport sys\nprint("\\n".join(sys.modules))' ], cwd=RepoDir)
+    return set(output.decode('utf-8').split())
+
+def test_upload_loads_only_what_every_upload_needs():
+    modules = modules_loaded_by('import overview_upload\noverview_upload.Upload')
+    for name in ('requests', 'urllib.request', 'sqlite3', 'tarfile', 'overview_upload._manifest', 'overview_upload._archive', 'overview_upload._pipeline', 'overview_upload._plan'):
+        assert name not in modules
@@ -0,0 +1,45 @@
+import json
+from overview_upload import UploadJournal
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read().split('\n')
+
+def test_resume_reads_entries(tmp_path):
+    path = str(tmp_path / 'journal')
+    with UploadJournal(path) as journal:
+        journal.record('/a', 'uuid-a', 'a.pdf', 'sha1-a')
+        journal.record('/b', 'uuid-b', 'b.pdf', None)
+
+    with UploadJournal(path) as journal:
+        assert len(journal) == 2
+        assert '/a' in journal
+        assert journal.entries['/b'].filename == 'b.pdf'
+
+def test_resume_after_torn_last_line(tmp_path):
+    path = str(tmp_path / 'journal')
+    with UploadJournal(path) as journal:
+        journal.record('/a', 'uuid-a', 'a.pdf', 'sha1-a')
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "/b", "uuid": "uu') # the crash
+
+    with UploadJournal(path) as journal:
+        assert list(journal.entries) == [ '/a' ]
+        journal.record('/c', 'uuid-c', 'c.pdf', 'sha1-c')
+
+    # The entry recorded after the crash must survive another restart
+    with UploadJournal(path) as journal:
+        assert list(journal.entries) == [ '/a', '/c' ]
+    lines = read_lines(path)
+    assert lines[-1] == ''
+    assert [ json.loads(line)['key'] for line in lines[:-1] ] == [ '/a', '/c' ]
+
+def test_clear(tmp_path):
+    path = str(tmp_path / 'journal')
+    with UploadJournal(path) as journal:
+        journal.record('/a', 'uuid-a', 'a.pdf', 'sha1-a')
+        journal.clear()
+        journal.record('/b', 'uuid-b', 'b.pdf', 'sha1-b')
+
+    with UploadJournal(path) as journal:
+        assert list(journal.entries) == [ '/b' ]
@@ -0,0 +1,29 @@
+from overview_upload import Manifest
+
+def test_record_hash_keeps_the_status_of_an_unchanged_file(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    with Manifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        manifest.record_status(path, path.stat(), 'sha1-a', Manifest.StatusUploaded)
+        manifest.record_hash(path, path.stat(), 'sha1-a')
+        assert manifest.lookup(path, path.stat()).status == Manifest.StatusUploaded
+
+def test_record_hash_forgets_the_status_of_a_changed_file(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    with Manifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        manifest.record_status(path, path.stat(), 'sha1-a', Manifest.StatusUploaded)
+        path.write_text('changed')
+        manifest.record_hash(path, path.stat(), 'sha1-b')
+        entry = manifest.lookup(path, path.stat())
+        assert (entry.sha1, entry.status) == ('sha1-b', None)
+        assert len(manifest.entries()) == 1
+
+def test_record_hash_of_a_new_file(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    with Manifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        manifest.record_hash(path, path.stat(), 'sha1-a')
+    with Manifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        entry = manifest.lookup(path, path.stat())
+        assert (entry.sha1, entry.status) == ('sha1-a', None)
@@ -0,0 +1,78 @@
+import os
+import textwrap
+import threading
+import pytest
+from overview_upload import Upload, Partition, Coordination, run_partitions
+
+RepoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_partitions_split_files_between_them():
+    filenames = [ 'dir/f{}.txt'.format(i) for i in range(100) ]
+    partitions = [ Partition(number, 3) for number in (1, 2, 3) ]
+    owners = [ [ p.number for p in partitions if p.contains_path(filename) ] for filename in filenames ]
+    assert all(len(numbers) == 1 for numbers in owners)
+    assert set(number for numbers in owners for number in numbers) == { 1, 2, 3 }
+
+def test_coordinator_finishes_after_every_part(server, corpus, tmp_path):
+    dirname = str(tmp_path / 'coordination')
+    errors = []
+
+    def run_part(number):
+        partition = Partition(number, 3)
+        coordination = Coordination(dirname, partition, poll_interval=0.05)
+        try:
+            with Upload(server.url, 'token') as upload:
+                if partition.is_coordinator:
+                    upload.clear_previous_upload()
+                coordination.start(timeout=10)
+                upload.send_directory(str(corpus), partition=partition)
+                if not partition.is_coordinator:
+                    coordination.report_done(upload.n_uploaded, len(upload.failed_files))
+                    return
+                reports = coordination.wait_for_workers(timeout=10)
+                upload.n_uploaded += sum(report['n_uploaded'] for report in reports)
+                upload.finish()
+                coordination.mark_finished()
+        except Exception as err:
+            errors.append(err)
+
+    # Workers first: they must wait for the coordinator to clear
+    threads = [ threading.Thread(target=run_part, args=(number,)) for number in (3, 2, 1) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(server.document_set_sha1s) == 5
+    assert server.counters()['requests']['POST /api/v1/files/finish'] == 1
+
+def test_wait_for_workers_times_out(tmp_path):
+    coordination = Coordination(str(tmp_path), Partition(1, 2), poll_interval=0.05)
+    coordination.start()
+    with pytest.raises(TimeoutError):
+        coordination.wait_for_workers(timeout=0.2)
+
+def test_run_partitions_reports_a_worker_that_died(tmp_path):
+    script = tmp_path / 'part.py'
+    script.write_text(textwrap.dedent('''
+        import os, sys
+        sys.path.insert(0, {!r})
+        from overview_upload import Coordination, Partition
+        partition = Partition.parse(sys.argv[sys.argv.index('--partition') + 1])
+        coordination = Coordination(sys.argv[sys.argv.index('--coordination-dir') + 1], partition, poll_interval=0.05)
+        coordination.start()
+        if partition.is_coordinator:
+            reports = coordination.wait_for_workers(timeout=30)
+            sys.exit(1 if any(report['error'] for report in reports) else 0)
+        elif partition.number == 2:
+            os._exit(3) # crash without reporting
+        coordination.report_done(1, 0)
+    ''').format(RepoDir))
+
+    status = run_partitions([ str(script) ], 3, str(tmp_path / 'coordination'), poll_interval=0.05)
+
+    assert status == 3
+    coordination = Coordination(str(tmp_path / 'coordination'), Partition(1, 3))
+    assert coordination.read_report(2)['error'] == 'exited with status 3 without reporting'
+    assert coordination.read_report(3)['error'] is None
@@ -0,0 +1,37 @@
+import pytest
+from overview_upload import Upload, Pipeline, PathJob, ResultUploaded, ResultFailed, ResultCancelled
+
+class BrokenHashJob(PathJob):
+    """A PathJob whose hash stage raises."""
+
+    def hash(self, pipeline):
+        raise RuntimeError('disk on fire')
+
+def test_stage_error_fails_only_its_job(server, corpus):
+    finished = []
+    with Upload(server.url, 'token') as upload:
+        with Pipeline(upload, fetch_workers=2, hash_workers=2, upload_workers=2, stop_on_error=False, on_result=finished.append) as pipeline:
+            pipeline.submit(BrokenHashJob(corpus / 'f0.txt', 'f0.txt'))
+            for i in range(1, 5):
+                pipeline.submit(PathJob(corpus / 'f{}.txt'.format(i), 'f{}.txt'.format(i)))
+            pipeline.drain()
+
+    assert pipeline.results == { ResultUploaded: 4, ResultFailed: 1 }
+    broken = [ job for job in finished if job.filename == 'f0.txt' ][0]
+    assert broken.result == ResultFailed
+    assert str(broken.error) == 'disk on fire'
+    assert len(server.pending_sha1s) == 4
+
+def test_stage_error_stops_the_pipeline(server, corpus):
+    with Upload(server.url, 'token') as upload:
+        with Pipeline(upload, fetch_workers=1, hash_workers=1, upload_workers=1) as pipeline:
+            pipeline.submit(BrokenHashJob(corpus / 'f0.txt', 'f0.txt'))
+            with pytest.raises(RuntimeError, match='disk on fire'):
+                pipeline.drain()
+            with pytest.raises(RuntimeError, match='disk on fire'):
+                pipeline.submit(PathJob(corpus / 'f1.txt', 'f1.txt'))
+
+    assert pipeline.results[ResultFailed] == 1
+    assert ResultUploaded not in pipeline.results
+    assert ResultCancelled not in pipeline.results # nothing was in flight
+    assert len(server.pending_sha1s) == 0
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import pytest
+from overview_upload import Upload, Pipeline, iter_plan_jobs, read_plan_summary, ResultDuplicate, ResultUploaded
+
+def mark_in_document_set(server, path):
+    server.document_set_sha1s.add(hashlib.sha1(path.read_bytes()).hexdigest())
+
+def test_plan_directory_sends_nothing(server, corpus):
+    mark_in_document_set(server, corpus / 'f0.txt')
+    (corpus / '.hidden.txt').write_text('hidden')
+    with Upload(server.url, 'token') as upload:
+        with upload.plan_directory(str(corpus), concurrency=2) as plan:
+            summary = plan.summary()
+
+    assert summary['files_to_upload'] == 4
+    assert summary['bytes_to_upload'] == sum((corpus / 'f{}.txt'.format(i)).stat().st_size for i in range(1, 5))
+    assert summary['files_skipped'] == { ResultDuplicate: 1, 'hidden': 1 }
+    assert summary['duplicate_ratio'] == 0.2
+    assert summary['estimated_seconds'] is None # not calibrated
+    assert 'POST /api/v1/files/{uuid}' not in server.counters()['requests']
+
+def test_written_plan_uploads_exactly_its_files(server, corpus, tmp_path):
+    mark_in_document_set(server, corpus / 'f0.txt')
+    plan_path = str(tmp_path / 'plan.jsonl')
+    with Upload(server.url, 'token') as upload:
+        with upload.plan_directory(str(corpus)) as plan:
+            plan.write(plan_path)
+
+    (corpus / 'f5.txt').write_text('added after planning')
+    (corpus / 'f4.txt').write_text('changed after planning')
+    assert read_plan_summary(plan_path)['files_to_upload'] == 4
+
+    with Upload(server.url, 'token') as upload:
+        with Pipeline(upload) as pipeline:
+            for job in iter_plan_jobs(plan_path):
+                pipeline.submit(job)
+            pipeline.drain()
+
+    assert pipeline.results == { ResultUploaded: 4 }
+    # f4.txt changed, so it was hashed again rather than trusting the plan
+    assert hashlib.sha1(b'changed after planning').hexdigest() in server.pending_sha1s
+    assert len(server.pending_sha1s) == 4
+
+def test_read_plan_summary_rejects_other_files(tmp_path):
+    path = tmp_path / 'not-a-plan.jsonl'
+    path.write_text(json.dumps({ 'version': 999 }) + '\n')
+    with pytest.raises(ValueError):
+        read_plan_summary(str(path))
+
+def test_calibrate_deletes_its_throwaway_files(server, corpus):
+    with Upload(server.url, 'token') as upload:
+        calibration = upload.calibrate(concurrency=2, n_files=3, n_bytes_per_file=10000)
+        with upload.plan_directory(str(corpus), skip_duplicate=False) as plan:
+            plan.calibration = calibration
+            summary = plan.summary()
+
+    assert calibration['concurrency'] == 2
+    assert calibration['files_per_second'] > 0
+    assert calibration['bytes_per_second'] > 0
+    assert summary['estimated_seconds'] > 0
+    assert server.counters()['requests']['POST /api/v1/files/{uuid}'] == 6
+    assert len(server.pending_sha1s) == 0
+    assert len(server.document_set_sha1s) == 0
@@ -0,0 +1,62 @@
+import os
+import pytest
+from overview_upload import Upload, ShardedUpload, ShardCounter, shard_by_subdirectory, shard_title, ResultUploaded
+
+@pytest.fixture
+def tree(tmp_path):
+    """Two subdirectories and a top-level file."""
+    dirname = tmp_path / 'tree'
+    for name, n_files in (('inbox', 3), ('sent', 2)):
+        (dirname / name).mkdir(parents=True)
+        for i in range(n_files):
+            (dirname / name / 'm{}.txt'.format(i)).write_text('{} {}'.format(name, i))
+    (dirname / 'top.txt').write_text('top')
+    return dirname
+
+def test_shard_title():
+    assert shard_title('Mail {shard}', 'inbox') == 'Mail inbox'
+    assert shard_title('Mail', 'inbox') == 'Mail inbox'
+    assert shard_title('Mail {shard}', '') == 'Mail'
+
+def test_shard_by_subdirectory():
+    assert shard_by_subdirectory(os.path.join('inbox', 'a', 'm.txt')) == 'inbox'
+    assert shard_by_subdirectory('top.txt') == ''
+
+def test_shard_counter_numbers_shards_of_max_files():
+    counter = ShardCounter(2)
+    assert [ counter() for _ in range(5) ] == [ '1', '1', '2', '2', '3' ]
+    assert [ counter('A') for _ in range(3) ] == [ 'A 1', 'A 1', 'A 2' ]
+    with pytest.raises(ValueError):
+        ShardCounter(0)
+
+def test_sharded_upload_sends_each_shard_to_its_own_document_set(server, tree):
+    created = []
+
+    def create_upload(shard, metrics):
+        # Each document set's token is its shard; the fake server doesn't care
+        created.append(shard)
+        return Upload(server.url, 'token-{}'.format(shard), metrics=metrics)
+
+    with ShardedUpload(create_upload, upload_workers=2, skip_duplicate=False) as sharded:
+        sharded.send_directory(str(tree), shard_by_subdirectory)
+        sharded.drain()
+        sharded.finish()
+
+    assert sorted(created) == [ '', 'inbox', 'sent' ]
+    assert dict((shard, dict(results)) for shard, results in sharded.results.items()) == {
+        '': { ResultUploaded: 1 },
+        'inbox': { ResultUploaded: 3 },
+        'sent': { ResultUploaded: 2 },
+    }
+    assert [ upload.n_uploaded for upload in sharded.uploads.values() ] == [ sharded.results[shard][ResultUploaded] for shard in sharded.uploads ]
+    assert sharded.metrics.counters[('files_total', (('result', ResultUploaded),))] == 6 # shared by every shard
+    assert server.counters()['requests']['POST /api/v1/files/finish'] == 3
+    assert len(server.document_set_sha1s) == 6
+    assert '(top level): 1 uploaded' in sharded.summary()
+
+def test_sharded_upload_splits_by_file_count(server, tree):
+    counter = ShardCounter(2)
+    with ShardedUpload(lambda shard, metrics: Upload(server.url, 'token', metrics=metrics), upload_workers=1, skip_duplicate=False) as sharded:
+        sharded.send_directory(str(tree), lambda filename: counter())
+        sharded.drain()
+    assert dict((shard, results[ResultUploaded]) for shard, results in sharded.results.items()) == { '1': 2, '2': 2, '3': 2 }
@@ -0,0 +1,194 @@
+import asyncio
+import io
+import pytest
+import requests
+from overview_upload import AsyncUpload, Upload, UploadJournal, Manifest, ResultUploaded, ResultFailed, ResultUnchanged, ResultAlreadySent
+
+class NonSeekableFile:
+    """A stream that can't be rewound, like a relayed download."""
+
+    def __init__(self, data):
+        self._in_file = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._in_file.read(size)
+
+def n_file_posts(server):
+    return server.counters()['requests'].get('POST /api/v1/files/{uuid}', 0)
+
+def record_skips(upload):
+    reasons = []
+    upload.add_observer(lambda event, data: reasons.append(data['reason']) if event == 'skipped' else None)
+    return reasons
+
+def test_5xx_is_retried_for_a_seekable_body(server):
+    server.fail_uploads = 1
+    with Upload(server.url, 'token') as upload:
+        result = upload.send_file_if_conditions_met(io.BytesIO(b'hello'), 'a.txt', n_bytes=5, skip_duplicate=False)
+    assert result == ResultUploaded
+    assert n_file_posts(server) == 2
+    assert len(server.pending_sha1s) == 1
+
+def test_5xx_is_not_retried_for_a_non_seekable_body(server):
+    server.fail_uploads = 1
+    with Upload(server.url, 'token', skip_failed_files=True) as upload:
+        result = upload.send_file_if_conditions_met(NonSeekableFile(b'hello'), 'a.txt', n_bytes=5, skip_duplicate=False)
+        assert result == ResultFailed
+        assert n_file_posts(server) == 1 # a retry would send an empty body
+
+        # The session still works, and still retries what it can rewind
+        server.reset()
+        server.fail_uploads = 1
+        result = upload.send_file_if_conditions_met(io.BytesIO(b'hello'), 'a.txt', n_bytes=5, skip_duplicate=False)
+    assert result == ResultUploaded
+    assert n_file_posts(server) == 2
+
+def test_finish_is_not_retried_after_a_5xx(server, corpus):
+    server.fail_finishes = 1 # the server added the files, then the gateway gave up
+    with Upload(server.url, 'token') as upload:
+        upload.send_directory(str(corpus))
+        with pytest.raises(requests.exceptions.HTTPError):
+            upload.finish()
+    assert server.counters()['requests']['POST /api/v1/files/finish'] == 1
+
+def test_journal_resume_skips_files_sent_before_a_crash(server, corpus, tmp_path):
+    journal_path = str(tmp_path / 'journal')
+    with UploadJournal(journal_path) as journal, Upload(server.url, 'token', journal=journal) as upload:
+        upload.resume_or_clear_previous_upload()
+        for name in ('f0.txt', 'f1.txt'):
+            assert upload.send_path_if_conditions_met(corpus / name, name) == ResultUploaded
+        # ... and crash, before finish()
+
+    with UploadJournal(journal_path) as journal, Upload(server.url, 'token', journal=journal) as upload:
+        skips = record_skips(upload)
+        upload.resume_or_clear_previous_upload()
+        upload.send_directory(str(corpus))
+        assert upload.n_uploaded == 5
+        upload.finish()
+        assert len(journal) == 0
+
+    assert skips == [ ResultAlreadySent ] * 2
+    assert n_file_posts(server) == 5
+    assert len(server.document_set_sha1s) == 5
+
+def test_manifest_skips_unchanged_files_on_the_next_run(server, corpus, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+    with Manifest(manifest_path) as manifest, Upload(server.url, 'token', manifest=manifest) as upload:
+        upload.clear_previous_upload()
+        upload.send_directory(str(corpus), incremental=True)
+        upload.finish()
+        assert manifest.count_by_status() == { Manifest.StatusUploaded: 5 }
+
+    (corpus / 'f4.txt').write_text('changed\n')
+    server.reset()
+    with Manifest(manifest_path) as manifest, Upload(server.url, 'token', manifest=manifest) as upload:
+        skips = record_skips(upload)
+        upload.send_directory(str(corpus), incremental=True)
+
+    assert skips == [ ResultUnchanged ] * 4
+    assert server.counters()['requests'] == {
+        'HEAD /api/v1/document-sets/files/{sha1}': 1, # only f4.txt
+        'POST /api/v1/files/{uuid}': 1,
+    }
+
+def test_finish_twice_does_not_finish_again(server, corpus):
+    with Upload(server.url, 'token') as upload:
+        upload.send_directory(str(corpus))
+        upload.finish()
+        upload.finish() # nothing new was sent
+        assert upload.n_uploaded == 5 # it counts every file, finished or not
+    assert server.counters()['requests']['POST /api/v1/files/finish'] == 1
+
+def send_async(upload, i):
+    data = 'async file {}'.format(i).encode('utf-8')
+    return upload.send_file(io.BytesIO(data), 'f{}.txt'.format(i), n_bytes=len(data), skip_duplicate=False)
+
+def test_async_spawn_waits_while_max_pending_tasks_are_outstanding(server):
+    server.latency = 0.05
+
+    async def run():
+        async with AsyncUpload(server.url, 'token', max_concurrency=2, max_pending=3) as upload:
+            tasks = []
+            n_outstanding = []
+            for i in range(10):
+                tasks.append(await upload.spawn(send_async(upload, i)))
+                n_outstanding.append(sum(1 for task in tasks if not task.done()))
+            await upload.finish()
+            return n_outstanding, [ task.result() for task in tasks ], upload.n_uploaded
+
+    n_outstanding, results, n_uploaded = asyncio.run(run())
+    assert max(n_outstanding) == 3
+    assert results == [ ResultUploaded ] * 10
+    assert n_uploaded == 10
+    assert len(server.document_set_sha1s) == 10
+    assert server.counters()['requests']['POST /api/v1/files/finish'] == 1
+
+def test_async_join_raises_the_error_of_a_spawned_task(server):
+    async def fail():
+        raise RuntimeError('boom')
+
+    async def run():
+        async with AsyncUpload(server.url, 'token') as upload:
+            await upload.spawn(send_async(upload, 0))
+            await upload.spawn(fail())
+            with pytest.raises(RuntimeError, match='boom'):
+                await upload.join()
+            await upload.join() # the error was reported once
+            with pytest.raises(RuntimeError):
+                await upload.spawn(fail())
+                await upload.finish()
+            return upload.n_uploaded
+
+    assert asyncio.run(run()) == 1
+    assert len(server.document_set_sha1s) == 0 # finish() did not finish
+
+def test_async_aclose_cancels_outstanding_tasks(server):
+    server.latency = 0.2
+
+    async def run():
+        upload = AsyncUpload(server.url, 'token', max_concurrency=1, max_pending=10)
+        tasks = [ await upload.spawn(send_async(upload, i)) for i in range(5) ]
+        await asyncio.sleep(0.05) # the first file is sending
+        await upload.aclose()
+        return tasks, upload.n_uploaded
+
+    tasks, n_uploaded = asyncio.run(run())
+    assert all(task.done() for task in tasks)
+    assert sum(1 for task in tasks if task.cancelled()) >= 4
+    # The file that was already sending finished in the background, and counts
+    assert n_uploaded == len(server.pending_sha1s) == 1
+
+def test_async_cancel_stops_spawned_tasks(server):
+    server.latency = 0.2
+
+    async def run():
+        async with AsyncUpload(server.url, 'token', max_concurrency=1, max_pending=10) as upload:
+            tasks = [ await upload.spawn(send_async(upload, i)) for i in range(5) ]
+            upload.cancel()
+            await upload.join() # cancelled tasks are not errors
+            return tasks
+
+    tasks = asyncio.run(run())
+    assert all(task.cancelled() for task in tasks)
+    assert len(server.pending_sha1s) == 0
+
+def test_async_upload_works_across_event_loops(server):
+    upload = AsyncUpload(server.url, 'token', max_concurrency=2)
+
+    async def send(start):
+        await asyncio.gather(*[ send_async(upload, i) for i in range(start, start + 3) ])
+        await upload.finish()
+
+    asyncio.run(send(0))
+    asyncio.run(send(3))
+    asyncio.run(upload.aclose())
+    assert upload.n_uploaded == 6
+    assert len(server.document_set_sha1s) == 6
+
+def test_empty_file_is_sent(server, tmp_path):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    with Upload(server.url, 'token') as upload:
+        assert upload.send_path_if_conditions_met(path, 'empty.txt', skip_duplicate=False) == ResultUploaded
+        assert upload.send_file_if_conditions_met(NonSeekableFile(b''), 'empty2.txt', n_bytes=0, skip_duplicate=False) == ResultUploaded
+    assert server.counters()['n_files_received'] == 2
@@ -0,0 +1,40 @@
+import errno
+import os
+import pytest
+from overview_upload import walk_directory
+
+def walk(dirname):
+    skips = []
+    filenames = [ filename for _, filename, _ in walk_directory(str(dirname), on_skip=lambda filename, reason: skips.append((filename, reason))) ]
+    return sorted(filenames), skips
+
+def break_scandir(monkeypatch, broken_path, error):
+    scandir = os.scandir
+    def broken_scandir(path):
+        if os.path.realpath(path) == os.path.realpath(str(broken_path)):
+            raise error
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', broken_scandir)
+
+@pytest.mark.parametrize('error', [
+    FileNotFoundError(errno.ENOENT, 'vanished'),
+    NotADirectoryError(errno.ENOTDIR, 'replaced by a file'),
+    OSError(errno.EIO, 'I/O error'),
+    PermissionError(errno.EACCES, 'not ours'),
+])
+def test_unreadable_directory_is_skipped(tmp_path, monkeypatch, error):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'x.txt').write_text('x')
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'b' / 'y.txt').write_text('y')
+    (tmp_path / 'z.txt').write_text('z')
+    break_scandir(monkeypatch, tmp_path / 'a', error)
+
+    filenames, skips = walk(tmp_path)
+
+    assert filenames == [ os.path.join('b', 'y.txt'), 'z.txt' ]
+    assert skips == [ ('a', 'unreadable') ]
+
+def test_missing_directory_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        walk(tmp_path / 'nope')
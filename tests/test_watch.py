@@ -0,0 +1,40 @@
+import pytest
+from overview_upload import Upload, DropDirectoryWatcher
+
+def test_watcher_sends_files_and_moves_them_once_finished(server, corpus, tmp_path):
+    done = tmp_path / 'done'
+    with Upload(server.url, 'token') as upload:
+        with DropDirectoryWatcher(upload, str(corpus), settle_seconds=0, done_dirname=str(done)) as watcher:
+            assert watcher.poll() == 5
+            assert len(server.pending_sha1s) == 5
+            assert not done.exists() # not finished yet
+            (corpus / 'f5.txt').write_text('late')
+            assert watcher.poll() == 1
+    assert watcher.n_batches == 1
+    assert len(server.document_set_sha1s) == 6
+    assert list(corpus.iterdir()) == []
+    assert sorted(p.name for p in done.iterdir()) == [ 'f{}.txt'.format(i) for i in range(6) ]
+
+def test_watcher_waits_for_files_to_settle(server, corpus):
+    with Upload(server.url, 'token') as upload:
+        watcher = DropDirectoryWatcher(upload, str(corpus), settle_seconds=60)
+        assert watcher.poll() == 0
+        assert len(server.pending_sha1s) == 0
+
+def test_watcher_finishes_a_full_batch(server, corpus):
+    with Upload(server.url, 'token') as upload:
+        watcher = DropDirectoryWatcher(upload, str(corpus), settle_seconds=0, batch_size=5)
+        watcher.poll()
+        assert watcher.n_batches == 1
+        assert len(server.document_set_sha1s) == 5
+        assert watcher.poll() == 0 # handled files aren't sent again
+
+@pytest.mark.parametrize('subdir', [ '', 'done', 'a/done' ])
+def test_watcher_rejects_a_done_dir_inside_the_drop_dir(server, corpus, subdir):
+    with Upload(server.url, 'token') as upload:
+        with pytest.raises(ValueError):
+            DropDirectoryWatcher(upload, str(corpus), done_dirname=str(corpus / subdir))
+
+def test_watcher_accepts_a_done_dir_beside_the_drop_dir(server, corpus, tmp_path):
+    with Upload(server.url, 'token') as upload:
+        DropDirectoryWatcher(upload, str(corpus), done_dirname=str(tmp_path / 'corpus-done'))